@@ -0,0 +1,68 @@
+from contextlib import contextmanager, ExitStack
+
+from glowingmeme.build_data.hybrid_executor import HybridExecutor
+
+
+class BuildContext:
+    """
+    What the builders of a single build share. Every builder of a build is given the same context, and a new context
+    is created for every build, so that nothing set up for one build leaks into the next one.
+    """
+
+    def __init__(
+        self,
+        stage_hooks=(),
+        slow_call_logger=None,
+        request_hedger=None,
+        http_transport=None,
+        hybrid_executor=None,
+        request_caches=None,
+        shared_clients=None,
+    ):
+        """
+        :param stage_hooks: objects with a stage(stage_name) context manager (e.g. a StageProfiler) that wrap every
+        stage of the build
+        :param slow_call_logger: optional SlowCallLogger logging the upstream calls slower than its threshold
+        :param request_hedger: optional HedgedRequests enforcing per-call deadlines and hedging slow reads
+        :param http_transport: optional HttpTransport whose connection pools the clients of the build use. It is not
+        closed with the context, so that the pools can outlive the build, e.g. for the clients shared by every build
+        of a long running service
+        :param hybrid_executor: HybridExecutor fetching and decoding the CVA variants and CIPAPI cases of the build,
+        whose worker processes are stopped with the context. A new one by default
+        :param request_caches: optional dictionary of service -> RequestCache of the records fetched by previous
+        builds, e.g. by the earlier builds of a long running service. Like the http_transport, the caches outlive the
+        context. Within a single build every record is only fetched once, so services without a cache aren't memoized
+        :param shared_clients: optional dictionary of client name -> client shared by the builders of every build
+        given it, so that they only log in once. The clients found in it when a builder first uses them replace the
+        ones the builder would create. Every builder creates its own clients by default
+        """
+        self.stage_hooks = list(stage_hooks)
+        self.slow_call_logger = slow_call_logger
+        self.request_hedger = request_hedger
+        self.http_transport = http_transport
+        self.hybrid_executor = (
+            hybrid_executor if hybrid_executor is not None else HybridExecutor()
+        )
+        self.request_caches = request_caches if request_caches is not None else {}
+        self.shared_clients = shared_clients
+
+    def close(self):
+        """
+        Releases what the build started. The context can't be used for another build after this.
+        :return:
+        """
+        if self.request_hedger is not None:
+            self.request_hedger.close()
+        self.hybrid_executor.close()
+
+    @contextmanager
+    def stage(self, stage_name):
+        """
+        Context manager delimiting a stage of the build, e.g. the CVA enumeration or the export, for the stage hooks.
+        :param stage_name:
+        :return:
+        """
+        with ExitStack() as stage_stack:
+            for stage_hook in self.stage_hooks:
+                stage_stack.enter_context(stage_hook.stage(stage_name))
+            yield
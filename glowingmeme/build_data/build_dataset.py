@@ -1,16 +1,41 @@
 import csv
+import logging
+import threading
 from enum import Enum
 from abc import abstractmethod
 
 from glowingmeme.clients.clients import Clients
+from glowingmeme.clients.hedging import HedgedClient
+from glowingmeme.clients.raw_responses import CvaVariantBodyClient, CipapiCaseBodyClient
+from glowingmeme.clients.request_cache import RequestCache
+from glowingmeme.build_data.build_context import BuildContext
 from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+from glowingmeme.instrumentation.profiling import SlowCallClient
 
+logger = logging.getLogger("GlowingMeme")
 
 class ReportedOutcomeEnum(Enum):
     REPORTED = "reported"
     NOT_REPORTED = "not_reported"
 
 
+class _LazyClient:
+    """
+    Descriptor of a BuildDataset client attribute, which creates the client the first time it is used.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, build_dataset, owner):
+        if build_dataset is None:
+            return self
+        return build_dataset._get_client(self.name)
+
+    def __set__(self, build_dataset, client):
+        build_dataset._build_clients[self.name] = client
+
+
 class BuildDataset:
 
     _ALL = "ALL"
@@ -21,23 +46,54 @@ class BuildDataset:
     _PHAST_CONS = "phastCons"
     _GNOMAD_GENOMES = "GNOMAD_GENOMES"
 
-    def __init__(self):
+    CVA_SERVICE = "cva"
+    CIPAPI_SERVICE = "cipapi"
+    CELLBASE_SERVICE = "cellbase"
+
+    _CLIENTS_FACTORY = "clients_factory"
+
+    # Bounds of the request caches kept across builds, see create_request_caches. They only hold the compact records
+    # extracted from each response, a few values per variant, so they are sized for the records of a whole build:
+    # CVA variants and Cellbase annotations by variant, and CIPAPI cases by case.
+    _REQUEST_CACHE_SIZES = {
+        CVA_SERVICE: 2000000,
+        CIPAPI_SERVICE: 200000,
+        CELLBASE_SERVICE: 2000000,
+    }
+
+    # guards the clients shared by several builds through their BuildContext, see BuildContext.shared_clients
+    _shared_clients_lock = threading.RLock()
 
-        # predefining clients that will be used
-        self.cva_client = None
-        self.cipapi_client = None
-        self.cellbase_client = None
-        self.cva_cases_client = None
-        self.cva_variants_client = None
+    # clients are only created, and logged in to, the first time a stage uses them
+    cva_client = _LazyClient()
+    cipapi_client = _LazyClient()
+    cellbase_client = _LazyClient()
+    cellbase_variant_client = _LazyClient()
+    cva_cases_client = _LazyClient()
+    cva_variants_client = _LazyClient()
+    # the I/O threads of a build read CVA variants and CIPAPI cases as undecoded response bodies
+    cva_variant_body_client = _LazyClient()
+    cipapi_case_body_client = _LazyClient()
 
-        self.start_clients()
+    def __init__(self, build_context=None):
+        """
+        :param build_context: BuildContext shared by the builders of the build, a new one by default
+        """
+        self.build_context = build_context if build_context is not None else BuildContext()
+
+        if self.build_context.shared_clients is not None:
+            self._clients = self.build_context.shared_clients
+            self._clients_lock = self._shared_clients_lock
+        else:
+            self._clients = {}
+            self._clients_lock = threading.RLock()
 
         # IMPORTANT DESCRIPTION OF DATASET
         # The dataset IS composed of variants that are associated with a specific case. This means that the same
         # variant can appear multiple times along the dataset as long as it does not contain repeated information
         # and outcomes.
 
-        # this is a list of VariantEntryInfo objects
+        # this is a list of VariantEntryInfo objects, or a SQLiteDatasetStore when building in memory-bounded mode
         self.main_dataset = []
 
         # this helper can be redefined by which attribute need by calling _set_dataset_index_helper_by_attribute
@@ -45,6 +101,14 @@ class BuildDataset:
         # in these object, the original objects in the main_dataset will also change.
         self.dataset_index_helper = {}
 
+        # clients of this builder, wrapped with the request caches and call policies of its build. The upstream
+        # clients they wrap are kept in self._clients, which can be shared by several builds
+        self._build_clients = {}
+
+        # items (e.g. case ids) left without enrichment because their upstream call timed out, see
+        # skip_on_request_timeout
+        self.timed_out_items = []
+
     @abstractmethod
     def build_dataset(self):
         """
@@ -55,17 +119,169 @@ class BuildDataset:
 
     def start_clients(self):
         """
-        Start all the required clients.
+        Start all the required clients. Any client already started is dropped and started again on its next use.
+        :return:
+        """
+        with self._clients_lock:
+            self._clients.clear()
+            self._build_clients.clear()
+
+    def _get_client(self, name):
+        """
+        Returns the client with the given attribute name, wrapped for the build, creating it if this is its first use.
+        :param name:
+        :return:
+        """
+        client = self._build_clients.get(name)
+        if client is None:
+            with self._clients_lock:
+                client = self._build_clients.get(name)
+                if client is None:
+                    client = self._build_clients[name] = self._wrap_build_client(
+                        name, self._get_upstream_client(name)
+                    )
+        return client
+
+    def _get_upstream_client(self, name):
+        """
+        Returns the upstream client with the given attribute name, creating it if this is its first use.
+        :param name:
+        :return:
+        """
+        client = self._clients.get(name)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._clients[name] = self._create_client(name)
+        return client
+
+    def _create_client(self, name):
+        """
+        Creates the upstream client with the given attribute name.
+        :param name:
+        :return:
+        """
+        # the Clients factory reads the credentials file, so it is created once and kept with the clients it creates
+        clients = lambda: self._get_upstream_client(self._CLIENTS_FACTORY)
+        client_factories = {
+            self._CLIENTS_FACTORY: lambda: Clients(http_transport=self.build_context.http_transport),
+            "cva_client": lambda: clients().get_cva_client(),
+            "cipapi_client": lambda: clients().get_cipapi_client(),
+            "cellbase_client": lambda: clients().get_cellbase_client(),
+            "cellbase_variant_client": lambda: clients().get_cellbase_variant_client(),
+            "cva_cases_client": lambda: self._get_upstream_client("cva_client").cases(),
+            "cva_variants_client": lambda: self._get_upstream_client("cva_client").variants(),
+            "cva_variant_body_client": lambda: CvaVariantBodyClient(
+                self._get_upstream_client("cva_variants_client")
+            ),
+            "cipapi_case_body_client": lambda: CipapiCaseBodyClient(
+                self._get_upstream_client("cipapi_client")
+            ),
+        }
+        return client_factories[name]()
+
+    def _wrap_build_client(self, name, client):
+        """
+        Wraps an upstream client with the call policies and instrumentation of the build.
+        :param name: attribute name of the client
+        :param client:
+        :return:
+        """
+        client_wrappers = {
+            "cipapi_case_body_client": lambda: self._wrap_client(
+                client, self.CIPAPI_SERVICE, ["get_case_body"]
+            ),
+            "cellbase_client": lambda: self._instrument_client(
+                client, self.CELLBASE_SERVICE, ["search"]
+            ),
+            "cellbase_variant_client": lambda: self._instrument_client(
+                client, self.CELLBASE_SERVICE, ["get_annotation"]
+            ),
+            "cva_variant_body_client": lambda: self._wrap_client(
+                client, self.CVA_SERVICE, ["get_variant_body"]
+            ),
+        }
+        return client_wrappers.get(name, lambda: client)()
+
+    def _wrap_client(self, client, service, read_methods):
+        """
+        Wraps the given idempotent read methods of a client with the request hedger and the slow call logger, if
+        there are any.
+        :param client:
+        :param service:
+        :param read_methods:
+        :return:
+        """
+        request_hedger = self.build_context.request_hedger
+        if request_hedger is not None:
+            client = HedgedClient(client, request_hedger, service, read_methods)
+        return self._instrument_client(client, service, read_methods)
+
+    @classmethod
+    def create_request_caches(cls, max_age):
+        """
+        Creates the request caches of every service, to be given to the BuildContext of several builds so that each
+        build only fetches what the previous ones didn't, or what was fetched too long ago.
+        :param max_age: seconds after which a cached record is fetched again
+        :return: dictionary of service -> RequestCache
+        """
+        return {
+            service: RequestCache(max_size=max_size, max_age=max_age)
+            for service, max_size in cls._REQUEST_CACHE_SIZES.items()
+        }
+
+    def _get_request_cache(self, service):
+        """
+        Returns the request cache the build keeps the records of a service in, if it has one.
+        :param service:
+        :return: RequestCache or None
+        """
+        return self.build_context.request_caches.get(service)
+
+    def _get_many_or_fetch(self, service, keys, fetch_missing_function):
+        """
+        Returns the records of the given keys, from the request cache of the service for those it holds. The others
+        are fetched with a single call to fetch_missing_function(missing_keys).
+        :param service:
+        :param keys: list of hashable values
+        :param fetch_missing_function: function that takes a list of keys and returns a dictionary of key -> record
+        :return: dictionary of key -> record, where keys without a record are missing or None
+        """
+        request_cache = self._get_request_cache(service)
+        if request_cache is None:
+            return fetch_missing_function(keys)
+        return request_cache.get_many_or_fetch(keys, fetch_missing_function)
+
+    def _instrument_client(self, client, service, methods):
+        """
+        Wraps the given methods of a client with the slow call logger, if there is one. This is the outermost
+        wrapper, so calls are timed as long as the builder waited for them, hedges and retries included, and their
+        stack is the one of the builder thread that made them, rather than the one of a hedging thread.
+        :param client:
+        :param service:
+        :param methods:
         :return:
         """
-        (
-            self.cipapi_client,
-            self.cellbase_client,
-            self.cva_client,
-        ) = Clients().get_all_clients()
+        slow_call_logger = self.build_context.slow_call_logger
+        if slow_call_logger is None:
+            return client
+        return SlowCallClient(client, slow_call_logger, service, methods)
 
-        self.cva_cases_client = self.cva_client.cases()
-        self.cva_variants_client = self.cva_client.variants()
+    def _log_timed_out_items(self, item_name):
+        """
+        Logs the items left without enrichment because their upstream call timed out.
+        :param item_name: plural name of the items, e.g. "cases"
+        :return:
+        """
+        if self.timed_out_items:
+            logger.warning(
+                "{count} {item_name} were left without enrichment after timing out: {items}".format(
+                    count=len(self.timed_out_items),
+                    item_name=item_name,
+                    items=", ".join(map(str, self.timed_out_items)),
+                )
+            )
 
     def _set_dataset_index_helper_by_attribute(self, dataset_key):
         """
@@ -75,22 +291,66 @@ class BuildDataset:
         This dictionary is a reference to the original objects in the main_dataset list
         :return:
         """
+        self.dataset_index_helper = self._index_dataset_by_attribute(dataset_key)
+
+    def _index_dataset_by_attribute(self, dataset_key):
+        """
+        Returns an index of the main dataset by the given attribute: a dictionary of value -> list of entries, or the
+        index kept by a disk backed dataset store.
+        :param dataset_key:
+        :return:
+        """
+        # a disk backed dataset store keeps its own indexes, so there is nothing to build in memory
+        if hasattr(self.main_dataset, "index_by"):
+            return self.main_dataset.index_by(dataset_key)
+
         dataset_by_key = {}
-        if dataset_key in VariantEntryInfo.VARIANT_INFO_VALUES:
+        # entries can also be indexed by the values derived from their attributes, e.g. their coordinates
+        if hasattr(VariantEntryInfo, dataset_key):
             for variant_info_object in self.main_dataset:
                 new_key = getattr(variant_info_object, dataset_key)
                 if new_key in dataset_by_key:
                     dataset_by_key[new_key].append(variant_info_object)
                 else:
                     dataset_by_key[new_key] = [variant_info_object]
-        self.dataset_index_helper = dataset_by_key
+        return dataset_by_key
+
+    def _count_indexed_entries(self, key):
+        """
+        Returns the number of entries under a key of the dataset_index_helper, without loading them from a disk
+        backed dataset store.
+        :param key:
+        :return:
+        """
+        if hasattr(self.dataset_index_helper, "count"):
+            return self.dataset_index_helper.count(key)
+        return len(self.dataset_index_helper.get(key, []))
+
+    def _iter_indexed_entries(self, key, index=None):
+        """
+        Iterates over the entries under a key of an index, streaming them from a disk backed dataset store instead of
+        loading them all at once.
+        :param key:
+        :param index: index of the main dataset, the dataset_index_helper by default
+        :return:
+        """
+        if index is None:
+            index = self.dataset_index_helper
+        if hasattr(index, "iter_entries"):
+            return index.iter_entries(key)
+        return iter(index.get(key, []))
 
-    def save_data_to_csv(self, file_name):
+    def save_data_to_csv(self, file_name, variant_entries=None):
         """
         This method takes the main dataset that was created and saves it to a csv
         :param file_name:
-        :return:
+        :param variant_entries: optional subset of the main dataset to save instead
+        :return: number of entries saved
         """
+        if variant_entries is None:
+            variant_entries = self.main_dataset
+
+        rows = 0
         with open(file_name, "w") as variant_entries_file:
 
             variant_entries_csv = csv.writer(variant_entries_file, delimiter=",")
@@ -98,5 +358,7 @@ class BuildDataset:
             # we start by adding the header, which is always the variant_info_values from the object
             variant_entries_csv.writerow(VariantEntryInfo.VARIANT_INFO_VALUES)
 
-            for variant_entry in self.main_dataset:
+            for variant_entry in variant_entries:
                 variant_entries_csv.writerow(list(variant_entry))
+                rows += 1
+        return rows
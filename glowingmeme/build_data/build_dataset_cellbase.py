@@ -1,5 +1,6 @@
 import os
-from multiprocessing.dummy import Pool as ThreadPool
+import math
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from glowingmeme.clients.clients import renew_access_token
 from glowingmeme.build_data.build_dataset import BuildDataset
@@ -8,12 +9,20 @@ from glowingmeme.build_data.build_dataset import BuildDataset
 class BuildDatasetCellbase(BuildDataset):
 
     _POST = "post"
+    _CHROMOSOME = "chr"
     _SCORE = "score"
     _SOURCE = "source"
+    _RS_ID_KEY = "rs_id"
     _RESULT_FIELD = "result"
     _PHAST_CONS = "phastCons"
     _VARIANT_ID_SEPARATOR = ":"
+    _COORDINATES_KEY = "coordinates"
     _CELLBASE_QUERY_BATCH_SIZE = 200
+    # POST annotation calls carry the variants in the body, so they can be much bigger than the search ones
+    _CELLBASE_ANNOTATION_BATCH_SIZE = 1000
+    # batches waiting to be queried per thread. Batches are made while the keys of the dataset are streamed, so
+    # only these are in memory
+    _BATCHES_PER_THREAD = 2
 
     _CONSERVATION = "conservation"
     _FUNCTIONAL_SCORES = "functionalScore"
@@ -28,46 +37,122 @@ class BuildDatasetCellbase(BuildDataset):
         "annotation." + _VARIANT_TRAIT_ASSOCIATION,
     ]
 
-    def __init__(self, cipapi_built_dataset):
+    # the coordinates are needed to match each annotation to the variant it belongs to
+    _ANNOTATION_INCLUDE_LIST = [
+        "chromosome",
+        "start",
+        "reference",
+        "alternate",
+        _CONSERVATION,
+        _FUNCTIONAL_SCORES,
+        _VARIANT_TRAIT_ASSOCIATION,
+    ]
+
+    def __init__(self, cipapi_built_dataset, build_context=None):
         """
         This method takes in its precursor dataset, which is the one updated by the Cipapi Dataset builder.
         :param cipapi_built_dataset:
+        :param build_context: BuildContext shared by the builders of the build
         """
-        super().__init__()
+        super().__init__(build_context)
         self.main_dataset = cipapi_built_dataset
         self.dataset_index_helper = None
+        self.coordinate_index_helper = None
+        # number of Cellbase calls of the last annotation, kept for the build history
+        self.number_of_batches = 0
 
     def build_dataset(self):
         """
         This method starts updating the variant entries with Cellbase info.
         :return:
         """
-        self._set_dataset_index_helper_by_attribute("rs_id")
-        self._annotate_variation()
+        with self.build_context.stage("cellbase"):
+            self._set_dataset_index_helper_by_attribute("rs_id")
+            self._set_coordinate_index_helper()
+            self._annotate_variation()
+
+    def _set_coordinate_index_helper(self):
+        """
+        Variants without an rs_id can't be searched for in Cellbase, so we index them by their
+        assembly:chr:pos:ref:alt coordinates (as filled in by BuildDatasetCVA) in order to annotate them instead.
+        A disk backed dataset keeps this index in its store, like the others.
+        :return:
+        """
+        self.coordinate_index_helper = self._index_dataset_by_attribute("coordinates")
 
     def _annotate_variation(self):
         """
         We build batches of variants to query Cellbase with, so that we don't send too big of a request which
-        threatens to send the service down.
+        threatens to send the service down. Variants with an rs_id are searched for, and the remaining ones are
+        annotated by their coordinates in bigger POST batches, both in the same pool.
         :return:
         """
-
-        list_of_batches = []
-        variant_ids_to_query = [
-            variant_id for variant_id in self.dataset_index_helper.keys() if variant_id
-        ]
-        for list_chunk in range(
-            0, len(variant_ids_to_query), self._CELLBASE_QUERY_BATCH_SIZE
-        ):
-            list_of_batches.append(
-                variant_ids_to_query[
-                    list_chunk : list_chunk + self._CELLBASE_QUERY_BATCH_SIZE
-                ]
-            )
+        self.number_of_batches = 0
 
         # we are putting a hard cap of threads here to not overload Cellbase
-        pool = ThreadPool(os.cpu_count())
-        pool.map(self._call_cellbase_variation, list_of_batches)
+        max_workers = os.cpu_count()
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="Cellbase"
+        ) as executor:
+            batches_in_flight = set()
+            for call_cellbase, batch in self._iter_batches():
+                if len(batches_in_flight) >= max_workers * self._BATCHES_PER_THREAD:
+                    done, batches_in_flight = wait(
+                        batches_in_flight, return_when=FIRST_COMPLETED
+                    )
+                    for future in done:
+                        future.result()
+                batches_in_flight.add(executor.submit(call_cellbase, batch))
+                self.number_of_batches += 1
+
+            for future in batches_in_flight:
+                future.result()
+
+    def _iter_batches(self):
+        """
+        Yields the Cellbase calls annotating the dataset as (function, batch), while streaming the rs_ids and
+        coordinates of the dataset.
+        :return:
+        """
+        rs_ids = []
+        for rs_id in self.dataset_index_helper.keys():
+            if not rs_id:
+                continue
+            rs_ids.append(rs_id)
+            if len(rs_ids) >= self._CELLBASE_QUERY_BATCH_SIZE:
+                yield self._call_cellbase_variation, rs_ids
+                rs_ids = []
+        if rs_ids:
+            yield self._call_cellbase_variation, rs_ids
+
+        # coordinates are batched per assembly, since the assembly is a parameter of the annotation call
+        coordinates_by_assembly = {}
+        for coordinates in self.coordinate_index_helper.keys():
+            # variants CVA couldn't annotate have no coordinates to annotate them with
+            if coordinates is None:
+                continue
+            assembly = coordinates.split(self._VARIANT_ID_SEPARATOR, 1)[0]
+            coordinates_batch = coordinates_by_assembly.setdefault(assembly, [])
+            coordinates_batch.append(coordinates)
+            if len(coordinates_batch) >= self._CELLBASE_ANNOTATION_BATCH_SIZE:
+                yield self._call_cellbase_annotation, coordinates_by_assembly.pop(
+                    assembly
+                )
+        for coordinates_batch in coordinates_by_assembly.values():
+            yield self._call_cellbase_annotation, coordinates_batch
+
+    @classmethod
+    def get_number_of_batches(cls, number_of_rs_ids, number_of_coordinates):
+        """
+        Returns the number of Cellbase calls needed to annotate the given number of variants with and without rs_id,
+        as batched by _annotate_variation.
+        :param number_of_rs_ids:
+        :param number_of_coordinates:
+        :return:
+        """
+        return math.ceil(number_of_rs_ids / cls._CELLBASE_QUERY_BATCH_SIZE) + math.ceil(
+            number_of_coordinates / cls._CELLBASE_ANNOTATION_BATCH_SIZE
+        )
 
     @renew_access_token
     def _call_cellbase_variation(self, variant_ids_to_query):
@@ -81,45 +166,157 @@ class BuildDatasetCellbase(BuildDataset):
         # since we're querying with rs_ids we are able to get relevant information for our build38 variant in a
         # build37 search in Cellbase (since there is more information available at the time)
 
+        # rs_ids annotated by a previous build, or being annotated by another thread, are not queried again
+        annotation_values_by_rs_id = self._get_many_or_fetch(
+            self.CELLBASE_SERVICE,
+            [(self._RS_ID_KEY, rs_id) for rs_id in variant_ids_to_query],
+            self._search_cellbase_variation,
+        )
+
+        for (_, rs_id), annotation_values in annotation_values_by_rs_id.items():
+
+            if annotation_values is None:
+                continue
+
+            # now we fill in all the variant information for these variants
+            for variant_info in self._iter_indexed_entries(rs_id):
+                variant_info.update_object(**annotation_values)
+
+    @renew_access_token
+    def _call_cellbase_annotation(self, coordinates_batch):
+        """
+        This method annotates a batch of variants without rs_id through a single POST annotation call, using their
+        coordinates.
+        :param coordinates_batch: list of assembly:chr:pos:ref:alt coordinates, all in the same assembly
+        :return:
+        """
+        annotation_values_by_coordinates = self._get_many_or_fetch(
+            self.CELLBASE_SERVICE,
+            [(self._COORDINATES_KEY, coordinates) for coordinates in coordinates_batch],
+            self._post_cellbase_annotation,
+        )
+
+        for (
+            (_, coordinates),
+            annotation_values,
+        ) in annotation_values_by_coordinates.items():
+
+            if annotation_values is None:
+                continue
+
+            for variant_info in self._iter_indexed_entries(
+                coordinates, self.coordinate_index_helper
+            ):
+                # entries of the variant with an rs_id are annotated by the rs_id search
+                if variant_info.rs_id is None:
+                    variant_info.update_object(**annotation_values)
+
+    def _post_cellbase_annotation(self, coordinate_keys):
+        """
+        Annotates the given coordinate cache keys, which all share the same assembly, with a POST call to Cellbase.
+        :param coordinate_keys:
+        :return: dictionary of coordinate cache key -> annotation values, as returned by _get_annotation_values
+        """
+        coordinate_ids = []
+        coordinate_keys_by_coordinates = {}
+        for coordinate_key in coordinate_keys:
+            assembly, coordinate_id = coordinate_key[1].split(
+                self._VARIANT_ID_SEPARATOR, 1
+            )
+            coordinate_ids.append(coordinate_id)
+            coordinate_keys_by_coordinates[
+                self._get_coordinates(*coordinate_id.split(self._VARIANT_ID_SEPARATOR))
+            ] = coordinate_key
+
+        response = self.cellbase_variant_client.get_annotation(
+            coordinate_ids,
+            method=self._POST,
+            assembly=assembly,
+            include=self._ANNOTATION_INCLUDE_LIST,
+        )
+
+        # annotations are matched to the variants sent by their coordinates rather than by their position in the
+        # response, since Cellbase can leave out the variants it fails to annotate
+        annotations_by_coordinates = {}
+        for query_result in response:
+            for annotation in query_result[self._RESULT_FIELD]:
+                coordinate_key = coordinate_keys_by_coordinates.get(
+                    self._get_coordinates(
+                        annotation.get("chromosome"),
+                        annotation.get("start"),
+                        annotation.get("reference"),
+                        annotation.get("alternate"),
+                    )
+                )
+                if (
+                    coordinate_key is not None
+                    and coordinate_key not in annotations_by_coordinates
+                ):
+                    annotations_by_coordinates[
+                        coordinate_key
+                    ] = self._get_annotation_values(annotation)
+
+        return annotations_by_coordinates
+
+    @classmethod
+    def _get_coordinates(cls, chromosome, start, reference, alternate):
+        """
+        Returns comparable coordinates of a variant, whether they come from a coordinate id or from a Cellbase
+        annotation, which leaves out the chr prefix of the chromosome.
+        :param chromosome:
+        :param start:
+        :param reference:
+        :param alternate:
+        :return: tuple of chromosome, start, reference and alternate
+        """
+        chromosome = str(chromosome)
+        if chromosome.startswith(cls._CHROMOSOME):
+            chromosome = chromosome[len(cls._CHROMOSOME) :]
+        return chromosome, str(start), reference, alternate
+
+    def _get_annotation_values(self, cellbase_variant_info):
+        """
+        Reduces a Cellbase variant annotation to the scores the VariantInfo objects are filled in with, so that only
+        those are kept by the request cache.
+        :param cellbase_variant_info:
+        :return: dictionary of VariantInfo attribute -> value
+        """
+        return {
+            "CADD_scaled_score": self._get_cadd_classification(
+                cellbase_variant_info
+            ),
+            "GERP": self._get_conservation_score_from_source(
+                cellbase_variant_info[self._CONSERVATION], "gerp"
+            ),
+            "phastCons": self._get_conservation_score_from_source(
+                cellbase_variant_info[self._CONSERVATION], "phastCons"
+            ),
+            "phylop": self._get_conservation_score_from_source(
+                cellbase_variant_info[self._CONSERVATION], "phylop"
+            ),
+            "clinVar": self._get_clinvar_classification(cellbase_variant_info),
+        }
+
+    def _search_cellbase_variation(self, rs_id_keys):
+        """
+        Queries Cellbase for the given rs_id cache keys and returns the annotation of each rs_id found.
+        :param rs_id_keys:
+        :return: dictionary of rs_id cache key -> annotation values, as returned by _get_annotation_values
+        """
         # this doesn't yield back, so we have to retrieve all at once. It's only max of 200 cases per query, so
         # it's fine to hold in memory here, even though it's multi threaded.
         response = self.cellbase_client.search(
-            id=variant_ids_to_query, include=self._INCLUDE_LIST
+            id=[rs_id for _, rs_id in rs_id_keys], include=self._INCLUDE_LIST
         )
 
-        response_helper = {}
+        # There should always be only one response. However if there are more here, we keep the last one
+        annotations_by_rs_id = {}
         for individual_result in response[0][self._RESULT_FIELD]:
-            if individual_result["id"] in response_helper:
-                response_helper[individual_result["id"]].append(individual_result)
-            else:
-                response_helper[individual_result["id"]] = [individual_result]
+            annotations_by_rs_id[
+                (self._RS_ID_KEY, individual_result["id"])
+            ] = self._get_annotation_values(individual_result["annotation"])
 
-        for rs_id in response_helper.keys():
-
-            # now we fill in all the variant information for these variants
-            for variant_info in self.dataset_index_helper[rs_id]:
-                cellbase_variant_info = response_helper[rs_id][-1]["annotation"]
-
-                # There should always be only one response. However if there are more here, we ignore them
-                variant_info.update_object(
-                    **{
-                        "CADD_scaled_score": self._get_cadd_classification(
-                            cellbase_variant_info
-                        ),
-                        "GERP": self._get_conservation_score_from_source(
-                            cellbase_variant_info[self._CONSERVATION], "gerp"
-                        ),
-                        "phastCons": self._get_conservation_score_from_source(
-                            cellbase_variant_info[self._CONSERVATION], "phastCons"
-                        ),
-                        "phylop": self._get_conservation_score_from_source(
-                            cellbase_variant_info[self._CONSERVATION], "phylop"
-                        ),
-                        "clinVar": self._get_clinvar_classification(
-                            cellbase_variant_info
-                        ),
-                    }
-                )
+        return annotations_by_rs_id
 
     def _get_conservation_score_from_source(self, conservation, source):
         """
@@ -1,9 +1,11 @@
-import os
-from operator import attrgetter
-from multiprocessing.dummy import Pool as ThreadPool
+import json
+from operator import itemgetter
 
 from glowingmeme.clients.clients import renew_access_token
+from glowingmeme.clients.hedging import skip_on_request_timeout
+from glowingmeme.clients.projection import FieldProjection
 from glowingmeme.build_data.build_dataset import BuildDataset
+from glowingmeme.build_data.work_scheduler import LongestFirstScheduler
 
 
 class BuildDatasetCipapi(BuildDataset):
@@ -12,147 +14,214 @@ class BuildDatasetCipapi(BuildDataset):
     MOTHER = "Mother"
     GENOMICS_ENGLAND_TIERING = "genomics_england_tiering"
 
-    def __init__(self, cva_built_dataset):
+    # the only fields read from a case. CIPAPI can't project on the server side, so cases are pruned to these as
+    # soon as they are decoded
+    _CASE_PROJECTION = FieldProjection(
+        [
+            "interpretation_request_data.json_request.pedigree.members.isProband",
+            "interpretation_request_data.json_request.pedigree.members.participantId",
+            "interpretation_request_data.json_request.pedigree.members.additionalInformation",
+            "interpretation_request_data.json_request.pedigree.members.ancestries",
+            "interpreted_genome.created_at",
+            "interpreted_genome.interpreted_genome_data.interpretationService",
+            "interpreted_genome.interpreted_genome_data.variants.variantCoordinates",
+            "interpreted_genome.interpreted_genome_data.variants.variantCalls",
+            "interpreted_genome.interpreted_genome_data.variants.reportEvents",
+            "clinical_report.created_at",
+            "clinical_report.exit_questionnaire.exit_questionnaire_data",
+        ]
+    )
+
+    def __init__(self, cva_built_dataset, cost_history=None, build_context=None):
         """
         This class takes as precursor a Pandas Dataframe with the columns defined in the parent class, in the variable
         DATASET_COLUMN_VALUES. It requires at least the columns case_id, assembly and variant details
         ("chromosome", "start", "end") to be populated, otherwise it won't be able to find this information in cipapi.
         :param cva_built_dataset:
+        :param cost_history: optional WorkCostHistory with the time each case took in previous runs
+        :param build_context: BuildContext shared by the builders of the build
         """
-        super().__init__()
+        super().__init__(build_context)
         self.main_dataset = cva_built_dataset
         self.dataset_index_helper = None
+        self.scheduler = LongestFirstScheduler(cost_history)
 
     def build_dataset(self):
         """
         Start building the dataset.
         :return:
         """
-        self._fetch_cipapi_data()
+        with self.build_context.stage("cipapi"):
+            self._fetch_cipapi_data()
 
     def _fetch_cipapi_data(self):
         """
-        This method queries cipapi for more data.
+        This method queries cipapi for more data. Cases are fetched as undecoded response bodies by I/O threads,
+        decoded and looked up by worker processes, and the values found are applied to the dataset here. Records cached
+        by a previous build are applied without fetching their case again.
         :return:
         """
 
         self._set_dataset_index_helper_by_attribute("case_id")
         case_id_list = self.dataset_index_helper.keys()
 
-        pool = ThreadPool(os.cpu_count())
-        pool.daemon = True
-
-        pool.map(self._query_data_for_case, case_id_list)
+        # cases differ hugely in size, so the biggest ones are fetched first to avoid a long tail at the end
+        self.build_context.hybrid_executor.run(
+            self.scheduler.order(case_id_list, self._count_indexed_entries),
+            self.scheduler.timed(self._fetch_case),
+            self._extract_case_records,
+            self._apply_case_records,
+            self._get_request_cache(self.CIPAPI_SERVICE),
+        )
+        self._log_timed_out_items("CIPAPI cases")
 
+    @skip_on_request_timeout
     @renew_access_token
-    def _query_data_for_case(self, case_id):
+    def _fetch_case(self, case_id):
         """
-        This method queries all the data for a given cipapi case.
+        This method queries a cipapi case, and returns the undecoded body of the response for the worker processes,
+        which decode what the dataset needs.
         :param case_id:
-        :return:
+        :return: json body of the case
         """
 
-        case = case_id.split("-")[0]
-        version = case_id.split("-")[1]
-        interpretation_request = self.cipapi_client.get_case(
+        case, version = self._split_case_id(case_id)
+        return self.cipapi_case_body_client.get_case_body(
             case_id=case, case_version=version
         )
 
+    @staticmethod
+    def _split_case_id(case_id):
+        """
+        Splits a dataset case id into the cipapi case id and version.
+        :param case_id:
+        :return: case id, case version
+        """
+        case_id_parts = case_id.split("-")
+        return case_id_parts[0], case_id_parts[1]
+
+    @classmethod
+    def _extract_case_records(cls, case_id, case_body):
+        """
+        This method runs in a worker process, and decodes a case, pruned to the fields that are read from it, into
+        the values of each of the variants of its interpreted genome. The record doesn't depend on the dataset, so it
+        can be cached for the following builds.
+        :param case_id:
+        :param case_body: json body of the case, as returned by _fetch_case
+        :return: values shared by all the variants of the case, dictionary of lookup key -> variant values
+        """
+        # the json is decoded as is, instead of decoding the whole interpretation request into protocol objects
+        interpretation_request = cls._CASE_PROJECTION.apply(json.loads(case_body))
+        pedigree = interpretation_request["interpretation_request_data"][
+            "json_request"
+        ]["pedigree"]
+
         # always pull the info from the latest report
-        latest_report = self._get_latest_report(
+        latest_report = cls._get_latest_report(
             interpretation_request=interpretation_request
         )
-        proband = [
-            member
-            for member in interpretation_request.pedigree.members
-            if member.isProband
-        ][0]
-        genomics_england_interpreted_genome = self._get_gel_interpreted_genome(
+        proband = [member for member in pedigree["members"] if member["isProband"]][0]
+        proband_ancestries = proband.get("ancestries") or {}
+        family_ids = cls._get_family_ids(pedigree=pedigree)
+        genomics_england_interpreted_genome = cls._get_gel_interpreted_genome(
             interpretation_request=interpretation_request
         )
 
-        fast_lookup_dict = self._create_fast_lookup_dict(
+        fast_lookup_dict = cls._create_fast_lookup_dict(
             genomics_england_interpreted_genome
         )
 
-        # we can now fill in every variant for this case with the relevant information
-        for variant_entry_info in self.dataset_index_helper[case_id]:
+        case_values = {
+            "mother_ethnic_origin": proband_ancestries.get("mothersEthnicOrigin"),
+            "father_ethnic_origin": proband_ancestries.get("fathersEthnicOrigin"),
+        }
+
+        if (
+            latest_report.get("exit_questionnaire")
+            and len(
+                latest_report["exit_questionnaire"]["exit_questionnaire_data"][
+                    "variantGroupLevelQuestions"
+                ]
+            )
+            >= 1
+        ):
+            exit_questionnaire_data = latest_report["exit_questionnaire"][
+                "exit_questionnaire_data"
+            ]
+            case_values.update(
+                {
+                    "case_solved_family": exit_questionnaire_data[
+                        "familyLevelQuestions"
+                    ]["caseSolvedFamily"],
+                    "phenotypes_solved": exit_questionnaire_data[
+                        "variantGroupLevelQuestions"
+                    ][-1]["phenotypesSolved"],
+                    "actionability": exit_questionnaire_data[
+                        "variantGroupLevelQuestions"
+                    ][-1]["actionability"],
+                }
+            )
+
+        variant_values_by_key = {}
+        for lookup_key, variants_in_genome in fast_lookup_dict.items():
+
+            # the first variant of the interpreted genome at each position is the one the dataset is filled in with
+            variant_in_genome = variants_in_genome[0]
 
-            fast_lookup_key_name = "{chr}_{start}".format(
-                chr=variant_entry_info.chromosome.replace("chr", ""),
-                start=variant_entry_info.start,
+            (
+                proband_zygosity,
+                mother_zygosity,
+                father_zygosity,
+            ) = cls._get_family_variant_zygosity(
+                family_ids=family_ids, variant=variant_in_genome,
             )
+            report_event = variant_in_genome["reportEvents"][0]
 
-            # get corresponding variant from interpreted genome
-            variant_in_genome = None
-            if fast_lookup_key_name in fast_lookup_dict:
-                variant_in_genome = fast_lookup_dict[fast_lookup_key_name][0]
-
-            if variant_in_genome:
-                (
-                    proband_zygosity,
-                    mother_zygosity,
-                    father_zygosity,
-                ) = self._get_family_variant_zygosity(
-                    pedigree=interpretation_request.pedigree, variant=variant_in_genome,
-                )
+            variant_values_by_key[lookup_key] = {
+                "zygosity_proband": proband_zygosity,
+                "zygosity_mother": mother_zygosity,
+                "zygosity_father": father_zygosity,
+                "mode_of_inheritance": report_event.get("modeOfInheritance"),
+                "segregation_pattern": report_event.get("segregationPattern"),
+                "penetrance": report_event.get("penetrance"),
+            }
 
-                variant_entry_info.zygosity_proband = proband_zygosity
-                variant_entry_info.zygosity_mother = mother_zygosity
-                variant_entry_info.zygosity_father = father_zygosity
-
-                variant_entry_info.mode_of_inheritance = variant_in_genome.reportEvents[
-                    0
-                ].modeOfInheritance
-                variant_entry_info.segregation_pattern = variant_in_genome.reportEvents[
-                    0
-                ].segregationPattern
-                variant_entry_info.penetrance = variant_in_genome.reportEvents[
-                    0
-                ].penetrance
-
-                variant_entry_info.mother_ethnic_origin = (
-                    proband.ancestries.mothersEthnicOrigin
-                )
-                variant_entry_info.father_ethnic_origin = (
-                    proband.ancestries.fathersEthnicOrigin
-                )
+        return case_values, variant_values_by_key
 
-                if (
-                    latest_report.exit_questionnaire
-                    and len(
-                        latest_report.exit_questionnaire.exit_questionnaire_data[
-                            "variantGroupLevelQuestions"
-                        ]
+    def _apply_case_records(self, case_records):
+        """
+        This method fills in every variant of the given cases with the values extracted for them.
+        :param case_records: list of (case id, record), as returned by _extract_case_records
+        :return:
+        """
+        for case_id, (case_values, variant_values_by_key) in case_records:
+            for variant_entry_info in self._iter_indexed_entries(case_id):
+                variant_values = variant_values_by_key.get(
+                    self._get_lookup_key(
+                        variant_entry_info.chromosome.replace("chr", ""),
+                        variant_entry_info.start,
                     )
-                    >= 1
-                ):
-
-                    variant_entry_info.case_solved_family = latest_report.exit_questionnaire.exit_questionnaire_data[
-                        "familyLevelQuestions"
-                    ][
-                        "caseSolvedFamily"
-                    ]
+                )
+                if variant_values is None:
+                    continue
 
-                    variant_entry_info.phenotypes_solved = latest_report.exit_questionnaire.exit_questionnaire_data[
-                        "variantGroupLevelQuestions"
-                    ][
-                        -1
-                    ][
-                        "phenotypesSolved"
-                    ]
+                # updating through update_object so that disk backed entries are written back to their store
+                variant_entry_info.update_object(**variant_values, **case_values)
 
-                    variant_entry_info.actionability = latest_report.exit_questionnaire.exit_questionnaire_data[
-                        "variantGroupLevelQuestions"
-                    ][
-                        -1
-                    ][
-                        "actionability"
-                    ]
+    @staticmethod
+    def _get_lookup_key(chromosome, start):
+        """
+        Returns the chr_start key under which variants are indexed by _create_fast_lookup_dict.
+        :param chromosome: chromosome without the chr prefix
+        :param start:
+        :return:
+        """
+        return "{chr}_{start}".format(chr=chromosome, start=start)
 
-    def _create_fast_lookup_dict(self, interpreted_genome):
+    @classmethod
+    def _create_fast_lookup_dict(cls, interpreted_genome):
         """
-        This method takes all the small variant objects from an interpreted genome and puts them in a dictionary
+        This method takes all the small variants from an interpreted genome and puts them in a dictionary
         index by chr_start. This makes it extremely quicker to query for variants later, since we can reduce the
         searchable list by that index.
         :param interpreted_genome:
@@ -160,10 +229,10 @@ class BuildDatasetCipapi(BuildDataset):
         """
 
         fast_lookup_variant_dict = {}
-        for variant in interpreted_genome.interpretation_request_payload.variants:
-            key_name = "{chr}_{start}".format(
-                chr=variant.variantCoordinates.chromosome,
-                start=variant.variantCoordinates.position,
+        for variant in interpreted_genome["interpreted_genome_data"]["variants"]:
+            variant_coordinates = variant["variantCoordinates"]
+            key_name = cls._get_lookup_key(
+                variant_coordinates["chromosome"], variant_coordinates["position"]
             )
 
             if key_name in fast_lookup_variant_dict:
@@ -173,10 +242,11 @@ class BuildDatasetCipapi(BuildDataset):
 
         return fast_lookup_variant_dict
 
-    def _get_family_variant_zygosity(self, pedigree, variant):
+    @staticmethod
+    def _get_family_variant_zygosity(family_ids, variant):
         """
-        Given a pedigree and a variant, this method will return the zygosity values for the family.
-        :param pedigree:
+        Given the family participant ids and a variant, this method will return the zygosity values for the family.
+        :param family_ids: proband, mother and father participant ids, as returned by _get_family_ids
         :param variant:
         :return: proband_zygosity, mother_zygosity, father_zygosity
         """
@@ -185,23 +255,20 @@ class BuildDatasetCipapi(BuildDataset):
         father_zygosity = None
         proband_zygosity = None
 
-        (
-            proband_participant_id,
-            mother_participant_id,
-            father_participant_id,
-        ) = self._get_family_ids(pedigree=pedigree)
+        proband_participant_id, mother_participant_id, father_participant_id = family_ids
 
-        for variant_call in variant.variantCalls:
-            if variant_call.participantId == proband_participant_id:
-                proband_zygosity = variant_call.zygosity
-            elif variant_call.participantId == mother_participant_id:
-                mother_zygosity = variant_call.zygosity
-            elif variant_call.participantId == father_participant_id:
-                father_zygosity = variant_call.zygosity
+        for variant_call in variant["variantCalls"]:
+            if variant_call["participantId"] == proband_participant_id:
+                proband_zygosity = variant_call["zygosity"]
+            elif variant_call["participantId"] == mother_participant_id:
+                mother_zygosity = variant_call["zygosity"]
+            elif variant_call["participantId"] == father_participant_id:
+                father_zygosity = variant_call["zygosity"]
 
         return proband_zygosity, mother_zygosity, father_zygosity
 
-    def _get_gel_interpreted_genome(self, interpretation_request):
+    @classmethod
+    def _get_gel_interpreted_genome(cls, interpretation_request):
         """
         Given an Interpretation Request, the interpreted genome that was created by genomics england tiering services
         will be returned.
@@ -211,16 +278,20 @@ class BuildDatasetCipapi(BuildDataset):
         return max(
             [
                 interpreted_genome
-                for interpreted_genome in interpretation_request.interpreted_genome
-                if interpreted_genome.interpretation_request_payload.interpretationService
-                == self.GENOMICS_ENGLAND_TIERING
+                for interpreted_genome in interpretation_request["interpreted_genome"]
+                if interpreted_genome.get("interpreted_genome_data")
+                and interpreted_genome["interpreted_genome_data"].get(
+                    "interpretationService"
+                )
+                == cls.GENOMICS_ENGLAND_TIERING
             ],
-            key=attrgetter("created_at"),
+            key=itemgetter("created_at"),
         )
 
-    def _get_family_ids(self, pedigree):
+    @classmethod
+    def _get_family_ids(cls, pedigree):
         """
-        Given a Pedigree object, this method will return the proband, father and mother participant ids.
+        Given a pedigree, this method will return the proband, father and mother participant ids.
         :param pedigree:
         :return: proband, mother, father participantIds
         """
@@ -228,13 +299,16 @@ class BuildDatasetCipapi(BuildDataset):
         father_participant_id = None
         proband_participant_id = None
 
-        for member in pedigree.members:
-            if member.isProband:
-                proband_participant_id = member.participantId
-            elif member.additionalInformation["relation_to_proband"] == self.FATHER:
-                father_participant_id = member.participantId
-            elif member.additionalInformation["relation_to_proband"] == self.MOTHER:
-                mother_participant_id = member.participantId
+        for member in pedigree["members"]:
+            relation_to_proband = (member.get("additionalInformation") or {}).get(
+                "relation_to_proband"
+            )
+            if member["isProband"]:
+                proband_participant_id = member["participantId"]
+            elif relation_to_proband == cls.FATHER:
+                father_participant_id = member["participantId"]
+            elif relation_to_proband == cls.MOTHER:
+                mother_participant_id = member["participantId"]
 
         return proband_participant_id, mother_participant_id, father_participant_id
 
@@ -249,7 +323,7 @@ class BuildDatasetCipapi(BuildDataset):
         return max(
             [
                 clinical_report
-                for clinical_report in interpretation_request.clinical_report
+                for clinical_report in interpretation_request["clinical_report"]
             ],
-            key=attrgetter("created_at"),
+            key=itemgetter("created_at"),
         )
@@ -1,28 +1,25 @@
-import os
-import sys
+import json
 import logging
 from collections import Counter
-from multiprocessing.dummy import Pool as ThreadPool
-
-from protocols.protocol_7_2.reports import Program, Assembly
 
 from glowingmeme.clients.clients import renew_access_token
+from glowingmeme.clients.hedging import skip_on_request_timeout
 from glowingmeme.build_data.build_dataset import BuildDataset
 from glowingmeme.build_data.build_dataset import ReportedOutcomeEnum
-from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(threadName)s] %(levelname)s %(module)s:%(lineno)d - %(message)s",
-    datefmt="%Y-%M-%d %H:%M:%S",
-    stream=sys.stderr,
+from glowingmeme.build_data.build_spec import (
+    DatasetTarget,
+    get_fetch_plan,
+    normalize_assembly,
 )
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
 
 logger = logging.getLogger("GlowingMeme")
 
+
 class BuildDatasetCVA(BuildDataset):
 
     _CHROMOSOME = "chr"
+    _CVA_SERVER_ERROR_RETRIES = 3
     _INCLUDE_LIST = [
         "assembly",
         "variantType",
@@ -37,208 +34,358 @@ class BuildDatasetCVA(BuildDataset):
         "annotation.populationFrequencies"
     ]
 
-    def __init__(self):
+    # the only fields read from a case when expanding it, projected by CVA itself
+    _CASE_INCLUDE_LIST = [
+        "identifier",
+        "version",
+        "assembly",
+        "program",
+        "probandSex",
+        "probandEstimatedAgeAtAnalysis",
+        "interpretation",
+        "reportedVariants",
+        "allVariants",
+        "tieredVariants",
+        "classifiedVariants",
+    ]
+
+    def __init__(
+        self, dataset_store=None, targets=None, case_sampler=None, build_context=None
+    ):
         """
         This is the first BuildDataset object to be called since it will fetch the relevant cases from CVA from which
         the remaining data will be fetched for.
+        :param dataset_store: optional SQLiteDatasetStore where the dataset is kept instead of memory
+        :param targets: list of DatasetTarget built together. Defaults to the archived rare disease GRCh38 cases.
+        :param case_sampler: optional StratifiedCaseSampler, to only build the dataset of a sample of the cases
+        :param build_context: BuildContext shared by the builders of the build
         :return:
         """
-        super().__init__()
+        super().__init__(build_context)
+        if dataset_store is not None:
+            self.main_dataset = dataset_store
+
+        self.targets = targets if targets else [DatasetTarget()]
+        self.case_sampler = case_sampler
+        # case ids belonging to each target, by target name
+        self.target_case_ids = {}
 
     def build_dataset(self):
         """
         This method starts the process to build the Dataset Based on CVA queries.
         :return:
         """
-        (
-            reported_variant_list,
-            non_reported_variant_list,
-        ) = self._query_cva_archived_cases()
-        self.main_dataset = reported_variant_list + non_reported_variant_list
+        with self.build_context.stage("cva_enumeration"):
+            if isinstance(self.main_dataset, list):
+                (
+                    reported_variant_list,
+                    non_reported_variant_list,
+                ) = self._query_cva_archived_cases()
+                self.main_dataset = reported_variant_list + non_reported_variant_list
+            else:
+                # entries are spilled to the dataset store as soon as each case is expanded
+                self._query_cva_archived_cases(self.main_dataset, self.main_dataset)
 
         logger.info("Started fetching individual variant info from CVA.")
-        self._set_dataset_index_helper_by_attribute("id")
-        self._fetch_specific_variant_information()
+        with self.build_context.stage("cva_variant_enrichment"):
+            self._set_dataset_index_helper_by_attribute("id")
+            self._fetch_specific_variant_information()
 
     @renew_access_token
-    def _query_cva_archived_cases(self):
+    def _query_cva_archived_cases(
+        self, reported_variant_list=None, non_reported_variant_list=None
+    ):
         """
-        This method queries all the CVA cases that were archived with a positive result. It build
+        This method queries all the CVA cases of the dataset targets (by default, the archived ones) and builds their
+        variant entries. Cases shared by several targets are only expanded once, and when there is a case sampler,
+        only the sampled cases are expanded.
+        :param reported_variant_list: optional list like object where reported entries are appended to
+        :param non_reported_variant_list: optional list like object where non reported entries are appended to
         :return: reported_variant_list, non_reported_variant_list
         """
-        reported_variant_list = []
-        non_reported_variant_list = []
-
-        cases_iterator = self.cva_cases_client.get_cases(
-            program=Program.rare_disease,
-            assembly=Assembly.GRCh38,
-            caseStatuses=["ARCHIVED_POSITIVE", "ARCHIVED_NEGATIVE"],
-            include_all=False,
-        )
+        if reported_variant_list is None:
+            reported_variant_list = []
+        if non_reported_variant_list is None:
+            non_reported_variant_list = []
+
+        # the token renewal retries this whole method, so anything appended by a failed attempt is dropped
+        reported_variant_list.clear()
+        non_reported_variant_list.clear()
+
+        self.target_case_ids = {target.name: set() for target in self.targets}
+        if self.case_sampler is not None:
+            self.case_sampler.reset()
+
+        # every (program, assembly, status) listing is fetched once for all the targets that need it
+        for (program, assembly, case_status), target_names in get_fetch_plan(
+            self.targets
+        ).items():
+            cases_iterator = self.cva_cases_client.get_cases(
+                program=program,
+                assembly=assembly,
+                caseStatuses=[case_status],
+                include_all=False,
+                include=self._CASE_INCLUDE_LIST,
+            )
 
-        for case in cases_iterator:
+            for case in cases_iterator:
+                case_id = "{identifier}-{version}".format(
+                    identifier=case.get("identifier", ""),
+                    version=str(case.get("version", "")),
+                )
 
-            # since the variants belong to the same case, both the reported and non reported ones will have
-            # some similar information, e.g. population
-            assembly = case.get("assembly", None)
-            case_id = "{identifier}-{version}".format(
-                identifier=case.get("identifier", ""),
-                version=str(case.get("version", "")),
-            )
-            sex = case.get("probandSex", None)
-            program = case.get("program", None)
-            tiered_variants = case.get("tieredVariants", {})
-            age = case.get("probandEstimatedAgeAtAnalysis", None)
-            classified_variants = case.get("classifiedVariants", {})
-            interpretation_message = str(case.get("interpretation", None)).encode(
-                "utf-8"
-            )
+                is_new_case = not any(
+                    case_id in case_ids for case_ids in self.target_case_ids.values()
+                )
+                for target_name in target_names:
+                    self.target_case_ids[target_name].add(case_id)
+
+                if is_new_case and (
+                    self.case_sampler is None
+                    or self.case_sampler.offer(case_id, case, case_status)
+                ):
+                    self.expand_case(
+                        case, case_id, reported_variant_list, non_reported_variant_list
+                    )
 
-            for variant in case.get("reportedVariants", []):
-                tier = self._get_variant_info(variant, tiered_variants)
-                variant_acmg_classification = self._get_variant_info(
-                    variant, classified_variants
+        if self.case_sampler is not None:
+            for case_id, case in self.case_sampler.pop_fallback_cases():
+                self.expand_case(
+                    case, case_id, reported_variant_list, non_reported_variant_list
                 )
-                # variant corresponds to the queryable CVA id
-                variant_info = VariantEntryInfo(
-                    **{
-                        "id": variant,
-                        "assembly": assembly,
-                        "case_id": case_id,
-                        "age": age,
-                        "sex": sex,
-                        "tier": tier,
-                        "program": program,
-                        "gel_variant_acmg_classification": variant_acmg_classification,
-                        "reported_outcome": ReportedOutcomeEnum.REPORTED.value,
-                    }
+            logger.info(
+                "Sampled {sampled_cases} of {population_cases} cases".format(
+                    **self.case_sampler.summary()
                 )
+            )
 
-                reported_variant_list.append(variant_info)
+        return reported_variant_list, non_reported_variant_list
 
-            non_reported_variants = self._subtract_lists(
-                case.get("reportedVariants", []), case.get("allVariants", [])
+    def expand_case(
+        self, case, case_id, reported_variant_list, non_reported_variant_list
+    ):
+        """
+        This method creates the reported and non reported variant entries of one CVA case. It is public so that
+        entries can be made from cases that don't come from CVA, e.g. synthetic ones.
+        :param case:
+        :param case_id:
+        :param reported_variant_list:
+        :param non_reported_variant_list:
+        :return:
+        """
+        # since the variants belong to the same case, both the reported and non reported ones will have
+        # some similar information, e.g. population
+        case_values = {
+            "assembly": case.get("assembly", None),
+            "case_id": case_id,
+            "age": case.get("probandEstimatedAgeAtAnalysis", None),
+            "sex": case.get("probandSex", None),
+            "program": case.get("program", None),
+        }
+
+        # tiers and classifications are looked up once per case instead of scanning every list for every variant
+        tier_by_variant = self._invert_variant_info(case.get("tieredVariants", {}))
+        classification_by_variant = self._invert_variant_info(
+            case.get("classifiedVariants", {})
+        )
+
+        # variant corresponds to the queryable CVA id
+        reported_variants = case.get("reportedVariants", [])
+        reported_variant_list.extend(
+            VariantEntryInfo.create_many(
+                ["id", "tier", "gel_variant_acmg_classification"],
+                [
+                    (
+                        variant,
+                        tier_by_variant.get(variant),
+                        classification_by_variant.get(variant),
+                    )
+                    for variant in reported_variants
+                ],
+                reported_outcome=ReportedOutcomeEnum.REPORTED.value,
+                **case_values
             )
-            for variant in non_reported_variants:
-                tier = self._get_variant_info(variant, tiered_variants)
-                # variant corresponds to the queryable CVA id
-
-                variant_info = VariantEntryInfo(
-                    **{
-                        "id": variant,
-                        "assembly": assembly,
-                        "case_id": case_id,
-                        "age": age,
-                        "sex": sex,
-                        "tier": tier,
-                        "program": program,
-                        "interpretation_message": interpretation_message,
-                        "reported_outcome": ReportedOutcomeEnum.NOT_REPORTED.value,
-                    }
-                )
-                non_reported_variant_list.append(variant_info)
+        )
 
-        return reported_variant_list, non_reported_variant_list
+        non_reported_variants = self._subtract_lists(
+            reported_variants, case.get("allVariants", [])
+        )
+        non_reported_variant_list.extend(
+            VariantEntryInfo.create_many(
+                ["id", "tier"],
+                [(variant, tier_by_variant.get(variant)) for variant in non_reported_variants],
+                interpretation_message=str(case.get("interpretation", None)).encode(
+                    "utf-8"
+                ),
+                reported_outcome=ReportedOutcomeEnum.NOT_REPORTED.value,
+                **case_values
+            )
+        )
 
     def _fetch_specific_variant_information(self):
         """
         This method uses the CVA variant client and the previously fetched variants to provide more info for them.
+        Variants are fetched as undecoded response bodies by I/O threads, decoded into compact records by worker
+        processes, and applied to the dataset here. Records cached by a previous build are applied without fetching
+        their variant again.
         :return:
         """
         all_unique_variants = self.dataset_index_helper.keys()
 
-        # threading available in client keeps breaking.
-        # Implementing it here instead
-        pool = ThreadPool(os.cpu_count())
-        pool.daemon = True
-
-        pool.map(self._query_and_fill_variant_object, all_unique_variants)
+        self.build_context.hybrid_executor.run(
+            all_unique_variants,
+            self._fetch_variant,
+            self._extract_variant_records,
+            self._apply_variant_records,
+            self._get_request_cache(self.CVA_SERVICE),
+        )
+        self._log_timed_out_items("CVA variants")
 
+    @skip_on_request_timeout
     @renew_access_token
-    def _query_and_fill_variant_object(self, variant_id):
+    def _fetch_variant(self, variant_id):
         """
-        This method queries one variant ID, and updates the corresponding variant info object with the new info.
+        This method queries one variant ID with the included fields only, and returns the undecoded body of the
+        response for the worker processes, which decode what the dataset needs.
         :param variant_id:
-        :return:
+        :return: json body of the response
         """
+        return self.cva_variant_body_client.get_variant_body(
+            variant_id,
+            include=self._INCLUDE_LIST,
+            retries=self._CVA_SERVER_ERROR_RETRIES,
+        )
 
-        variant_wrapper = self.cva_variants_client.get_variant_by_id(variant_id,
-                                                                     include=self._INCLUDE_LIST)
-
-        for variant in variant_wrapper.variants:
-
-            if variant.assembly == self._ASSEMBLY_38 and variant.annotation:
-                for variant_info_object in self.dataset_index_helper[
-                    variant_wrapper.id
-                ]:
-
-                    variant_type = variant.smallVariantType
-                    if variant.variantType:
-                        variant_type = variant.variantType
-
-                    # rebuilding list with new values fetched
-                    variant_info_object.update_object(
-                        **{
-                            "chromosome": self._CHROMOSOME
-                            + variant.annotation.chromosome,
-                            "start": variant.annotation.start,
-                            "end": variant.annotation.start
-                            + len(variant.annotation.reference),
-                            "alt": variant.annotation.alternate,
-                            "ref": variant.annotation.reference,
-                            "rs_id": variant.annotation.id,
-                            "consequence_type": self._get_sequence_ontology_terms(
-                                variant.annotation.consequenceTypes
-                            ),
-                            "biotypes": self._get_biotypes(
-                                variant.annotation.consequenceTypes
-                            ),
-                            "population_frequency": self._get_population_frequency(
-                                variant_info_object.sex,
-                                variant.annotation.populationFrequencies,
-                            ),
-                            "type": variant_type,
-                            "PhastCons": self._get_conservation_score_from_source(
-                                self._PHAST_CONS, variant.annotation.conservation,
-                            ),
-                            "phylop": self._get_conservation_score_from_source(
-                                self._PHYLOP, variant.annotation.conservation
-                            ),
-                        }
-                    )
+    @classmethod
+    def _extract_variant_records(cls, variant_id, variant_body):
+        """
+        This method runs in a worker process, and decodes the response body of a variant into the values of each of
+        its assemblies.
+        :param variant_id:
+        :param variant_body: json body of the response, as returned by _fetch_variant
+        :return: dictionary of normalized assembly -> (variant values, dictionary of population -> frequency), empty
+        if CVA has no such variant
+        """
+        variant = cls._decode_variant(variant_body)
+        if variant is None:
+            logger.warning("No variant found with id {}".format(variant_id))
+            return {}
+        return cls._get_variant_records(variant)
 
-    def _get_population_frequency(self, sex, population_frequencies_list):
+    @staticmethod
+    def _decode_variant(variant_body):
         """
-        This method, from a given PopulationsFrequencies object and sex of participant, extracts the most relevant
-        population frequency. For now it only uses sex for its logic.
-        :return:
+        This method decodes a CVA response body as pyark does, and returns the variant it holds.
+        :param variant_body:
+        :return: variant json, or None if CVA has no such variant
+        """
+        response = json.loads(variant_body)
+        if response.get("error"):
+            raise ValueError(response["error"])
+        results = response.get("response") or [{}]
+        variants = results[0].get("result") or []
+        return variants[0] if variants else None
+
+    @classmethod
+    def _get_variant_records(cls, variant):
         """
-        population_all_frequency = None
-        population_sex_frequency = None
-        if population_frequencies_list:
-            for population_frequency in population_frequencies_list:
-                if population_frequency.study == self._GNOMAD_GENOMES:
-                    if population_frequency.population == sex:
-                        population_sex_frequency = population_frequency.altAlleleFreq
+        This method extracts from the json of a variant the values of each of its assemblies. Population frequencies
+        depend on the sex of each participant, so all the GNOMAD_GENOMES ones are kept for _apply_variant_records to
+        choose from.
+        :param variant: variant json
+        :return: dictionary of normalized assembly -> (variant values, dictionary of population -> frequency)
+        """
+        variant_records = {}
+        for variant_representation in variant.get("variants") or []:
+            annotation = variant_representation.get("annotation")
+            if not annotation:
+                continue
+
+            consequence_types = annotation.get("consequenceTypes") or []
+            conservation = annotation.get("conservation")
+            variant_values = {
+                "chromosome": cls._CHROMOSOME + annotation["chromosome"],
+                "start": annotation["start"],
+                "end": annotation["start"] + len(annotation.get("reference") or ""),
+                "alt": annotation.get("alternate"),
+                "ref": annotation.get("reference"),
+                "rs_id": annotation.get("id"),
+                "consequence_type": cls._get_sequence_ontology_terms(
+                    consequence_types
+                ),
+                "biotypes": cls._get_biotypes(consequence_types),
+                "type": variant_representation.get("variantType")
+                or variant_representation.get("smallVariantType"),
+                "PhastCons": cls._get_conservation_score_from_source(
+                    cls._PHAST_CONS, conservation
+                ),
+                "phylop": cls._get_conservation_score_from_source(
+                    cls._PHYLOP, conservation
+                ),
+            }
+            population_frequencies = {
+                population_frequency.get("population"): population_frequency.get(
+                    "altAlleleFreq"
+                )
+                for population_frequency in annotation.get("populationFrequencies")
+                or []
+                if population_frequency.get("study") == cls._GNOMAD_GENOMES
+            }
+
+            # the same CVA variant can belong to cases of different assemblies when building several targets. Cases
+            # and variants don't always write assemblies the same way, so both are normalized
+            variant_records[normalize_assembly(variant_representation.get("assembly"))] = (
+                variant_values,
+                population_frequencies,
+            )
+        return variant_records
 
-                    if population_frequency.population == self._ALL:
-                        population_all_frequency = population_frequency.altAlleleFreq
+    def _apply_variant_records(self, variant_records):
+        """
+        This method updates the variant info objects of each variant with the values extracted for their assembly.
+        :param variant_records: list of (variant id, records by assembly), as returned by _extract_variant_records
+        :return:
+        """
+        for variant_id, records_by_assembly in variant_records:
+            for variant_info_object in self._iter_indexed_entries(variant_id):
+                variant_record = records_by_assembly.get(
+                    normalize_assembly(variant_info_object.assembly)
+                )
+                if variant_record is None:
+                    continue
+
+                variant_values, population_frequencies = variant_record
+                variant_info_object.update_object(
+                    population_frequency=self._get_population_frequency(
+                        variant_info_object.sex, population_frequencies
+                    ),
+                    **variant_values
+                )
 
+    def _get_population_frequency(self, sex, population_frequencies):
+        """
+        This method, from the GNOMAD_GENOMES frequencies of a variant and sex of participant, extracts the most
+        relevant population frequency. For now it only uses sex for its logic.
+        :param sex:
+        :param population_frequencies: dictionary of population -> frequency
+        :return:
+        """
+        population_sex_frequency = population_frequencies.get(sex)
         if population_sex_frequency:
             return population_sex_frequency
-        return population_all_frequency
+        return population_frequencies.get(self._ALL)
 
     @staticmethod
     def _get_sequence_ontology_terms(consequence_types_list):
         """
-        This method returns a list of sequence ontology terms given a list of consequenceType objects.
+        This method returns a list of sequence ontology terms given a list of consequenceType jsons.
         :return:
         """
         sequence_names = []
         for consequence_type in consequence_types_list:
-            for sequence_ontology in consequence_type.sequenceOntologyTerms:
-                if sequence_ontology.name:
-                    sequence_names.append(sequence_ontology.name)
+            for sequence_ontology in consequence_type.get("sequenceOntologyTerms") or []:
+                if sequence_ontology.get("name"):
+                    sequence_names.append(sequence_ontology["name"])
 
         if sequence_names:
             return ",".join(sequence_names)
@@ -247,13 +394,13 @@ class BuildDatasetCVA(BuildDataset):
     @staticmethod
     def _get_biotypes(consequence_types_list):
         """
-        This method returns a list of biotypes given a list of consequenceType objects.
+        This method returns a list of biotypes given a list of consequenceType jsons.
         :return:
         """
         biotypes = [
-            consequence_type.biotype
+            consequence_type["biotype"]
             for consequence_type in consequence_types_list
-            if consequence_type.biotype
+            if consequence_type.get("biotype")
         ]
 
         if biotypes:
@@ -263,14 +410,14 @@ class BuildDatasetCVA(BuildDataset):
     @staticmethod
     def _get_conservation_score_from_source(source, conservation):
         """
-        This method returns the required score given a conservation object list.
+        This method returns the required score given a list of conservation score jsons.
         :param conservation:
         :return:
         """
         if conservation:
             for conservation_score in conservation:
-                if conservation_score.source == source:
-                    return conservation_score.score
+                if conservation_score.get("source") == source:
+                    return conservation_score.get("score")
         return None
 
     @staticmethod
@@ -287,6 +434,20 @@ class BuildDatasetCVA(BuildDataset):
                 info = key
         return info
 
+    @staticmethod
+    def _invert_variant_info(info_dict):
+        """
+        This method inverts a dictionary of variant lists, e.g. the variant tiers, into a dictionary of variant to
+        info. As in _get_variant_info, a variant listed under several keys takes the last one.
+        :param info_dict:
+        :return:
+        """
+        info_by_variant = {}
+        for key, variants in info_dict.items():
+            for variant in variants:
+                info_by_variant[variant] = key
+        return info_by_variant
+
     @staticmethod
     def _subtract_lists(array_1, array_2):
         """
@@ -0,0 +1,291 @@
+import json
+import logging
+from operator import attrgetter
+
+from glowingmeme.build_data.build_dataset import ReportedOutcomeEnum
+
+logger = logging.getLogger("GlowingMeme")
+
+
+class BuildFeatures:
+    """
+    Optional stage that runs after BuildDatasetCellbase and turns the dataset into a model-ready feature matrix.
+    Every encoding is done column wise with pandas/numpy instead of row by row. Both are only imported when features
+    are built, so that the matrix formats can be read without paying for their import.
+    """
+
+    SPARSE = "csr"
+    DENSE = "dense"
+    MATRIX_FORMATS = [SPARSE, DENSE]
+
+    REPORTED_LABEL = 1
+    NOT_REPORTED_LABEL = 0
+    UNKNOWN_LABEL = -1
+
+    _MULTI_LABEL_SEPARATOR = ","
+    _FEATURE_NAME_SEPARATOR = "="
+    _MISSING_SUFFIX = "_missing"
+
+    # comma joined values, one-hot encoded as multi-label columns
+    _MULTI_LABEL_COLUMNS = ["consequence_type", "biotypes"]
+    # single valued categories, one-hot encoded
+    _CATEGORICAL_COLUMNS = [
+        "sex",
+        "type",
+        "mode_of_inheritance",
+        "segregation_pattern",
+        "penetrance",
+    ]
+    # numeric values, kept as they are together with a missing value mask
+    _NUMERIC_COLUMNS = [
+        "age",
+        "population_frequency",
+        "CADD_scaled_score",
+        "PhastCons",
+        "phylop",
+        "GERP",
+    ]
+
+    # number of alternate alleles for each zygosity, unknown zygosities are masked as missing
+    _ZYGOSITY_ENCODING = {
+        "reference_homozygous": 0,
+        "reference_hemizigous": 0,
+        "half_missing_reference": 0,
+        "heterozygous": 1,
+        "alternate_hemizigous": 1,
+        "half_missing_alternate": 1,
+        "alternate_homozygous": 2,
+    }
+    _TIER_ENCODING = {
+        "TIER1": 1,
+        "TIERA": 1,
+        "TIER2": 2,
+        "TIERB": 2,
+        "TIER3": 3,
+        "TIER4": 4,
+        "TIER5": 5,
+    }
+    _ACMG_ENCODING = {
+        "benign_variant": 1,
+        "likely_benign_variant": 2,
+        "variant_of_unknown_clinical_significance": 3,
+        "uncertain_significance": 3,
+        "likely_pathogenic_variant": 4,
+        "pathogenic_variant": 5,
+    }
+    _ORDINAL_COLUMNS = {
+        "zygosity_proband": _ZYGOSITY_ENCODING,
+        "zygosity_mother": _ZYGOSITY_ENCODING,
+        "zygosity_father": _ZYGOSITY_ENCODING,
+        "tier": _TIER_ENCODING,
+        "gel_variant_acmg_classification": _ACMG_ENCODING,
+    }
+
+    _LABEL_COLUMN = "reported_outcome"
+
+    def __init__(self, cellbase_built_dataset):
+        """
+        This class takes the dataset updated by the Cellbase Dataset builder.
+        :param cellbase_built_dataset: list of VariantEntryInfo objects, or a SQLiteDatasetStore
+        """
+        self.main_dataset = cellbase_built_dataset
+
+        # the feature matrix is held as coordinate triplets until saved, in the row order of the dataset
+        self.number_of_rows = 0
+        self.feature_names = []
+        self.labels = None
+        self._rows = []
+        self._columns = []
+        self._values = []
+
+    def build_features(self):
+        """
+        This method encodes every feature column of the dataset.
+        :return:
+        """
+        import numpy as np
+        import pandas as pd
+
+        dataset_frame = self._get_dataset_frame()
+        self.number_of_rows = len(dataset_frame)
+
+        for column in self._MULTI_LABEL_COLUMNS:
+            self._add_one_hot_features(
+                column,
+                dataset_frame[column]
+                .str.split(self._MULTI_LABEL_SEPARATOR)
+                .explode()
+                .dropna(),
+            )
+
+        for column in self._CATEGORICAL_COLUMNS:
+            self._add_one_hot_features(column, dataset_frame[column].dropna())
+
+        for column, encoding in self._ORDINAL_COLUMNS.items():
+            self._add_numeric_feature(column, dataset_frame[column].map(encoding))
+
+        for column in self._NUMERIC_COLUMNS:
+            self._add_numeric_feature(
+                column, pd.to_numeric(dataset_frame[column], errors="coerce")
+            )
+
+        # entries without an outcome are not labelled as not reported, so that they can be left out of training
+        self.labels = np.select(
+            [
+                dataset_frame[self._LABEL_COLUMN] == ReportedOutcomeEnum.REPORTED.value,
+                dataset_frame[self._LABEL_COLUMN] == ReportedOutcomeEnum.NOT_REPORTED.value,
+            ],
+            [self.REPORTED_LABEL, self.NOT_REPORTED_LABEL],
+            self.UNKNOWN_LABEL,
+        ).astype(np.int8)
+        unknown_labels = int(np.count_nonzero(self.labels == self.UNKNOWN_LABEL))
+        if unknown_labels:
+            logger.warning(
+                "{unknown_labels} dataset entries have no reported outcome, they are labelled {label}".format(
+                    unknown_labels=unknown_labels, label=self.UNKNOWN_LABEL
+                )
+            )
+
+        logger.info(
+            "Built {features} features for {rows} dataset entries".format(
+                features=len(self.feature_names), rows=self.number_of_rows
+            )
+        )
+
+    def save_features(
+        self,
+        matrix_file_name,
+        vocabulary_file_name,
+        labels_file_name,
+        matrix_format=SPARSE,
+    ):
+        """
+        This method saves the feature matrix as a .npz file, its labels as a .npy file and its vocabulary as a json
+        file. Sparse matrices are saved with scipy.sparse.save_npz and loaded with scipy.sparse.load_npz, dense ones
+        are saved as the features array of a numpy .npz file.
+        :param matrix_file_name:
+        :param vocabulary_file_name:
+        :param labels_file_name:
+        :param matrix_format: SPARSE or DENSE
+        :return:
+        """
+        import numpy as np
+        from scipy import sparse
+
+        rows = np.concatenate(self._rows) if self._rows else np.array([], np.int64)
+        columns = (
+            np.concatenate(self._columns) if self._columns else np.array([], np.int64)
+        )
+        values = (
+            np.concatenate(self._values) if self._values else np.array([], np.float32)
+        )
+        shape = (self.number_of_rows, len(self.feature_names))
+        feature_matrix = sparse.csr_matrix((values, (rows, columns)), shape=shape)
+
+        if matrix_format == self.DENSE:
+            np.savez_compressed(matrix_file_name, features=feature_matrix.toarray())
+        else:
+            sparse.save_npz(matrix_file_name, feature_matrix)
+        np.save(labels_file_name, self.labels)
+
+        with open(vocabulary_file_name, "w") as vocabulary_file:
+            json.dump(
+                {
+                    "format": matrix_format,
+                    "shape": list(shape),
+                    "features": self.feature_names,
+                    "encodings": self._ORDINAL_COLUMNS,
+                    "labels": {
+                        ReportedOutcomeEnum.REPORTED.value: self.REPORTED_LABEL,
+                        ReportedOutcomeEnum.NOT_REPORTED.value: self.NOT_REPORTED_LABEL,
+                        "unknown": self.UNKNOWN_LABEL,
+                    },
+                },
+                vocabulary_file,
+                indent=2,
+            )
+
+    def _get_dataset_frame(self):
+        """
+        Builds a data frame holding only the columns used as features.
+        :return:
+        """
+        import pandas as pd
+
+        frame_columns = (
+            self._MULTI_LABEL_COLUMNS
+            + self._CATEGORICAL_COLUMNS
+            + list(self._ORDINAL_COLUMNS.keys())
+            + self._NUMERIC_COLUMNS
+            + [self._LABEL_COLUMN]
+        )
+        get_frame_values = attrgetter(*frame_columns)
+        return pd.DataFrame.from_records(
+            [get_frame_values(variant_entry) for variant_entry in self.main_dataset],
+            columns=frame_columns,
+        )
+
+    def _add_one_hot_features(self, column, category_series):
+        """
+        Adds one feature per distinct value of the given series. The index of the series is the dataset row, so
+        exploded multi-label series produce several features for the same row.
+        :param column:
+        :param category_series:
+        :return:
+        """
+        import numpy as np
+        import pandas as pd
+
+        categories = pd.Categorical(category_series.astype(str))
+        first_feature = len(self.feature_names)
+        self.feature_names.extend(
+            "{column}{separator}{category}".format(
+                column=column, separator=self._FEATURE_NAME_SEPARATOR, category=category
+            )
+            for category in categories.categories
+        )
+
+        # repeated values in the same row (e.g. the same biotype in two transcripts) are set only once
+        row_feature_pairs = np.unique(
+            np.stack(
+                [
+                    category_series.index.to_numpy(dtype=np.int64),
+                    categories.codes.astype(np.int64) + first_feature,
+                ]
+            ),
+            axis=1,
+        )
+        self._rows.append(row_feature_pairs[0])
+        self._columns.append(row_feature_pairs[1])
+        self._values.append(np.ones(row_feature_pairs.shape[1], dtype=np.float32))
+
+    def _add_numeric_feature(self, column, numeric_series):
+        """
+        Adds a numeric feature, with missing values set to 0, and its missing value mask.
+        :param column:
+        :param numeric_series:
+        :return:
+        """
+        import numpy as np
+
+        numeric_values = numeric_series.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing_mask = np.isnan(numeric_values)
+
+        value_feature = len(self.feature_names)
+        self.feature_names.extend([column, column + self._MISSING_SUFFIX])
+
+        value_rows = np.flatnonzero(~missing_mask & (numeric_values != 0))
+        missing_rows = np.flatnonzero(missing_mask)
+        self._rows.extend([value_rows, missing_rows])
+        self._columns.extend(
+            [
+                np.full(len(value_rows), value_feature, dtype=np.int64),
+                np.full(len(missing_rows), value_feature + 1, dtype=np.int64),
+            ]
+        )
+        self._values.extend(
+            [
+                numeric_values[value_rows].astype(np.float32),
+                np.ones(len(missing_rows), dtype=np.float32),
+            ]
+        )
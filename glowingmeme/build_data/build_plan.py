@@ -0,0 +1,179 @@
+from glowingmeme.build_data.build_dataset_cellbase import BuildDatasetCellbase
+
+
+class BuildPlanner:
+    """
+    Estimates the upstream calls and the wall time of a build from its enumerated CVA cases, before any variant or
+    case is fetched. The previous version of the dataset tells which cases and variants are new, and which rs_ids
+    the known variants have.
+    Wall times are estimated from the seconds per call (or per saved row, for the export) that each stage took in
+    previous builds, as recorded in the cost history by record_stage_costs. Both sides count the same units: every
+    unique variant and case is fetched once per build, and rows are counted once per target they are saved to.
+    """
+
+    CVA_ENUMERATION = "cva_enumeration"
+    CVA_VARIANT_ENRICHMENT = "cva_variant_enrichment"
+    CIPAPI = "cipapi"
+    CELLBASE = "cellbase"
+    EXPORT = "export"
+
+    _STAGE_KEY = "stage:{stage}"
+
+    def __init__(self, cost_history):
+        """
+        :param cost_history: WorkCostHistory of the previous builds
+        """
+        self.cost_history = cost_history
+
+    @classmethod
+    def record_stage_costs(cls, cost_history, stage_seconds, stage_work_items):
+        """
+        Records the seconds per work item that each stage of a build took, for the plans of the following builds.
+        :param cost_history: WorkCostHistory
+        :param stage_seconds: dictionary of stage -> seconds, as measured by a StageTimer
+        :param stage_work_items: dictionary of stage -> number of calls made by the stage, or of rows saved by the
+        export
+        :return:
+        """
+        for stage, seconds in stage_seconds.items():
+            work_items = stage_work_items.get(stage)
+            if work_items:
+                cost_history.record(
+                    cls._STAGE_KEY.format(stage=stage), seconds / work_items
+                )
+
+    def plan(
+        self,
+        variant_entries,
+        previous_entries=(),
+        enumeration_seconds=None,
+        listed_cases=None,
+        target_case_ids=None,
+    ):
+        """
+        Plans the build of the given enumerated entries.
+        :param variant_entries: entries created by the CVA enumeration
+        :param previous_entries: iterable of (case_id, id, rs_id) of the entries of the previous dataset version
+        :param enumeration_seconds: seconds the enumeration took, as it was already run
+        :param listed_cases: number of cases listed by the enumeration
+        :param target_case_ids: optional dictionary of target name -> case ids of the target, as entries are saved
+        once for each target of their case
+        :return: dictionary of stage -> dictionary of work_items, new, calls and estimated_seconds, where unknown
+        values are None, and the total estimated_seconds with the stages that had no recorded cost
+        """
+        rows = 0
+        variant_ids = set()
+        case_ids = set()
+        for variant_entry in variant_entries:
+            if target_case_ids is None:
+                rows += 1
+            else:
+                rows += sum(
+                    1 for case_ids_of_target in target_case_ids.values() if variant_entry.case_id in case_ids_of_target
+                )
+            variant_ids.add(variant_entry.id)
+            case_ids.add(variant_entry.case_id)
+        variant_ids.discard(None)
+
+        previous_case_ids = set()
+        rs_id_by_variant_id = {}
+        for case_id, variant_id, rs_id in previous_entries:
+            previous_case_ids.add(case_id)
+            # saved csvs have empty values instead of None
+            rs_id_by_variant_id[variant_id] = rs_id if rs_id else None
+
+        known_variant_ids = variant_ids & rs_id_by_variant_id.keys()
+        new_variants = len(variant_ids) - len(known_variant_ids)
+
+        # rs_ids are only known once variants are fetched from CVA, so those of new variants are estimated from the
+        # share of variants with an rs_id in the previous version, or assumed to all have one without it
+        rs_id_share = 1.0
+        if rs_id_by_variant_id:
+            rs_id_share = sum(
+                1 for rs_id in rs_id_by_variant_id.values() if rs_id
+            ) / len(rs_id_by_variant_id)
+        known_rs_ids = {
+            rs_id_by_variant_id[variant_id] for variant_id in known_variant_ids
+        }
+        known_rs_ids.discard(None)
+        known_coordinates = sum(
+            1
+            for variant_id in known_variant_ids
+            if rs_id_by_variant_id[variant_id] is None
+        )
+        new_rs_ids = round(new_variants * rs_id_share)
+
+        build_plan = {
+            self.CVA_ENUMERATION: {
+                "work_items": listed_cases,
+                "new": None,
+                "calls": None,
+                "estimated_seconds": enumeration_seconds,
+            },
+            self.CVA_VARIANT_ENRICHMENT: self._plan_stage(
+                self.CVA_VARIANT_ENRICHMENT,
+                len(variant_ids),
+                new_variants,
+                len(variant_ids),
+            ),
+            self.CIPAPI: self._plan_stage(
+                self.CIPAPI,
+                len(case_ids),
+                len(case_ids - previous_case_ids),
+                len(case_ids),
+            ),
+            self.CELLBASE: self._plan_stage(
+                self.CELLBASE,
+                len(known_rs_ids) + known_coordinates + new_variants,
+                new_variants,
+                BuildDatasetCellbase.get_number_of_batches(
+                    len(known_rs_ids) + new_rs_ids,
+                    known_coordinates + new_variants - new_rs_ids,
+                ),
+            ),
+            self.EXPORT: {
+                "work_items": rows,
+                "new": None,
+                "calls": 0,
+                "estimated_seconds": self._estimate_seconds(self.EXPORT, rows),
+            },
+        }
+
+        stages_without_history = [
+            stage
+            for stage, stage_plan in build_plan.items()
+            if stage_plan["estimated_seconds"] is None
+        ]
+        build_plan["estimated_seconds"] = sum(
+            stage_plan["estimated_seconds"] or 0 for stage_plan in build_plan.values()
+        )
+        build_plan["stages_without_history"] = stages_without_history
+        return build_plan
+
+    def _plan_stage(self, stage, work_items, new, calls):
+        """
+        Returns the plan of a stage making the given number of calls.
+        :param stage:
+        :param work_items: number of cases, variants or rows of the stage
+        :param new: number of work items not in the previous version
+        :param calls: number of upstream calls
+        :return:
+        """
+        return {
+            "work_items": work_items,
+            "new": new,
+            "calls": calls,
+            "estimated_seconds": self._estimate_seconds(stage, calls),
+        }
+
+    def _estimate_seconds(self, stage, work_items):
+        """
+        Returns the time a stage should take from its recorded cost per work item, or None if it has none.
+        :param stage:
+        :param work_items:
+        :return:
+        """
+        cost_per_work_item = self.cost_history.get(self._STAGE_KEY.format(stage=stage))
+        if cost_per_work_item is None:
+            return None
+        return cost_per_work_item * work_items
@@ -0,0 +1,123 @@
+# canonical names of the assemblies, by the lower case names CVA cases, CVA variants and build specs use for them
+_ASSEMBLY_NAMES = {
+    "grch37": "GRCh37",
+    "hg19": "GRCh37",
+    "grch38": "GRCh38",
+    "hg38": "GRCh38",
+}
+
+
+def normalize_assembly(assembly):
+    """
+    Returns the canonical name of an assembly, e.g. GRCh38 for grch38, hg38 or GRCh38.p13, so that assemblies
+    written differently by each source compare equal. Unknown assemblies are only stripped of their patch.
+    :param assembly:
+    :return:
+    """
+    if assembly is None:
+        return None
+    assembly_name = str(assembly).strip().split(".")[0]
+    return _ASSEMBLY_NAMES.get(assembly_name.lower(), assembly_name)
+
+
+class DatasetTarget:
+    """
+    One dataset to be produced by a build: the CVA cases of a program and assembly with the given case statuses.
+    """
+
+    DEFAULT_NAME = "default"
+    # values of protocols' Program.rare_disease and Assembly.GRCh38, which is slow to import
+    DEFAULT_PROGRAM = "rare_disease"
+    DEFAULT_ASSEMBLY = "GRCh38"
+    DEFAULT_CASE_STATUSES = ["ARCHIVED_POSITIVE", "ARCHIVED_NEGATIVE"]
+
+    def __init__(
+        self,
+        name=DEFAULT_NAME,
+        program=DEFAULT_PROGRAM,
+        assembly=DEFAULT_ASSEMBLY,
+        case_statuses=None,
+    ):
+        self.name = name
+        self.program = program
+        self.assembly = normalize_assembly(assembly)
+        self.case_statuses = (
+            list(case_statuses)
+            if case_statuses is not None
+            else list(self.DEFAULT_CASE_STATUSES)
+        )
+
+    def __repr__(self):
+        return "DatasetTarget({name}: {program}, {assembly}, {case_statuses})".format(
+            **vars(self)
+        )
+
+
+class TargetDataset:
+    """
+    The entries of a dataset that belong to the cases of a target. The dataset is streamed again every time this is
+    iterated, so that saving a target never holds its entries in memory.
+    """
+
+    def __init__(self, variant_entries, case_ids):
+        """
+        :param variant_entries: iterable of the entries of every target, e.g. the main dataset of the build
+        :param case_ids: set of the case ids of the target
+        """
+        self.variant_entries = variant_entries
+        self.case_ids = case_ids
+
+    def __iter__(self):
+        for variant_entry in self.variant_entries:
+            if variant_entry.case_id in self.case_ids:
+                yield variant_entry
+
+
+def load_build_spec(file_name):
+    """
+    Loads the dataset targets of a build from a yaml (or json) build spec file, e.g.
+
+    targets:
+      - name: rare_disease_archived
+        program: rare_disease
+        assembly: GRCh38
+        case_statuses: [ARCHIVED_POSITIVE, ARCHIVED_NEGATIVE]
+      - name: cancer_grch37
+        program: cancer
+        assembly: GRCh37
+
+    Missing fields take the values of the default target.
+    :param file_name:
+    :return: list of DatasetTarget
+    """
+    import yaml
+
+    with open(file_name) as build_spec_file:
+        build_spec = yaml.load(build_spec_file, Loader=yaml.FullLoader)
+
+    targets = [DatasetTarget(**target) for target in build_spec["targets"]]
+
+    target_names = [target.name for target in targets]
+    if len(set(target_names)) != len(target_names):
+        raise ValueError(
+            "Dataset target names must be unique, got {names}".format(names=target_names)
+        )
+
+    return targets
+
+
+def get_fetch_plan(targets):
+    """
+    Groups the targets by the CVA case listings they need, so that each listing is fetched once for the union of
+    all targets. Since a case has a single status, listing each (program, assembly, status) once also means each
+    case is fetched once.
+    :param targets:
+    :return: dictionary of (program, assembly, case_status) -> list of target names
+    """
+    fetch_plan = {}
+    for target in targets:
+        for case_status in target.case_statuses:
+            fetch_plan.setdefault(
+                (target.program, target.assembly, case_status), []
+            ).append(target.name)
+    return fetch_plan
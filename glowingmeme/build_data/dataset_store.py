@@ -0,0 +1,420 @@
+import pickle
+import sqlite3
+import weakref
+import threading
+from collections import OrderedDict
+
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class StoredVariantEntryInfo(VariantEntryInfo):
+    """
+    VariantEntryInfo that belongs to a SQLiteDatasetStore. Every update_object call is written through to the store,
+    so this object can be dropped from memory at any time without losing information.
+    """
+
+    # weak references let the store find the objects of its rows that are still in use
+    __slots__ = ["_store", "_row_id", "__weakref__"]
+
+    def update_object(self, **kwargs):
+        """
+        This method updates attributes given in dict kwargs and writes them to the store.
+        :return:
+        """
+        super().update_object(**kwargs)
+        self._store.update(self)
+
+
+class DatasetStoreIndex:
+    """
+    Read only, dictionary like view of a SQLiteDatasetStore indexed by one attribute. It replaces the
+    dataset_index_helper dictionary when building in memory-bounded mode.
+    """
+
+    def __init__(self, store, attribute):
+        self._store = store
+        self._attribute = attribute
+
+    def keys(self):
+        return self._store.iter_distinct_values(self._attribute)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return self._store.count_distinct_values(self._attribute)
+
+    def __contains__(self, key):
+        return self._store.contains(self._attribute, key)
+
+    def __getitem__(self, key):
+        variant_entries = self._store.get_by_attribute(self._attribute, key)
+        if not variant_entries:
+            raise KeyError(key)
+        return variant_entries
+
+    def get(self, key, default=None):
+        return self._store.get_by_attribute(self._attribute, key) or default
+
+    def count(self, key):
+        """
+        Returns the number of entries indexed under a key, without loading them.
+        :param key:
+        :return:
+        """
+        return self._store.count(self._attribute, key)
+
+    def iter_entries(self, key):
+        """
+        Streams the entries indexed under a key, so that they don't all have to be in memory at once.
+        :param key:
+        :return:
+        """
+        return self._store.iter_by_attribute(self._attribute, key)
+
+
+class SQLiteDatasetStore:
+    """
+    Embedded on-disk store of VariantEntryInfo objects with an in-memory hot cache. It can be used instead of the
+    main_dataset list so that the memory used by a build is bounded by hot_cache_size instead of the archive size.
+
+    Every row has at most one object in memory: rows read again while their object is still in use, e.g. after it
+    left the hot cache, get that same object back, so updates made through one reference are never overwritten by a
+    stale copy.
+    """
+
+    # attributes that the builders index the dataset by. These are kept as separate, indexed columns.
+    INDEXED_ATTRIBUTES = ["id", "case_id", "rs_id", "coordinates"]
+
+    _INSERT_BUFFER_SIZE = 10000
+    _UPDATE_BUFFER_SIZE = 10000
+    _ITERATION_PAGE_SIZE = 1000
+
+    def __init__(self, file_name, hot_cache_size=100000):
+        """
+        :param file_name: sqlite file where the entries will be stored. Existing entries in it are dropped.
+        :param hot_cache_size: maximum number of entries kept in memory
+        """
+        self.file_name = file_name
+        self.hot_cache_size = hot_cache_size
+
+        self._lock = threading.RLock()
+        self._hot_cache = OrderedDict()
+        # every object of a row still in memory, whether it is in the hot cache or only referenced by a builder
+        self._live_entries = weakref.WeakValueDictionary()
+        # highest number of entries that were in memory at the same time
+        self.peak_live_entries = 0
+        self._insert_buffer = []
+        # column values of the rows updated since the last flush, by row id
+        self._update_buffer = {}
+
+        self._connection = sqlite3.connect(
+            file_name, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute("DROP TABLE IF EXISTS entries")
+        self._connection.execute(
+            "CREATE TABLE entries ({columns}, data BLOB)".format(
+                columns=", ".join(self.INDEXED_ATTRIBUTES)
+            )
+        )
+        for attribute in self.INDEXED_ATTRIBUTES:
+            self._connection.execute(
+                "CREATE INDEX entries_{attribute} ON entries ({attribute})".format(
+                    attribute=attribute
+                )
+            )
+
+    def __len__(self):
+        with self._lock:
+            self._flush_buffers()
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[
+                0
+            ]
+
+    def __iter__(self):
+        """
+        Streams every entry of the store in insertion order.
+        :return:
+        """
+        return self._iter_rows("1", ())
+
+    def append(self, variant_entry):
+        """
+        Adds one VariantEntryInfo to the store.
+        :param variant_entry:
+        :return:
+        """
+        with self._lock:
+            self._insert_buffer.append(self._serialize(variant_entry))
+            if len(self._insert_buffer) >= self._INSERT_BUFFER_SIZE:
+                self._flush_buffers()
+
+    def extend(self, variant_entries):
+        """
+        Adds every given VariantEntryInfo to the store.
+        :param variant_entries:
+        :return:
+        """
+        for variant_entry in variant_entries:
+            self.append(variant_entry)
+
+    def clear(self):
+        """
+        Removes every entry from the store.
+        :return:
+        """
+        with self._lock:
+            self._insert_buffer = []
+            self._update_buffer = {}
+            self._hot_cache.clear()
+            self._live_entries.clear()
+            self._connection.execute("DELETE FROM entries")
+
+    def update(self, stored_variant_entry):
+        """
+        Writes the current values of a StoredVariantEntryInfo back to the store. Updates are buffered and written in
+        a single transaction, at the latest before the store is read again.
+        :param stored_variant_entry:
+        :return:
+        """
+        with self._lock:
+            self._update_buffer[stored_variant_entry._row_id] = self._serialize(
+                stored_variant_entry
+            )
+            if len(self._update_buffer) >= self._UPDATE_BUFFER_SIZE:
+                self._flush_buffers()
+
+    def index_by(self, attribute):
+        """
+        Returns a dictionary like index of the store by the given attribute.
+        :param attribute: one of INDEXED_ATTRIBUTES
+        :return:
+        """
+        if attribute not in self.INDEXED_ATTRIBUTES:
+            raise ValueError(
+                "The dataset store can only be indexed by {attributes}".format(
+                    attributes=self.INDEXED_ATTRIBUTES
+                )
+            )
+        return DatasetStoreIndex(self, attribute)
+
+    def iter_distinct_values(self, attribute):
+        """
+        Streams the distinct values of an indexed attribute, None first and then in increasing order, reading them a
+        page at a time through the index of the attribute.
+        :param attribute:
+        :return:
+        """
+        if self.contains(attribute, None):
+            yield None
+
+        last_value = None
+        while True:
+            with self._lock:
+                self._flush_buffers()
+                if last_value is None:
+                    condition, parameters = "IS NOT NULL", ()
+                else:
+                    condition, parameters = "> ?", (last_value,)
+                values = [
+                    value
+                    for (value,) in self._connection.execute(
+                        "SELECT DISTINCT {attribute} FROM entries WHERE {attribute} {condition} "
+                        "ORDER BY {attribute} LIMIT ?".format(
+                            attribute=attribute, condition=condition
+                        ),
+                        parameters + (self._ITERATION_PAGE_SIZE,),
+                    )
+                ]
+
+            if not values:
+                return
+            for value in values:
+                yield value
+            last_value = values[-1]
+
+    def count_distinct_values(self, attribute):
+        """
+        Returns the number of distinct values of an indexed attribute, None included.
+        :param attribute:
+        :return:
+        """
+        with self._lock:
+            self._flush_buffers()
+            number_of_values = self._connection.execute(
+                "SELECT COUNT(DISTINCT {attribute}) FROM entries".format(
+                    attribute=attribute
+                )
+            ).fetchone()[0]
+        # COUNT leaves NULL out
+        return number_of_values + int(self.contains(attribute, None))
+
+    def contains(self, attribute, value):
+        with self._lock:
+            self._flush_buffers()
+            return (
+                self._connection.execute(
+                    "SELECT 1 FROM entries WHERE {attribute} IS ? LIMIT 1".format(
+                        attribute=attribute
+                    ),
+                    (value,),
+                ).fetchone()
+                is not None
+            )
+
+    def get_by_attribute(self, attribute, value):
+        """
+        Returns every entry whose indexed attribute equals the given value.
+        :param attribute:
+        :param value:
+        :return:
+        """
+        with self._lock:
+            self._flush_buffers()
+            return [
+                self._load_entry(row_id, data)
+                for row_id, data in self._connection.execute(
+                    "SELECT rowid, data FROM entries WHERE {attribute} IS ? ORDER BY rowid".format(
+                        attribute=attribute
+                    ),
+                    (value,),
+                )
+            ]
+
+    def iter_by_attribute(self, attribute, value):
+        """
+        Streams every entry whose indexed attribute equals the given value, a page at a time.
+        :param attribute:
+        :param value:
+        :return:
+        """
+        return self._iter_rows(
+            "{attribute} IS ?".format(attribute=attribute), (value,)
+        )
+
+    def count(self, attribute, value):
+        """
+        Returns the number of entries whose indexed attribute equals the given value.
+        :param attribute:
+        :param value:
+        :return:
+        """
+        with self._lock:
+            self._flush_buffers()
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM entries WHERE {attribute} IS ?".format(
+                    attribute=attribute
+                ),
+                (value,),
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._flush_buffers()
+            self._hot_cache.clear()
+            self._connection.close()
+
+    def _iter_rows(self, condition, parameters):
+        """
+        Streams the entries of the rows matching a condition in insertion order, reading them a page at a time. Pages
+        are small next to the hot cache, so that several threads streaming at once still fit in it.
+        :param condition: sql condition on the indexed columns
+        :param parameters: values of the condition placeholders
+        :return:
+        """
+        page_size = min(self._ITERATION_PAGE_SIZE, max(1, self.hot_cache_size // 4))
+        last_row_id = 0
+        while True:
+            with self._lock:
+                self._flush_buffers()
+                rows = self._connection.execute(
+                    "SELECT rowid, data FROM entries WHERE rowid > ? AND ({condition}) ORDER BY rowid LIMIT ?".format(
+                        condition=condition
+                    ),
+                    (last_row_id,) + tuple(parameters) + (page_size,),
+                ).fetchall()
+                variant_entries = [self._load_entry(row_id, data) for row_id, data in rows]
+
+            if not variant_entries:
+                return
+
+            for variant_entry in variant_entries:
+                yield variant_entry
+            last_row_id = rows[-1][0]
+            # the page isn't held while the next one is read
+            del variant_entries, variant_entry
+
+    def _flush_buffers(self):
+        """
+        Writes the buffered inserts and updates in a single transaction. Must be called while holding the lock.
+        :return:
+        """
+        if not self._insert_buffer and not self._update_buffer:
+            return
+
+        self._connection.execute("BEGIN")
+        if self._insert_buffer:
+            self._connection.executemany(
+                "INSERT INTO entries VALUES ({placeholders})".format(
+                    placeholders=", ".join(["?"] * (len(self.INDEXED_ATTRIBUTES) + 1))
+                ),
+                self._insert_buffer,
+            )
+        if self._update_buffer:
+            self._connection.executemany(
+                "UPDATE entries SET {columns}, data = ? WHERE rowid = ?".format(
+                    columns=", ".join(
+                        "{attribute} = ?".format(attribute=attribute)
+                        for attribute in self.INDEXED_ATTRIBUTES
+                    )
+                ),
+                [
+                    column_values + (row_id,)
+                    for row_id, column_values in self._update_buffer.items()
+                ],
+            )
+        self._connection.execute("COMMIT")
+        self._insert_buffer = []
+        self._update_buffer = {}
+
+    def _load_entry(self, row_id, data):
+        """
+        Returns the StoredVariantEntryInfo of a row, from the hot cache, or the object already in use for it if there
+        is one. Must be called while holding the lock.
+        :param row_id:
+        :param data:
+        :return:
+        """
+        if row_id in self._hot_cache:
+            self._hot_cache.move_to_end(row_id)
+            return self._hot_cache[row_id]
+
+        stored_variant_entry = self._live_entries.get(row_id)
+        if stored_variant_entry is None:
+            stored_variant_entry = StoredVariantEntryInfo.from_values(pickle.loads(data))
+            stored_variant_entry._store = self
+            stored_variant_entry._row_id = row_id
+            self._live_entries[row_id] = stored_variant_entry
+
+        # entries still referenced by the builders take room from the hot cache, since they stay in memory anyway
+        self._hot_cache[row_id] = stored_variant_entry
+        while self._hot_cache and (
+            len(self._hot_cache) > self.hot_cache_size
+            or len(self._live_entries) > self.hot_cache_size
+        ):
+            self._hot_cache.popitem(last=False)
+        self.peak_live_entries = max(self.peak_live_entries, len(self._live_entries))
+
+        return stored_variant_entry
+
+    def _serialize(self, variant_entry):
+        """
+        Returns the column values of an entry: its indexed attributes followed by all its values pickled.
+        :param variant_entry:
+        :return:
+        """
+        return tuple(
+            getattr(variant_entry, attribute) for attribute in self.INDEXED_ATTRIBUTES
+        ) + (pickle.dumps(tuple(variant_entry), protocol=pickle.HIGHEST_PROTOCOL),)
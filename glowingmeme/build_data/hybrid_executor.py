@@ -0,0 +1,207 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+
+from glowingmeme.instrumentation.profiling import StackSampler
+
+
+def _extract_batch(extract_function, batch, sample_interval=None):
+    """
+    Runs in a worker process: extracts the record of every fetched payload of a batch.
+    NOTE: this function needs to be out of any class as it is pickled to be sent to the worker processes.
+    :param extract_function:
+    :param batch: list of (work_item, payload)
+    :param sample_interval: if given, the worker process is sampled every this many seconds during the extraction
+    :return: list of (work_item, record), dictionary of folded stack -> count sampled in the worker, or None
+    """
+    if sample_interval is None:
+        return [
+            (work_item, extract_function(work_item, payload))
+            for work_item, payload in batch
+        ], None
+
+    stack_sampler = StackSampler(sample_interval)
+    stack_sampler.start()
+    try:
+        records = [
+            (work_item, extract_function(work_item, payload))
+            for work_item, payload in batch
+        ]
+    finally:
+        stack_sampler.stop()
+    return records, dict(stack_sampler.stack_counts)
+
+
+class HybridExecutor:
+    """
+    Splits per-item work in three steps so that network waits and CPU work don't compete for the GIL:
+    - I/O threads fetch the raw payload of each work item, and nothing else
+    - a process pool decodes batches of payloads and extracts the few values needed into compact records
+    - the records are handed back to the calling thread in bulk, which applies them to the dataset
+    Records can be kept in a cache across runs, in which case the work items whose record is cached skip the first two
+    steps. The number of fetched payloads waiting to be extracted is bounded, so the fetches stall instead of piling up
+    responses in memory when the extraction is the bottleneck.
+
+    Extract functions are sent to the worker processes, so they have to be picklable, i.e. module level functions,
+    static methods or class methods. Worker processes are spawned rather than forked, since forking a process whose
+    I/O threads hold locks can deadlock the children. Spawning is slow, so the processes are started by the first
+    run and reused by the following ones until the executor is closed.
+    """
+
+    _START_METHOD = "spawn"
+    _NO_MORE_WORK = object()
+
+    # fetches in flight per I/O worker, so that a worker never waits for the next work item to be handed out
+    _FETCHES_PER_IO_WORKER = 2
+    # batches waiting in the process pool per CPU worker, beyond which no more payloads are fetched
+    _BATCHES_PER_CPU_WORKER = 2
+
+    def __init__(self, io_workers=None, cpu_workers=None, batch_size=16, stage_profiler=None):
+        """
+        :param io_workers: number of threads fetching payloads, defaults to the number of CPUs
+        :param cpu_workers: number of processes extracting records, defaults to the number of CPUs
+        :param batch_size: number of payloads sent to a worker process at once
+        :param stage_profiler: optional StageProfiler, in which case the worker processes sample their extractions
+        at its interval and their stacks are added to the profile of the current stage
+        """
+        self.io_workers = io_workers if io_workers else os.cpu_count()
+        self.cpu_workers = cpu_workers if cpu_workers else os.cpu_count()
+        self.batch_size = batch_size
+        self.stage_profiler = stage_profiler
+
+        self._cpu_executor = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Stops the worker processes, if they were started. A following run starts new ones.
+        :return:
+        """
+        with self._lock:
+            cpu_executor, self._cpu_executor = self._cpu_executor, None
+        if cpu_executor is not None:
+            cpu_executor.shutdown()
+
+    def _get_cpu_executor(self):
+        """
+        Returns the pool of worker processes, starting it if this is its first use.
+        :return: ProcessPoolExecutor
+        """
+        with self._lock:
+            if self._cpu_executor is None:
+                self._cpu_executor = ProcessPoolExecutor(
+                    max_workers=self.cpu_workers,
+                    mp_context=multiprocessing.get_context(self._START_METHOD),
+                )
+            return self._cpu_executor
+
+    def run(
+        self,
+        work_items,
+        fetch_function,
+        extract_function,
+        apply_function,
+        record_cache=None,
+    ):
+        """
+        Fetches, extracts and applies every work item. Work items are fetched in the given order.
+        :param work_items: iterable of work items
+        :param fetch_function: function of a work item returning its payload, run in the I/O threads. Work items
+        whose payload is None are skipped.
+        :param extract_function: function of a work item and its payload returning its record, which can't be None,
+        run in the worker processes
+        :param apply_function: function of a list of (work_item, record), run in the calling thread
+        :param record_cache: optional RequestCache of records by work item. Work items with a cached record are
+        applied without being fetched, and the records extracted are cached.
+        :return:
+        """
+        work_items = iter(work_items)
+        max_fetches = self.io_workers * self._FETCHES_PER_IO_WORKER
+        max_batches = self.cpu_workers * self._BATCHES_PER_CPU_WORKER
+        sample_interval = (
+            self.stage_profiler.interval if self.stage_profiler is not None else None
+        )
+
+        cpu_executor = self._get_cpu_executor()
+        with ThreadPoolExecutor(
+            max_workers=self.io_workers, thread_name_prefix="HybridFetch"
+        ) as io_executor:
+
+            fetches = {}
+            extractions = set()
+            batch = []
+            cached_records = []
+            work_items_left = True
+
+            while True:
+                # new fetches are only started while the worker processes keep up with the fetched payloads
+                while (
+                    work_items_left
+                    and len(fetches) < max_fetches
+                    and len(extractions) < max_batches
+                ):
+                    work_item = next(work_items, self._NO_MORE_WORK)
+                    if work_item is self._NO_MORE_WORK:
+                        work_items_left = False
+                        break
+
+                    record = (
+                        record_cache.get(work_item) if record_cache is not None else None
+                    )
+                    if record is not None:
+                        cached_records.append((work_item, record))
+                        if len(cached_records) >= self.batch_size:
+                            apply_function(cached_records)
+                            cached_records = []
+                        continue
+                    fetches[io_executor.submit(fetch_function, work_item)] = work_item
+
+                if cached_records and not work_items_left:
+                    apply_function(cached_records)
+                    cached_records = []
+
+                # the last payloads don't make a full batch
+                if batch and not fetches and not work_items_left:
+                    extractions.add(
+                        cpu_executor.submit(
+                            _extract_batch, extract_function, batch, sample_interval
+                        )
+                    )
+                    batch = []
+
+                if not fetches and not extractions:
+                    break
+
+                done, _ = wait(
+                    list(fetches) + list(extractions), return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    if future in extractions:
+                        extractions.remove(future)
+                        records, stack_counts = future.result()
+                        if stack_counts:
+                            self.stage_profiler.add_worker_stacks(stack_counts)
+                        if record_cache is not None:
+                            for work_item, record in records:
+                                record_cache.put(work_item, record)
+                        apply_function(records)
+                        continue
+
+                    work_item = fetches.pop(future)
+                    payload = future.result()
+                    if payload is None:
+                        continue
+                    batch.append((work_item, payload))
+                    if len(batch) >= self.batch_size:
+                        extractions.add(
+                            cpu_executor.submit(
+                                _extract_batch, extract_function, batch, sample_interval
+                            )
+                        )
+                        batch = []
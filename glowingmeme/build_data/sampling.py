@@ -0,0 +1,134 @@
+import hashlib
+from collections import Counter
+
+
+class StratifiedCaseSampler:
+    """
+    Reproducible stratified sample of the cases listed by CVA, for builds that only need the statistical shape of
+    the dataset. Cases are stratified by case status, outcome (positive when the case has reported variants) and
+    bucket of their number of variants, and each case is kept when a hash of the seed and its id falls below the
+    sampling fraction. The decision only depends on the case itself, so cases are sampled as they are listed, the
+    same seed always gives the same sample, and every stratum is sampled at the same rate.
+    Strata too small to get a case that way are given their case with the lowest hash, so that none of them is
+    missing from the sample.
+    """
+
+    POSITIVE = "positive"
+    NEGATIVE = "negative"
+
+    _HASH_RANGE = 2 ** 64
+
+    def __init__(self, fraction, seed=0):
+        """
+        :param fraction: share of the cases of each stratum kept in the sample, between 0 and 1
+        :param seed: cases are sampled differently for each seed
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError(
+                "The sampling fraction must be between 0 and 1, not {}".format(fraction)
+            )
+        self.fraction = fraction
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every case offered so far.
+        :return:
+        """
+        self.population_counts = Counter()
+        self.sample_counts = Counter()
+        # lowest hash case of each stratum that has no sampled case yet, as (hash, case id, case)
+        self._fallback_cases = {}
+
+    def offer(self, case_id, case, case_status):
+        """
+        Decides whether a listed case belongs to the sample.
+        :param case_id:
+        :param case: case json, as listed by CVA
+        :param case_status: status under which the case was listed
+        :return: True if the case is sampled
+        """
+        stratum = self.get_stratum(case, case_status)
+        self.population_counts[stratum] += 1
+
+        case_hash = self._get_case_hash(case_id)
+        if case_hash < self.fraction:
+            self.sample_counts[stratum] += 1
+            self._fallback_cases.pop(stratum, None)
+            return True
+
+        if not self.sample_counts[stratum]:
+            fallback_case = self._fallback_cases.get(stratum)
+            if fallback_case is None or case_hash < fallback_case[0]:
+                self._fallback_cases[stratum] = (case_hash, case_id, case)
+        return False
+
+    def pop_fallback_cases(self):
+        """
+        Returns the cases that are sampled because their stratum would be empty otherwise, once every case was
+        offered.
+        :return: list of (case id, case)
+        """
+        fallback_cases = []
+        for stratum, (_, case_id, case) in sorted(self._fallback_cases.items()):
+            self.sample_counts[stratum] += 1
+            fallback_cases.append((case_id, case))
+        self._fallback_cases = {}
+        return fallback_cases
+
+    def summary(self):
+        """
+        Describes the sample, so that it can be saved next to the datasets built from it.
+        :return:
+        """
+        return {
+            "sample": True,
+            "fraction": self.fraction,
+            "seed": self.seed,
+            "population_cases": sum(self.population_counts.values()),
+            "sampled_cases": sum(self.sample_counts.values()),
+            "strata": [
+                {
+                    "case_status": case_status,
+                    "outcome": outcome,
+                    "variants": variant_count_bucket,
+                    "population_cases": population_count,
+                    "sampled_cases": self.sample_counts[
+                        (case_status, outcome, variant_count_bucket)
+                    ],
+                }
+                for (
+                    case_status,
+                    outcome,
+                    variant_count_bucket,
+                ), population_count in sorted(self.population_counts.items())
+            ],
+        }
+
+    @classmethod
+    def get_stratum(cls, case, case_status):
+        """
+        Returns the stratum of a case.
+        :param case:
+        :param case_status:
+        :return: case status, outcome, bucket of the number of variants as "<min>-<max>"
+        """
+        outcome = cls.POSITIVE if case.get("reportedVariants") else cls.NEGATIVE
+        bucket = len(case.get("allVariants") or []).bit_length()
+        if bucket == 0:
+            variant_count_bucket = "0-0"
+        else:
+            variant_count_bucket = "{}-{}".format(2 ** (bucket - 1), 2 ** bucket - 1)
+        return case_status, outcome, variant_count_bucket
+
+    def _get_case_hash(self, case_id):
+        """
+        Returns a number between 0 and 1 that only depends on the seed and the case id.
+        :param case_id:
+        :return:
+        """
+        digest = hashlib.sha1(
+            "{seed}:{case_id}".format(seed=self.seed, case_id=case_id).encode("utf-8")
+        ).digest()
+        return int.from_bytes(digest[:8], "big") / self._HASH_RANGE
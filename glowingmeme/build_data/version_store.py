@@ -0,0 +1,367 @@
+import os
+import csv
+import gzip
+import json
+
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class DatasetVersionStore:
+    """
+    Folder of dataset versions where each version is kept as the rows added, removed and changed since its parent
+    version, with a full snapshot every snapshot_interval versions. Rows are kept as their csv values, so that
+    materializing a version gives the same rows as its csv. They are identified by their (case_id, id,
+    reported_outcome) and an ordinal, which tells apart the entries of a version that share all three. Ordinals
+    follow the order of the csv values of those entries, so that they don't depend on the order of the build.
+
+    The folder holds a manifest.json describing the versions, and one gzipped csv per version, either a snapshot
+    (an ordinal column followed by the header and rows) or a delta (change and ordinal columns followed by the
+    header and rows, where removed rows keep their last values).
+    """
+
+    ADDED = "added"
+    REMOVED = "removed"
+    CHANGED = "changed"
+
+    SNAPSHOT = "snapshot"
+    DELTA = "delta"
+
+    KEY_ATTRIBUTES = ["case_id", "id", "reported_outcome"]
+
+    _MANIFEST = "manifest.json"
+    _CHANGE_COLUMN = "change"
+    _ORDINAL_COLUMN = "ordinal"
+    _VERSION_FILE_NAME = "glowingmeme_{version}_{type}.csv.gz"
+
+    def __init__(self, folder, snapshot_interval=10):
+        """
+        :param folder: folder of the store, created if needed
+        :param snapshot_interval: number of versions between two full snapshots
+        """
+        self.folder = folder
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(folder, exist_ok=True)
+
+        self._manifest_file_name = os.path.join(folder, self._MANIFEST)
+        self.versions = []
+        if os.path.exists(self._manifest_file_name):
+            with open(self._manifest_file_name) as manifest_file:
+                self.versions = json.load(manifest_file)["versions"]
+
+    @property
+    def latest_version(self):
+        """
+        Returns the number of the latest version, or None if the store is empty.
+        :return:
+        """
+        if not self.versions:
+            return None
+        return self.versions[-1]["version"]
+
+    def add_version(self, variant_entries):
+        """
+        Stores the given entries as a new version, as a delta against the latest version unless a snapshot is due.
+        The latest version is streamed from its files while it is compared, so only the new version is held in memory.
+        :param variant_entries: iterable of VariantEntryInfo
+        :return: the manifest entry of the new version
+        """
+        header = list(VariantEntryInfo.VARIANT_INFO_VALUES)
+        key_positions = [header.index(attribute) for attribute in self.KEY_ATTRIBUTES]
+
+        # entries sharing their key attributes, e.g. a variant both reported and not reported, are all kept
+        rows_by_key = {}
+        for variant_entry in variant_entries:
+            row = self._to_csv_values(variant_entry)
+            rows_by_key.setdefault(
+                tuple(row[position] for position in key_positions), []
+            ).append(row)
+
+        # the same entries get the same ordinals in every build, whatever order they were built in
+        rows = {}
+        for key, key_rows in rows_by_key.items():
+            key_rows.sort()
+            for ordinal, row in enumerate(key_rows):
+                rows[key + (ordinal,)] = row
+        del rows_by_key
+
+        parent = self.versions[-1] if self.versions else None
+        version = {
+            "version": 0 if parent is None else parent["version"] + 1,
+            "parent": None if parent is None else parent["version"],
+            "rows": len(rows),
+        }
+
+        parent_rows = iter(())
+        if parent is not None:
+            parent_rows = self._iter_keyed_rows(parent["version"])
+            if next(parent_rows) != header:
+                # deltas are only kept between versions with the same columns
+                parent_rows.close()
+                parent_rows = iter(())
+                parent = None
+
+        change_counts = {self.ADDED: 0, self.REMOVED: 0, self.CHANGED: 0}
+        changes = self._count_changes(self._pop_changes(parent_rows, rows), change_counts)
+        if parent is None or self._versions_since_snapshot() >= self.snapshot_interval:
+            version["type"] = self.SNAPSHOT
+            self._write_version_file(
+                version,
+                [[self._ORDINAL_COLUMN] + header],
+                ([key[-1]] + row for key, row in rows.items()),
+            )
+            # the changes are still counted for the manifest
+            for _ in changes:
+                pass
+        else:
+            version["type"] = self.DELTA
+            self._write_version_file(
+                version,
+                [[self._CHANGE_COLUMN, self._ORDINAL_COLUMN] + header],
+                ([change, key[-1]] + row for change, key, row in changes),
+            )
+        version.update(change_counts)
+
+        self.versions.append(version)
+        self._save_manifest()
+        return version
+
+    def materialize(self, version_number):
+        """
+        Yields the rows of a version, as csv values ordered as its header, which is yielded first.
+        :param version_number:
+        :return:
+        """
+        keyed_rows = self._iter_keyed_rows(version_number)
+        yield next(keyed_rows)
+        for _, row in keyed_rows:
+            yield row
+
+    def get_header(self, version_number):
+        """
+        Returns the columns of a version.
+        :param version_number:
+        :return:
+        """
+        version_rows = self._iter_version_file(self._get_chain(version_number)[-1])
+        header = next(version_rows)
+        version_rows.close()
+        return header
+
+    def iter_changes(self, from_version, to_version):
+        """
+        Yields the (change, row) pairs that turn a version into a later one, where change is one of ADDED, REMOVED or
+        CHANGED. Only the deltas between both versions are read, unless there is a snapshot in between, in which case
+        both versions are materialized and compared.
+        :param from_version:
+        :param to_version:
+        :return:
+        """
+        if to_version < from_version:
+            raise ValueError(
+                "Can't stream changes from version {} back to version {}".format(
+                    from_version, to_version
+                )
+            )
+
+        versions_by_number = {version["version"]: version for version in self.versions}
+        chain = []
+        version_number = to_version
+        while version_number != from_version:
+            chain.append(versions_by_number[version_number])
+            version_number = chain[-1]["parent"]
+
+        # snapshots don't record what changed, so they are compared with their previous version
+        if any(version["type"] == self.SNAPSHOT for version in chain):
+            from_rows = self._iter_keyed_rows(from_version)
+            next(from_rows)
+            to_rows = self._iter_keyed_rows(to_version)
+            next(to_rows)
+            for change, _, row in self._pop_changes(from_rows, dict(to_rows)):
+                yield change, row
+            return
+
+        # the changes of consecutive deltas are merged into one per row. A changed row that ends up with its original
+        # values is still reported as changed, since deltas only keep the new values of changed rows.
+        net_changes = {}
+        for version in reversed(chain):
+            version_changes = self._iter_version_file(version)
+            next(version_changes)
+            for change, key, row in version_changes:
+                if key not in net_changes:
+                    # whether the row was in from_version, and its values there if known
+                    net_changes[key] = [
+                        change != self.ADDED,
+                        row if change == self.REMOVED else None,
+                        None,
+                        None,
+                    ]
+                # the row values in the latest version read, and its last values before being removed
+                if change == self.REMOVED:
+                    net_changes[key][2:] = [None, row]
+                else:
+                    net_changes[key][2] = row
+
+        for in_from_version, original_row, row, removed_row in net_changes.values():
+            if not in_from_version and row is not None:
+                yield self.ADDED, row
+            elif in_from_version and row is None:
+                yield self.REMOVED, removed_row
+            elif in_from_version and row != original_row:
+                yield self.CHANGED, row
+
+    def export_csv(self, version_number, file_name):
+        """
+        Writes a version as a plain csv, as saved by BuildDataset.save_data_to_csv.
+        :param version_number:
+        :param file_name:
+        :return:
+        """
+        with open(file_name, "w") as csv_file:
+            csv.writer(csv_file, delimiter=",").writerows(self.materialize(version_number))
+
+    def _iter_keyed_rows(self, version_number):
+        """
+        Streams a version from its latest snapshot. The deltas since are small next to the snapshot, so their net
+        changes are read first and applied to the snapshot rows as they are read.
+        :param version_number:
+        :return: generator of the header, and then of the (key, row) of every row
+        """
+        snapshot, *deltas = self._get_chain(version_number)
+
+        # row key -> row values, or None if the row was removed
+        delta_rows = {}
+        for version in deltas:
+            version_changes = self._iter_version_file(version)
+            next(version_changes)
+            for change, key, row in version_changes:
+                delta_rows[key] = None if change == self.REMOVED else row
+
+        snapshot_rows = self._iter_version_file(snapshot)
+        yield next(snapshot_rows)
+        for _, key, row in snapshot_rows:
+            if key in delta_rows:
+                row = delta_rows.pop(key)
+                if row is None:
+                    continue
+            yield key, row
+
+        # the rows added by the deltas
+        for key, row in delta_rows.items():
+            if row is not None:
+                yield key, row
+
+    def _get_chain(self, version_number):
+        """
+        Returns the manifest entries from the latest snapshot up to the given version.
+        :param version_number:
+        :return:
+        """
+        versions_by_number = {version["version"]: version for version in self.versions}
+        if version_number not in versions_by_number:
+            raise KeyError("Unknown dataset version {}".format(version_number))
+
+        chain = [versions_by_number[version_number]]
+        while chain[-1]["type"] != self.SNAPSHOT:
+            chain.append(versions_by_number[chain[-1]["parent"]])
+        return chain[::-1]
+
+    def _pop_changes(self, old_rows, new_rows):
+        """
+        Compares two versions, taking the rows of the newer one out of new_rows as they are compared.
+        :param old_rows: iterable of (row key, csv values) of the older version
+        :param new_rows: dictionary of row key -> csv values of the newer version
+        :return: generator of (change, row key, row), where removed rows keep their old values
+        """
+        for key, old_row in old_rows:
+            row = new_rows.pop(key, None)
+            if row is None:
+                yield self.REMOVED, key, old_row
+            elif row != old_row:
+                yield self.CHANGED, key, row
+
+        # the rows left weren't in the older version
+        while new_rows:
+            key, row = new_rows.popitem()
+            yield self.ADDED, key, row
+
+    @staticmethod
+    def _count_changes(changes, change_counts):
+        """
+        Counts the changes of each type as they go through.
+        :param changes: iterable of (change, row key, row)
+        :param change_counts: dictionary of change -> number of changes, updated as the changes are consumed
+        :return: generator of the changes
+        """
+        for change, key, row in changes:
+            change_counts[change] += 1
+            yield change, key, row
+
+    def _versions_since_snapshot(self):
+        """
+        Returns the number of versions since, and including, the latest snapshot.
+        :return:
+        """
+        if not self.versions:
+            return 0
+        return len(self._get_chain(self.latest_version))
+
+    def _write_version_file(self, version, header_rows, rows):
+        """
+        Writes the file of a version and records its name in the manifest entry.
+        :param version:
+        :param header_rows:
+        :param rows:
+        :return:
+        """
+        version["file"] = self._VERSION_FILE_NAME.format(
+            version=version["version"], type=version["type"]
+        )
+        with gzip.open(os.path.join(self.folder, version["file"]), "wt", newline="") as version_file:
+            version_csv = csv.writer(version_file, delimiter=",")
+            version_csv.writerows(header_rows)
+            version_csv.writerows(rows)
+
+    def _iter_version_file(self, version):
+        """
+        Streams the rows of a version file.
+        :param version:
+        :return: generator of the header of the dataset, and then of the (change, row key, row) of every row, where
+        change is None for the rows of a snapshot
+        """
+        with gzip.open(os.path.join(self.folder, version["file"]), "rt", newline="") as version_file:
+            version_csv = csv.reader(version_file, delimiter=",")
+            header = next(version_csv)
+
+            has_change = version["type"] == self.DELTA
+            # the change and ordinal columns come before the columns of the dataset
+            header = header[2:] if has_change else header[1:]
+            yield header
+
+            key_positions = [header.index(attribute) for attribute in self.KEY_ATTRIBUTES]
+            for row in version_csv:
+                change = row.pop(0) if has_change else None
+                ordinal = int(row.pop(0))
+                yield change, tuple(row[position] for position in key_positions) + (ordinal,), row
+
+    def _save_manifest(self):
+        """
+        Saves the manifest, replacing the previous one at once so that a crash never leaves it half written.
+        :return:
+        """
+        temporary_file_name = self._manifest_file_name + ".tmp"
+        with open(temporary_file_name, "w") as manifest_file:
+            json.dump(
+                {"snapshot_interval": self.snapshot_interval, "versions": self.versions},
+                manifest_file,
+                indent=2,
+            )
+        os.replace(temporary_file_name, self._manifest_file_name)
+
+    @staticmethod
+    def _to_csv_values(variant_entry):
+        """
+        Returns the values of an entry as written to a csv.
+        :param variant_entry:
+        :return:
+        """
+        return ["" if value is None else str(value) for value in variant_entry]
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import threading
+
+
+class WorkCostHistory:
+    """
+    Keeps the time each work item took, so that following runs can schedule the most expensive items first.
+    Costs are persisted in a json file of key -> seconds. Each cost is an exponential moving average of the times
+    recorded for its key, so that a single unusual run does not replace the whole history.
+    """
+
+    def __init__(self, file_name=None, smoothing=0.3):
+        """
+        :param file_name: json file with the costs of previous runs. If None, costs are only kept for this run.
+        :param smoothing: weight (0-1] of a new time in the moving average, 1 keeps only the last time
+        """
+        self.file_name = file_name
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._costs = {}
+
+        if file_name and os.path.exists(file_name):
+            with open(file_name) as cost_file:
+                self._costs = json.load(cost_file)
+
+    def __contains__(self, key):
+        return key in self._costs
+
+    def get(self, key, default=None):
+        return self._costs.get(key, default)
+
+    def record(self, key, cost):
+        """
+        Adds the time a work item took to its moving average cost.
+        :param key:
+        :param cost:
+        :return:
+        """
+        with self._lock:
+            previous_cost = self._costs.get(key)
+            if previous_cost is None:
+                self._costs[key] = cost
+            else:
+                self._costs[key] = previous_cost + self.smoothing * (cost - previous_cost)
+
+    def save(self):
+        """
+        Writes the costs to the history file, if there is one.
+        :return:
+        """
+        if not self.file_name:
+            return
+        with self._lock:
+            with open(self.file_name, "w") as cost_file:
+                json.dump(self._costs, cost_file)
+
+
+class LongestFirstScheduler:
+    """
+    Hands work items to a thread pool one at a time, most expensive first, so that big items are not picked up at
+    the end of a stage while every other worker sits idle. Item costs are estimated from a WorkCostHistory when
+    the item was seen in a previous run, or otherwise from a size estimate scaled by the average cost per unit of
+    size seen so far.
+    """
+
+    def __init__(self, cost_history=None):
+        self.cost_history = cost_history if cost_history is not None else WorkCostHistory()
+
+    def map(self, pool, function, work_items, estimate_size):
+        """
+        Applies function to every work item, in decreasing order of estimated cost, and records how long each
+        one took in the cost history.
+        :param pool: ThreadPool running the work
+        :param function: function of a single work item
+        :param work_items: iterable of hashable work items
+        :param estimate_size: function returning a size estimate for a work item, e.g. its number of variants
+        :return:
+        """
+        # chunksize of 1 so that idle workers pick up the next item as soon as they are done
+        for _ in pool.imap_unordered(
+            self.timed(function), self.order(work_items, estimate_size), chunksize=1
+        ):
+            pass
+
+    def order(self, work_items, estimate_size):
+        """
+        Returns the work items in decreasing order of estimated cost, for executors other than a ThreadPool.
+        :param work_items: iterable of hashable work items
+        :param estimate_size: function returning a size estimate for a work item, e.g. its number of variants
+        :return: list of work items
+        """
+        work_sizes = {work_item: estimate_size(work_item) for work_item in work_items}
+        cost_per_unit = self._get_cost_per_unit(work_sizes)
+
+        return sorted(
+            work_sizes.keys(),
+            key=lambda work_item: self.cost_history.get(
+                work_item, work_sizes[work_item] * cost_per_unit
+            ),
+            reverse=True,
+        )
+
+    def timed(self, function):
+        """
+        Wraps a function of a single work item so that the time each call takes is recorded in the cost history.
+        :param function:
+        :return:
+        """
+
+        def timed_function(work_item):
+            start_time = time.monotonic()
+            result = function(work_item)
+            self.cost_history.record(work_item, time.monotonic() - start_time)
+            return result
+
+        return timed_function
+
+    def _get_cost_per_unit(self, work_sizes):
+        """
+        Average recorded cost per unit of size, for the work items that have a recorded cost.
+        :param work_sizes:
+        :return:
+        """
+        total_cost = 0
+        total_size = 0
+        for work_item, size in work_sizes.items():
+            if work_item in self.cost_history:
+                total_cost += self.cost_history.get(work_item)
+                total_size += size
+        if total_cost and total_size:
+            return total_cost / total_size
+        return 1
@@ -1,24 +1,26 @@
 import os
-import yaml
-from requests import HTTPError
-
-from pyark.cva_client import CvaClient
-from pycellbase.cbclient import CellBaseClient
-from pycellbase.cbconfig import ConfigClient
-from pycipapi.cipapi_client import CipApiClient
 
 
 class Clients:
     """
-    Connect to production clients using the GEL_CREDENTIALS as an env variable
+    Connect to production clients using the GEL_CREDENTIALS as an env variable.
+    The client libraries are only imported when a client is requested, since they take seconds to import.
+    When given an HttpTransport, the connection pool of each host is mounted on the session the client library uses
+    for it, so every client sends its requests through the transport's shared pool of its host.
     """
 
+    # pycipapi retries failed connections and 5xx responses at the session level
+    _CIPAPI_RETRIES = 8
+
     PROD_CVA_HOST = "https://bio-prod-cva.gel.zone"
     PROD_CIPAPI_HOST = "https://cipapi-prod.gel.zone"
     PROD_CELLBASE_HOST = "https://cellbase.gel.zone/cellbase"
 
-    def __init__(self, cipapi_host=None, cva_host=None, cellbase_host=None):
+    def __init__(
+        self, cipapi_host=None, cva_host=None, cellbase_host=None, http_transport=None
+    ):
         self._credentials = self._get_credentials()
+        self._http_transport = http_transport
         self.cva_host = cva_host if cva_host else self.PROD_CVA_HOST
         self.cipapi_host = cipapi_host if cipapi_host else self.PROD_CIPAPI_HOST
         self.cellbase_host = cellbase_host if cellbase_host else self.PROD_CELLBASE_HOST
@@ -28,6 +30,8 @@ class Clients:
         Build credentials from GEL_CREDENTIALS env file.
         :return:
         """
+        import yaml
+
         credentials = {
             entry["name"]: entry
             for entry in yaml.load(
@@ -41,37 +45,76 @@ class Clients:
         Get and login to cipapi client
         :return:
         """
-        return CipApiClient(
+        from pycipapi.cipapi_client import CipApiClient
+
+        cipapi_client = CipApiClient(
             url_base=self.cipapi_host,
             user=self._credentials["cip_api_prod"]["username"],
             password=self._credentials["cip_api_prod"]["password"],
-            retries=8,
+            retries=self._CIPAPI_RETRIES,
         )
 
+        # the request methods of pycipapi are bound to its session, so they use the pool once it is mounted. The pool
+        # keeps the retries pycipapi mounts for every host
+        if self._http_transport is not None:
+            self._http_transport.mount(
+                cipapi_client.session, self.cipapi_host, retries=self._CIPAPI_RETRIES
+            )
+        return cipapi_client
+
     def get_cellbase_client(self):
         """
-        Get and login to cellbase variant client
+        Get and login to cellbase variation client
+        :return:
+        """
+        return self._get_cellbase_base_client().get_variation_client()
+
+    def get_cellbase_variant_client(self):
+        """
+        Get and login to cellbase variant client, used to annotate variants by their coordinates
         :return:
         """
+        return self._get_cellbase_base_client().get_variant_client()
+
+    def _get_cellbase_base_client(self):
+        """
+        Get cellbase client from which the specific clients are created
+        :return:
+        """
+        from pycellbase.cbclient import CellBaseClient
+        from pycellbase.cbconfig import ConfigClient
+
         cellbase_configuration = {
             "species": "hsapiens",
             "version": "v4",
-            "rest": {"hosts": [self.PROD_CELLBASE_HOST]},
+            "rest": {"hosts": [self.cellbase_host]},
         }
         cellbase_client = CellBaseClient(ConfigClient(cellbase_configuration))
-        return cellbase_client.get_variation_client()
+
+        # the specific clients share the session of the base client, which pycellbase doesn't expose otherwise
+        if self._http_transport is not None:
+            self._http_transport.mount(cellbase_client._session, self.cellbase_host)
+        return cellbase_client
 
     def get_cva_client(self):
         """
         Get and login to CVA client
         :return:
         """
-        return CvaClient(
-            url_base=self.PROD_CVA_HOST,
+        from pyark.cva_client import CvaClient
+
+        cva_client = CvaClient(
+            url_base=self.cva_host,
             user=self._credentials["cva_prod"]["username"],
             password=self._credentials["cva_prod"]["password"],
         )
 
+        # every pyark client, sub clients included, uses the session of their RestClient class, which pyark doesn't
+        # expose otherwise. pyark retries failed requests itself
+        if self._http_transport is not None:
+            self._http_transport.mount(cva_client._session, self.cva_host)
+        return cva_client
+
     def get_all_clients(self):
         """
         Get cipapi, cellbase and cva production clients.
@@ -92,6 +135,8 @@ def renew_access_token(func):
     """
 
     def wrapper(*args, **kwargs):
+        from requests import HTTPError
+
         try:
             return func(*args, **kwargs)
         except HTTPError:
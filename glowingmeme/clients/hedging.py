@@ -0,0 +1,258 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+logger = logging.getLogger("GlowingMeme")
+
+
+class RequestTimeoutError(Exception):
+    """
+    Raised when an upstream call does not return within its deadline.
+    """
+
+    pass
+
+
+class LatencyTracker:
+    """
+    Thread safe rolling window of the latencies measured during a run.
+    """
+
+    def __init__(self, window_size=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window_size)
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile):
+        """
+        Returns the given percentile (0-100) of the recorded latencies, or None if nothing was recorded.
+        :param percentile:
+        :return:
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+class HedgedRequests:
+    """
+    Runs idempotent upstream calls with a per-call deadline and, optionally, hedging: once a call takes longer than
+    the given percentile of the latencies measured so far in the run, a second identical request is sent and the
+    first response to arrive wins.
+    Calls run in their own daemon threads, so a call that hangs past its deadline neither pins the caller's worker
+    thread nor keeps the process from exiting.
+    """
+
+    # hedging only starts once enough latencies were measured for the percentile to be meaningful
+    _MIN_SAMPLES = 20
+
+    def __init__(self, timeout=None, hedge_percentile=None, max_workers=64):
+        """
+        :param timeout: deadline in seconds for each call, None for no deadline
+        :param hedge_percentile: latency percentile (0-100) after which a hedged request is sent, None to disable
+        :param max_workers: maximum number of requests in flight, hung ones included
+        """
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+
+        self._request_slots = threading.BoundedSemaphore(max_workers)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._latency_trackers = {}
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    def call(self, name, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs) enforcing the deadline and sending a hedged request if it is slow.
+        :param name: name of the call, latencies are tracked separately for each name
+        :param function:
+        :return: the result of the first request to succeed
+        """
+        latency_tracker = self._get_latency_tracker(name)
+        hedge_delay = None
+        if self.hedge_percentile is not None and len(latency_tracker) >= self._MIN_SAMPLES:
+            hedge_delay = latency_tracker.percentile(self.hedge_percentile)
+
+        with self._lock:
+            self.calls += 1
+
+        start_time = time.monotonic()
+        primary_request = self._submit(name, self.timeout, function, *args, **kwargs)
+        pending_requests = {primary_request}
+        last_error = None
+
+        while True:
+            elapsed_time = time.monotonic() - start_time
+            wait_time = None
+            if self.timeout is not None:
+                wait_time = max(0, self.timeout - elapsed_time)
+            if hedge_delay is not None:
+                hedge_wait_time = max(0, hedge_delay - elapsed_time)
+                wait_time = (
+                    hedge_wait_time if wait_time is None else min(wait_time, hedge_wait_time)
+                )
+
+            done_requests, pending_requests = wait(
+                pending_requests, timeout=wait_time, return_when=FIRST_COMPLETED
+            )
+
+            for done_request in done_requests:
+                if done_request.exception() is None:
+                    latency_tracker.record(time.monotonic() - start_time)
+                    if done_request is not primary_request:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return done_request.result()
+                last_error = done_request.exception()
+
+            if not pending_requests:
+                # failures are not hedged, retrying them is up to the clients
+                raise last_error
+
+            elapsed_time = time.monotonic() - start_time
+            if self.timeout is not None and elapsed_time >= self.timeout:
+                raise self._timeout_error(name)
+
+            if hedge_delay is not None and elapsed_time >= hedge_delay:
+                hedge_delay = None
+                # hedges are only sent when a request slot is free, they never wait for one
+                hedged_request = self._submit(name, 0, function, *args, **kwargs)
+                if hedged_request is not None:
+                    pending_requests.add(hedged_request)
+                    with self._lock:
+                        self.hedged += 1
+
+    def close(self):
+        """
+        Stops sending requests, calls made after this raise a RuntimeError. Requests still in flight are left to
+        finish or hang in their daemon threads, without waiting for them.
+        :return:
+        """
+        self._closed = True
+
+    def stats(self):
+        """
+        Returns how many calls were made, hedged, won by the hedged request and timed out.
+        :return:
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "timeouts": self.timeouts,
+            }
+
+    def _submit(self, name, slot_timeout, function, *args, **kwargs):
+        """
+        Runs function(*args, **kwargs) in a new daemon thread once a request slot is free.
+        :param name: name of the call
+        :param slot_timeout: seconds to wait for a free request slot, None to wait for as long as it takes
+        :param function:
+        :return: a Future of the result, or None for a hedge without a free slot
+        """
+        if self._closed:
+            raise RuntimeError("{name} was called after the requests were closed".format(name=name))
+        if not self._request_slots.acquire(timeout=slot_timeout):
+            if slot_timeout == 0:
+                return None
+            # every slot is taken by hung requests, so this call could not even start within its deadline
+            raise self._timeout_error(name)
+
+        request = Future()
+
+        def run_request():
+            try:
+                if request.set_running_or_notify_cancel():
+                    try:
+                        result = function(*args, **kwargs)
+                    except BaseException as error:
+                        request.set_exception(error)
+                    else:
+                        request.set_result(result)
+            finally:
+                self._request_slots.release()
+
+        threading.Thread(target=run_request, name="HedgedRequest", daemon=True).start()
+        return request
+
+    def _timeout_error(self, name):
+        """
+        Counts a call that timed out and returns the error to raise.
+        :param name: name of the call
+        :return:
+        """
+        with self._lock:
+            self.timeouts += 1
+        return RequestTimeoutError(
+            "{name} did not return within {timeout} seconds".format(
+                name=name, timeout=self.timeout
+            )
+        )
+
+    def _get_latency_tracker(self, name):
+        with self._lock:
+            if name not in self._latency_trackers:
+                self._latency_trackers[name] = LatencyTracker()
+            return self._latency_trackers[name]
+
+
+class HedgedClient:
+    """
+    Wraps a service client so that calls to the given idempotent read methods go through HedgedRequests. Every
+    other attribute is delegated to the wrapped client untouched.
+    """
+
+    def __init__(self, client, hedged_requests, namespace, hedged_methods):
+        self._client = client
+        self._hedged_requests = hedged_requests
+        self._namespace = namespace
+        self._hedged_methods = set(hedged_methods)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self._hedged_methods:
+            return attribute
+
+        def hedged_method(*args, **kwargs):
+            return self._hedged_requests.call(
+                "{namespace}.{name}".format(namespace=self._namespace, name=name),
+                attribute,
+                *args,
+                **kwargs
+            )
+
+        return hedged_method
+
+
+def skip_on_request_timeout(func):
+    """
+    This method is meant to be used as a decorator on per-item work of a builder, so that an item whose upstream call
+    timed out is logged, added to the timed_out_items of the builder and left without enrichment instead of failing
+    the whole stage.
+    :param func:
+    :return:
+    """
+
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except RequestTimeoutError as error:
+            logger.warning("Skipping {item}: {error}".format(item=args[1:], error=error))
+            args[0].timed_out_items.append(args[1])
+
+    return wrapper
@@ -0,0 +1,46 @@
+class FieldProjection:
+    """
+    Declarative projection of a json document onto the fields that are read from it, for services that can't project
+    on the server side. Fields are dotted paths, and the fields of lists of objects apply to each of their elements,
+    e.g. "interpreted_genome.interpreted_genome_data.variants.variantCalls" keeps the whole variantCalls list of
+    every variant of every interpreted genome, and nothing else of them.
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: list of dotted paths
+        """
+        self.fields = list(fields)
+        self._field_tree = {}
+        for field in self.fields:
+            field_tree = self._field_tree
+            path = field.split(".")
+            for key in path[:-1]:
+                # a parent field kept whole has no subtree to descend into
+                if key in field_tree and field_tree[key] is None:
+                    break
+                field_tree = field_tree.setdefault(key, {})
+            else:
+                field_tree[path[-1]] = None
+
+    def apply(self, document):
+        """
+        Returns a copy of the document with only the projected fields. Only the kept subtrees are walked, so the cost
+        is proportional to what is kept rather than to the size of the document.
+        :param document:
+        :return:
+        """
+        return self._project(document, self._field_tree)
+
+    def _project(self, document, field_tree):
+        if field_tree is None:
+            return document
+        if isinstance(document, list):
+            return [self._project(element, field_tree) for element in document]
+        if isinstance(document, dict):
+            return {
+                key: self._project(document[key], subtree)
+                for key, subtree in field_tree.items()
+                if key in document
+            }
+        return document
@@ -0,0 +1,80 @@
+import time
+
+
+class CvaVariantBodyClient:
+    """
+    Reads CVA variants as the undecoded body of their response, so that the I/O threads of a build only wait for the
+    network and leave decoding to the worker processes. pyark only returns variants decoded into protocol objects, so
+    the request is sent as its variants client would send it, through its session, url and authentication headers.
+    requests is only imported when the first variant is read, since it is slow to import.
+    """
+
+    # CVA fails erratically with server errors, which pyark retries after a second
+    _RETRY_WAIT = 1
+
+    def __init__(self, variants_client):
+        """
+        :param variants_client: pyark VariantsClient
+        """
+        self._variants_client = variants_client
+
+    def get_variant_body(self, identifier, include, retries=3):
+        """
+        Returns the body of the response to the query of one variant id, as get_variant_by_id sends it.
+        :param identifier: CVA variant id
+        :param include: fields of the variant included in the response
+        :param retries: number of times a failed request is sent again
+        :return: json body, whose response.result list has the variant if CVA knows it
+        """
+        from requests import RequestException
+
+        variants_client = self._variants_client
+        url = variants_client._build_url([variants_client._BASE_ENDPOINT, identifier])
+        request = "GET {url}".format(url=url)
+
+        attempt = 0
+        while True:
+            try:
+                response = variants_client._session.get(
+                    url, params={"include": include}, headers=variants_client._headers
+                )
+                if not 500 <= response.status_code < 600 or attempt >= retries:
+                    # pyark raises a RequestException for an unauthorised request once it has renewed its token
+                    variants_client._verify_response(response, request)
+                    return response.content
+            except RequestException:
+                if attempt >= retries:
+                    raise
+            attempt += 1
+            time.sleep(self._RETRY_WAIT)
+
+
+class CipapiCaseBodyClient:
+    """
+    Reads CIPAPI interpretation requests as the undecoded body of their response, for the same reason as
+    CvaVariantBodyClient. The request is the one get_case_raw sends, with the retries and token renewal of pycipapi.
+    """
+
+    def __init__(self, cipapi_client):
+        """
+        :param cipapi_client: pycipapi CipApiClient
+        """
+        self._cipapi_client = cipapi_client
+
+    def get_case_body(self, case_id, case_version):
+        """
+        Returns the body of the response to the query of one interpretation request, as get_case_raw sends it.
+        :param case_id:
+        :param case_version:
+        :return: json body of the interpretation request, None if it is empty
+        """
+        cipapi_client = self._cipapi_client
+        url = (
+            cipapi_client.build_url(
+                cipapi_client.url_base, cipapi_client.IR_ENDPOINT, case_id, case_version
+            )
+            + "/"
+        )
+        response = cipapi_client._request_call("get", url, params=None)
+        response = cipapi_client._verify_response(response, "get", url=url, params=None)
+        return response.content or None
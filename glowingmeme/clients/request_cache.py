@@ -0,0 +1,232 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class _InFlightRequest:
+    """
+    Holds the outcome of a request that is currently being fetched by one thread, so that other threads asking for
+    the same key can wait on it instead of sending the same request again.
+    """
+
+    __slots__ = ["event", "value", "error"]
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        """
+        Blocks until the owner thread has finished the request and returns its value (or raises its error).
+        :return:
+        """
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class RequestCache:
+    """
+    In-process, thread safe LRU memoization of upstream calls with request coalescing (single-flight).
+    Concurrent callers asking for the same key share one in-flight request and one cached result. Values older than
+    the maximum age are invalidated, so that a cache kept across builds still sees upstream changes.
+    """
+
+    DEFAULT_MAX_SIZE = 50000
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_age=None, clock=time.monotonic):
+        """
+        :param max_size: maximum number of values kept
+        :param max_age: seconds after which a value is fetched again, None to keep values until they are evicted
+        :param clock: function returning the current time in seconds
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        # key -> (time the value was stored, value)
+        self._cache = OrderedDict()
+        self._in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._is_fresh(key)
+
+    def get(self, key):
+        """
+        Returns the cached value for key, without fetching it.
+        :param key:
+        :return: the value, or None if it is not cached
+        """
+        with self._lock:
+            if self._is_fresh(key):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key][1]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """
+        Caches the value of a key that was fetched without going through the cache.
+        :param key:
+        :param value:
+        :return:
+        """
+        self._store(key, value)
+
+    def get_or_fetch(self, key, fetch_function):
+        """
+        Returns the cached value for key. If it is not cached, either waits for the thread that is already fetching
+        it or calls fetch_function() to fetch it, caching the result.
+        :param key: any hashable value
+        :param fetch_function: function with no arguments that fetches the value
+        :return:
+        """
+        with self._lock:
+            if self._is_fresh(key):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key][1]
+
+            in_flight_request = self._in_flight.get(key)
+            is_owner = in_flight_request is None
+            if is_owner:
+                self.misses += 1
+                in_flight_request = self._in_flight[key] = _InFlightRequest()
+            else:
+                self.coalesced += 1
+
+        if not is_owner:
+            return in_flight_request.result()
+
+        try:
+            in_flight_request.value = fetch_function()
+            self._store(key, in_flight_request.value)
+        except Exception as error:
+            in_flight_request.error = error
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight_request.event.set()
+
+        return in_flight_request.value
+
+    def get_many_or_fetch(self, keys, fetch_missing_function):
+        """
+        Batched version of get_or_fetch. Keys that are neither cached nor being fetched by another thread are fetched
+        with a single call to fetch_missing_function(missing_keys), which should return a dictionary of key -> value.
+        Keys absent from that dictionary are cached as None, so that unknown keys are not queried again.
+        :param keys: list of hashable values
+        :param fetch_missing_function: function that takes a list of keys and returns a dictionary
+        :return: dictionary of key -> value for every given key
+        """
+        results = {}
+        owned_requests = {}
+        waiting_requests = {}
+
+        with self._lock:
+            for key in keys:
+                if key in results or key in owned_requests or key in waiting_requests:
+                    continue
+                if self._is_fresh(key):
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    results[key] = self._cache[key][1]
+                elif key in self._in_flight:
+                    self.coalesced += 1
+                    waiting_requests[key] = self._in_flight[key]
+                else:
+                    self.misses += 1
+                    owned_requests[key] = self._in_flight[key] = _InFlightRequest()
+
+        if owned_requests:
+            try:
+                fetched_values = fetch_missing_function(list(owned_requests.keys()))
+                for key, in_flight_request in owned_requests.items():
+                    in_flight_request.value = fetched_values.get(key)
+                    self._store(key, in_flight_request.value)
+                    results[key] = in_flight_request.value
+            except Exception as error:
+                for in_flight_request in owned_requests.values():
+                    in_flight_request.error = error
+                raise
+            finally:
+                with self._lock:
+                    for key in owned_requests.keys():
+                        self._in_flight.pop(key, None)
+                for in_flight_request in owned_requests.values():
+                    in_flight_request.event.set()
+
+        for key, in_flight_request in waiting_requests.items():
+            results[key] = in_flight_request.result()
+
+        return results
+
+    def clear(self):
+        """
+        Drops every cached value. Statistics are kept.
+        :return:
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        Returns the hit, miss, coalesce, eviction and expiration counts of this cache.
+        :return:
+        """
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _is_fresh(self, key):
+        """
+        Returns whether a value is cached for key and younger than the maximum age, dropping it if it is too old.
+        Must be called holding the lock.
+        :param key:
+        :return:
+        """
+        cached = self._cache.get(key)
+        if cached is None:
+            return False
+        if self.max_age is not None and self._clock() - cached[0] > self.max_age:
+            del self._cache[key]
+            self.expirations += 1
+            return False
+        return True
+
+    def _store(self, key, value):
+        """
+        Adds a value to the cache, evicting the least recently used entries if the cache is full.
+        :param key:
+        :param value:
+        :return:
+        """
+        with self._lock:
+            self._cache[key] = (self._clock(), value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
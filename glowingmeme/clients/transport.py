@@ -0,0 +1,104 @@
+import os
+import threading
+
+
+class HttpTransport:
+    """
+    Keep-alive connection pools shared by all the service clients, one per host, sized to the concurrency of the
+    build, so that worker threads reuse open connections instead of paying a new TLS handshake, or discarding
+    connections when the pool is full.
+    The pools are mounted, as requests adapters, on the clients' own sessions for their host only, so the client
+    libraries keep their sessions, with their headers, authentication and adapters for any other host.
+    requests is only imported when the first pool is created, since it is slow to import.
+    """
+
+    # every worker thread (os.cpu_count() per stage) can have a hedged call in flight, and pycellbase splits big
+    # queries over 4 threads of its own
+    _CONNECTIONS_PER_WORKER = 4
+    _RETRY_BACKOFF_FACTOR = 0.8
+    _RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=None):
+        """
+        :param pool_size: maximum number of connections kept open per host
+        """
+        self.pool_size = (
+            pool_size if pool_size else self._CONNECTIONS_PER_WORKER * os.cpu_count()
+        )
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def mount(self, session, host, retries=0):
+        """
+        Mounts the shared connection pool of a host on a client session, creating it if this is its first use. The
+        session keeps using its own adapters for any other host.
+        :param session: requests.Session of a client library
+        :param host: url prefix of the host, e.g. https://cipapi-prod.gel.zone
+        :param retries: number of times failed connections and 5xx responses are retried by the pool itself. Only
+        used when the pool is created.
+        :return:
+        """
+        from urllib3.util import make_headers
+
+        with self._lock:
+            adapter = self._adapters.get(host)
+            if adapter is None:
+                adapter = self._adapters[host] = self._create_adapter(retries)
+        session.mount(host, adapter)
+        session.headers.update(make_headers(keep_alive=True, accept_encoding=True))
+
+    def _create_adapter(self, retries):
+        """
+        Creates a keep-alive adapter whose connection pool holds up to pool_size connections.
+        :param retries:
+        :return: requests.adapters.HTTPAdapter
+        """
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # without retries 5xx responses are left for the client library to handle, as with its own adapters
+        max_retries = 0
+        if retries:
+            max_retries = Retry(
+                total=retries,
+                read=retries,
+                connect=retries,
+                backoff_factor=self._RETRY_BACKOFF_FACTOR,
+                status_forcelist=self._RETRY_STATUSES,
+            )
+        return HTTPAdapter(pool_maxsize=self.pool_size, max_retries=max_retries)
+
+    def close(self):
+        """
+        Closes the open connections of every pool.
+        :return:
+        """
+        with self._lock:
+            for adapter in self._adapters.values():
+                adapter.close()
+
+    def stats(self):
+        """
+        Returns the number of requests sent and connections opened for each host. Every request above the number of
+        connections reused an open one.
+        :return: dictionary of host -> dictionary of requests, connections and reuse ratio
+        """
+        with self._lock:
+            adapters = dict(self._adapters)
+
+        transport_stats = {}
+        for host, adapter in adapters.items():
+            requests_sent = 0
+            connections_opened = 0
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    requests_sent += pool.num_requests
+                    connections_opened += pool.num_connections
+            transport_stats[host] = {
+                "requests": requests_sent,
+                "connections": connections_opened,
+                "reuse": 1 - connections_opened / requests_sent if requests_sent else 0.0,
+            }
+        return transport_stats
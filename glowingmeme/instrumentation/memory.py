@@ -0,0 +1,253 @@
+import sys
+import math
+import logging
+import resource
+import tracemalloc
+from itertools import islice
+from collections import Counter
+from contextlib import contextmanager
+
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+logger = logging.getLogger("GlowingMeme")
+
+
+def get_peak_memory_mb():
+    """
+    Returns the peak resident memory of this process in MB.
+    :return:
+    """
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports it in KB and macOS in bytes
+    if sys.platform == "darwin":
+        return peak_memory / 1024 / 1024
+    return peak_memory / 1024
+
+
+class MemoryProfiler:
+    """
+    Accounts for the memory of a build. As a stage hook, it traces the Python allocations of the process with
+    tracemalloc and records, for every stage, how much traced memory it left behind, its traced peak, the peak
+    resident memory of the process so far and the source lines that allocated the most. It also estimates how many
+    bytes each VariantEntryInfo field takes across a dataset, and which values are duplicated the most.
+    Tracing slows the build down and only sees this process, not the worker processes of the HybridExecutor.
+    """
+
+    _MB = 1024 * 1024
+    _VALUE_REPR_LENGTH = 80
+
+    def __init__(self, top_allocations=10, top_values=5, max_sampled_entries=200000):
+        """
+        :param top_allocations: number of source lines reported for each stage
+        :param top_values: number of most duplicated values reported for each field
+        :param max_sampled_entries: datasets bigger than this are estimated from a sample of their entries
+        """
+        self.top_allocations = top_allocations
+        self.top_values = top_values
+        self.max_sampled_entries = max_sampled_entries
+
+        # report of each stage, by stage name
+        self.stage_reports = {}
+        self._last_snapshot = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, stage_name):
+        """
+        Context manager recording the memory accounting of everything running in the process while it is open.
+        :param stage_name:
+        :return:
+        """
+        if self._last_snapshot is None:
+            self._last_snapshot = self._take_snapshot()
+        # reset_peak was added in Python 3.9, before it the traced peak is the peak of the whole build so far
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            traced_memory, traced_peak = tracemalloc.get_traced_memory()
+            snapshot = self._take_snapshot()
+            allocations = snapshot.compare_to(self._last_snapshot, "lineno")
+            self._last_snapshot = snapshot
+
+            stage_report = self.stage_reports[stage_name] = {
+                "traced_mb": traced_memory / self._MB,
+                "traced_growth_mb": sum(allocation.size_diff for allocation in allocations)
+                / self._MB,
+                "traced_peak_mb": traced_peak / self._MB,
+                "peak_rss_mb": get_peak_memory_mb(),
+                "top_allocations": [
+                    {
+                        "location": "{file_name}:{line}".format(
+                            file_name=allocation.traceback[0].filename,
+                            line=allocation.traceback[0].lineno,
+                        ),
+                        "mb": allocation.size / self._MB,
+                        "growth_mb": allocation.size_diff / self._MB,
+                        "blocks": allocation.count,
+                    }
+                    for allocation in allocations[: self.top_allocations]
+                ],
+            }
+            logger.info(
+                "Stage {stage} left {traced_growth_mb:+.1f} MB traced, {traced_mb:.1f} MB in total, with a traced "
+                "peak of {traced_peak_mb:.1f} MB and a peak RSS of {peak_rss_mb:.1f} MB so far. Top allocations: "
+                "{top_locations}".format(
+                    stage=stage_name,
+                    top_locations=", ".join(
+                        "{location} {mb:.1f} MB".format(**allocation)
+                        for allocation in stage_report["top_allocations"][:3]
+                    ),
+                    **stage_report
+                )
+            )
+
+    def get_report(self, variant_entries, indexes=None):
+        """
+        Returns the memory report of a build: the report of every stage so far, the estimated size of the dataset by
+        field and the estimated size of the given indexes.
+        :param variant_entries: entries of the dataset
+        :param indexes: optional dictionary of name -> index of entries, e.g. the dataset_index_helper of a builder
+        :return:
+        """
+        return {
+            "stages": self.stage_reports,
+            "dataset": self.estimate_dataset_memory(variant_entries),
+            "indexes": {
+                name: self.estimate_index_memory(index)
+                for name, index in (indexes or {}).items()
+            },
+        }
+
+    def estimate_dataset_memory(self, variant_entries):
+        """
+        Estimates the bytes taken by the entries themselves and by the values of each of their fields. Values shared
+        by several entries, e.g. the case values set by VariantEntryInfo.create_many, are only counted once, and
+        duplicated_mb is what could be saved if all the equal values of a field were shared.
+        :param variant_entries: list like object of VariantEntryInfo
+        :return:
+        """
+        number_of_entries = len(variant_entries)
+        stride = max(1, math.ceil(number_of_entries / self.max_sampled_entries))
+        sampled_entries = list(islice(variant_entries, 0, None, stride))
+        scale = number_of_entries / len(sampled_entries) if sampled_entries else 0
+
+        fields = {}
+        field_values = zip(*map(tuple, sampled_entries))
+        for field, values in zip(VariantEntryInfo.VARIANT_INFO_VALUES, field_values):
+            fields[field] = self._estimate_field_memory(
+                [value for value in values if value is not None], scale
+            )
+
+        return {
+            "entries": number_of_entries,
+            "sampled_entries": len(sampled_entries),
+            "entries_mb": sum(sys.getsizeof(variant_entry) for variant_entry in sampled_entries)
+            * scale
+            / self._MB,
+            "values_mb": sum(field_report["mb"] for field_report in fields.values()),
+            "duplicated_mb": sum(
+                field_report["duplicated_mb"] for field_report in fields.values()
+            ),
+            "fields": dict(
+                sorted(fields.items(), key=lambda field: field[1]["mb"], reverse=True)
+            ),
+        }
+
+    @classmethod
+    def estimate_index_memory(cls, index):
+        """
+        Estimates the bytes taken by an index of entries, i.e. a dictionary of key -> list of entries, not counting
+        the keys and entries, which belong to the dataset.
+        :param index:
+        :return:
+        """
+        # disk backed indexes are kept in their store
+        if not isinstance(index, dict):
+            return 0.0
+        return (
+            sys.getsizeof(index)
+            + sum(sys.getsizeof(variant_entries) for variant_entries in index.values())
+        ) / cls._MB
+
+    def _estimate_field_memory(self, values, scale):
+        """
+        Estimates the bytes taken by the values of a field.
+        :param values: values of the field in the sampled entries, None excluded
+        :param scale: number of entries per sampled entry
+        :return:
+        """
+        value_counts = Counter()
+        sizes_by_value = {}
+        # one of the values equal to each key, to report it
+        value_by_key = {}
+        objects_size = 0
+        seen_objects = set()
+        for value in values:
+            value_key = self._get_value_key(value)
+            value_counts[value_key] += 1
+            if id(value) in seen_objects:
+                continue
+            seen_objects.add(id(value))
+            value_size = self._get_size(value)
+            objects_size += value_size
+            sizes_by_value[value_key] = value_size
+            value_by_key[value_key] = value
+
+        return {
+            "mb": objects_size * scale / self._MB,
+            "values": round(len(values) * scale),
+            "distinct_values": len(value_counts),
+            "duplicated_mb": (objects_size - sum(sizes_by_value.values()))
+            * scale
+            / self._MB,
+            "top_values": [
+                {
+                    "value": repr(value_by_key[value_key])[: self._VALUE_REPR_LENGTH],
+                    "entries": round(count * scale),
+                    "bytes": sizes_by_value[value_key],
+                }
+                for value_key, count in value_counts.most_common(self.top_values)
+                if count > 1
+            ],
+        }
+
+    @staticmethod
+    def _get_value_key(value):
+        """
+        Returns a hashable key of a value, so that equal values are counted together.
+        :param value:
+        :return:
+        """
+        if isinstance(value, (dict, list)):
+            return repr(value)
+        return value
+
+    @staticmethod
+    def _get_size(value):
+        """
+        Returns the bytes taken by a value and, for dictionaries and lists, by the values they hold.
+        :param value:
+        :return:
+        """
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(
+                sys.getsizeof(key) + sys.getsizeof(element)
+                for key, element in value.items()
+            )
+        elif isinstance(value, list):
+            size += sum(sys.getsizeof(element) for element in value)
+        return size
+
+    @staticmethod
+    def _take_snapshot():
+        """
+        Takes a snapshot of the traced allocations, leaving out those of tracemalloc itself.
+        :return:
+        """
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger("GlowingMeme")
+
+
+class StackSampler:
+    """
+    Sampling profiler of every thread of the process. Most of the work of a build runs in thread pools, which a
+    deterministic profiler started in the main thread would not see, so instead the stacks of all threads are
+    sampled at a fixed interval and counted in the folded format used by flamegraph tools
+    (https://github.com/brendangregg/FlameGraph, speedscope, ...).
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        :param interval: seconds between samples
+        """
+        self.interval = interval
+        self.stack_counts = Counter()
+        self.number_of_samples = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="StackSampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def write_folded_stacks(self, file_name):
+        """
+        Writes the sampled stacks as "thread;frame;frame count" lines, outermost frame first.
+        :param file_name:
+        :return:
+        """
+        with open(file_name, "w") as folded_file:
+            for stack, count in self.stack_counts.most_common():
+                folded_file.write("{stack} {count}\n".format(stack=stack, count=count))
+
+    def get_top_functions(self, number_of_functions=10):
+        """
+        Returns the functions that were running (top of the stack) in most samples, with their share of samples.
+        :param number_of_functions:
+        :return: list of (function, fraction of samples)
+        """
+        function_counts = Counter()
+        for stack, count in self.stack_counts.items():
+            function_counts[stack.rsplit(";", 1)[-1]] += count
+
+        total_count = sum(function_counts.values()) or 1
+        return [
+            (function, count / total_count)
+            for function, count in function_counts.most_common(number_of_functions)
+        ]
+
+    def _sample(self):
+        sampler_thread_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_thread_id:
+                    continue
+                self.stack_counts[
+                    self._fold_stack(thread_names.get(thread_id, str(thread_id)), frame)
+                ] += 1
+            self.number_of_samples += 1
+
+    @staticmethod
+    def _fold_stack(thread_name, frame):
+        """
+        Returns the folded representation of the stack that ends in the given frame.
+        :param thread_name:
+        :param frame:
+        :return:
+        """
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(
+                "{function} ({file}:{line})".format(
+                    function=code.co_name,
+                    file=os.path.basename(code.co_filename),
+                    line=code.co_firstlineno,
+                )
+            )
+            frame = frame.f_back
+        # thread pools name their threads Thread-N, so the thread name prefix is enough to tell them apart
+        frames.append(thread_name.split("-")[0])
+        return ";".join(reversed(frames))
+
+
+class StageProfiler:
+    """
+    Profiles each stage of a build with a StackSampler and writes one folded stacks file per stage.
+    A StackSampler only sees the threads of its own process, so the worker processes of a HybridExecutor sample
+    themselves and their stacks are added to the stage with add_worker_stacks, under a WorkerProcess root frame.
+    """
+
+    WORKER_PROCESS = "WorkerProcess"
+
+    def __init__(self, output_folder, interval=0.005):
+        """
+        :param output_folder: folder where the <stage>.folded files are written
+        :param interval: seconds between samples
+        """
+        self.output_folder = output_folder
+        self.interval = interval
+        os.makedirs(output_folder, exist_ok=True)
+
+        self._stack_sampler = None
+        self._lock = threading.Lock()
+
+    def add_worker_stacks(self, stack_counts):
+        """
+        Adds the stacks sampled in a worker process to the profile of the current stage. Stacks sampled outside of
+        any stage are dropped.
+        :param stack_counts: dictionary of folded stack -> count, as sampled by the StackSampler of the worker
+        :return:
+        """
+        with self._lock:
+            if self._stack_sampler is None:
+                return
+            for stack, count in stack_counts.items():
+                self._stack_sampler.stack_counts[
+                    "{process};{stack}".format(process=self.WORKER_PROCESS, stack=stack)
+                ] += count
+
+    @contextmanager
+    def stage(self, stage_name):
+        """
+        Context manager that profiles everything running in the process while it is open.
+        :param stage_name:
+        :return:
+        """
+        stack_sampler = StackSampler(self.interval)
+        start_time = time.monotonic()
+        stack_sampler.start()
+        with self._lock:
+            self._stack_sampler = stack_sampler
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stack_sampler = None
+            stack_sampler.stop()
+            folded_file_name = os.path.join(
+                self.output_folder, "{stage}.folded".format(stage=stage_name)
+            )
+            stack_sampler.write_folded_stacks(folded_file_name)
+
+            logger.info(
+                "Stage {stage} took {seconds:.1f} seconds, profile written to {file_name}. Top functions: "
+                "{top_functions}".format(
+                    stage=stage_name,
+                    seconds=time.monotonic() - start_time,
+                    file_name=folded_file_name,
+                    top_functions=", ".join(
+                        "{function} {fraction:.0%}".format(
+                            function=function, fraction=fraction
+                        )
+                        for function, fraction in stack_sampler.get_top_functions(5)
+                    ),
+                )
+            )
+
+
+class StageTimer:
+    """
+    Measures the wall time of each stage of a build.
+    """
+
+    def __init__(self):
+        # seconds taken by each stage, by stage name
+        self.stage_seconds = {}
+
+    @contextmanager
+    def stage(self, stage_name):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage_name] = (
+                self.stage_seconds.get(stage_name, 0) + time.monotonic() - start_time
+            )
+
+
+class SlowCallLogger:
+    """
+    Logs the arguments and call stack of upstream calls slower than a threshold.
+    """
+
+    _MAX_ARGUMENT_LENGTH = 300
+
+    def __init__(self, threshold=10.0):
+        """
+        :param threshold: seconds after which a call is logged
+        """
+        self.threshold = threshold
+        self.slow_calls = 0
+        self._lock = threading.Lock()
+
+    def call(self, name, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs), logging it if it was slower than the threshold.
+        :param name:
+        :param function:
+        :return:
+        """
+        start_time = time.monotonic()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed_time = time.monotonic() - start_time
+            if elapsed_time >= self.threshold:
+                with self._lock:
+                    self.slow_calls += 1
+                logger.warning(
+                    "Slow upstream call {name} took {seconds:.1f} seconds with arguments {arguments}\n"
+                    "{stack}".format(
+                        name=name,
+                        seconds=elapsed_time,
+                        arguments=self._format_arguments(args, kwargs),
+                        stack="".join(traceback.format_stack()[:-1]),
+                    )
+                )
+
+    def _format_arguments(self, args, kwargs):
+        arguments = ", ".join(
+            [repr(argument) for argument in args]
+            + ["{}={!r}".format(key, value) for key, value in kwargs.items()]
+        )
+        if len(arguments) > self._MAX_ARGUMENT_LENGTH:
+            return arguments[: self._MAX_ARGUMENT_LENGTH] + "..."
+        return arguments
+
+
+class SlowCallClient:
+    """
+    Wraps a service client so that slow calls to the given methods are logged by a SlowCallLogger. Every other
+    attribute is delegated to the wrapped client untouched.
+    """
+
+    def __init__(self, client, slow_call_logger, namespace, logged_methods):
+        self._client = client
+        self._slow_call_logger = slow_call_logger
+        self._namespace = namespace
+        self._logged_methods = set(logged_methods)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self._logged_methods:
+            return attribute
+
+        def logged_method(*args, **kwargs):
+            return self._slow_call_logger.call(
+                "{namespace}.{name}".format(namespace=self._namespace, name=name),
+                attribute,
+                *args,
+                **kwargs
+            )
+
+        return logged_method
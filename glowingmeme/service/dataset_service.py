@@ -0,0 +1,313 @@
+import re
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+logger = logging.getLogger("GlowingMeme")
+
+
+class DatasetIndex:
+    """
+    Read only indexes of a built dataset by case_id, variant id, rs_id and genomic region. Entries are only
+    referenced, so an index costs a few pointers per entry on top of the dataset itself. The index carries the
+    version of its dataset, so that the two are always read together.
+    """
+
+    _CHROMOSOME = "chr"
+
+    def __init__(self, variant_entries, version=0, built_at=None):
+        """
+        :param variant_entries: iterable of VariantEntryInfo, as left by the last builder of a build
+        :param version: number of the build of the dataset in its service
+        :param built_at: timestamp of the end of the build
+        """
+        self.version = version
+        self.built_at = built_at
+        self.entries_by_attribute = {"case_id": {}, "id": {}, "rs_id": {}}
+        entries_by_chromosome = {}
+        self.size = 0
+
+        for variant_entry in variant_entries:
+            self.size += 1
+            for attribute, entries_by_value in self.entries_by_attribute.items():
+                value = getattr(variant_entry, attribute)
+                if value is None:
+                    continue
+                if value in entries_by_value:
+                    entries_by_value[value].append(variant_entry)
+                else:
+                    entries_by_value[value] = [variant_entry]
+
+            if variant_entry.chromosome and variant_entry.start is not None:
+                entries_by_chromosome.setdefault(variant_entry.chromosome, []).append(
+                    variant_entry
+                )
+
+        # entries of each chromosome sorted by start, with the length of their longest entry, so that a region
+        # query is a binary search followed by a scan of the entries that can overlap the region
+        self._starts_by_chromosome = {}
+        self._entries_by_chromosome = {}
+        self._max_length_by_chromosome = {}
+        for chromosome, entries in entries_by_chromosome.items():
+            entries.sort(key=self._get_start)
+            self._entries_by_chromosome[chromosome] = entries
+            self._starts_by_chromosome[chromosome] = [
+                variant_entry.start for variant_entry in entries
+            ]
+            self._max_length_by_chromosome[chromosome] = max(
+                self._get_end(variant_entry) - variant_entry.start
+                for variant_entry in entries
+            )
+
+    def get(self, attribute, value):
+        """
+        Returns the entries whose attribute (case_id, id or rs_id) has the given value.
+        :param attribute:
+        :param value:
+        :return: list of VariantEntryInfo
+        """
+        return self.entries_by_attribute[attribute].get(value, [])
+
+    def get_region(self, chromosome, start, end):
+        """
+        Returns the entries overlapping a region, ends included.
+        :param chromosome: with or without the chr prefix
+        :param start:
+        :param end:
+        :return: list of VariantEntryInfo, sorted by start
+        """
+        if not chromosome.startswith(self._CHROMOSOME):
+            chromosome = self._CHROMOSOME + chromosome
+        if chromosome not in self._entries_by_chromosome:
+            return []
+
+        starts = self._starts_by_chromosome[chromosome]
+        entries = self._entries_by_chromosome[chromosome]
+        first_position = bisect_left(
+            starts, start - self._max_length_by_chromosome[chromosome]
+        )
+        last_position = bisect_right(starts, end)
+        return [
+            variant_entry
+            for variant_entry in entries[first_position:last_position]
+            if self._get_end(variant_entry) >= start
+        ]
+
+    @staticmethod
+    def _get_start(variant_entry):
+        return variant_entry.start
+
+    @staticmethod
+    def _get_end(variant_entry):
+        return variant_entry.end if variant_entry.end is not None else variant_entry.start
+
+
+class DatasetService:
+    """
+    Long running process keeping the latest dataset and its indexes resident, and rebuilding it on a schedule.
+    Builds run in the same process as the lookups, so the clients stay logged in between builds, and the records
+    fetched by a build can be reused by the following ones, through the BuildContext the build function gives them.
+    Lookups keep being answered from the previous dataset while a rebuild runs, and a failed rebuild leaves it in
+    place until the next one.
+    """
+
+    def __init__(self, build_function, rebuild_interval=None):
+        """
+        :param build_function: function with no arguments that builds a dataset and returns its entries
+        :param rebuild_interval: seconds between the end of a build and the start of the next one, None to build once
+        """
+        self.build_function = build_function
+        self.rebuild_interval = rebuild_interval
+
+        # the version and build time of the dataset are kept with its index, so a single assignment swaps them all
+        self.dataset_index = None
+        self.building = False
+
+        self._stop_event = threading.Event()
+        self._rebuild_thread = None
+
+    def rebuild(self):
+        """
+        Builds a new dataset and, once indexed, swaps it with the one being served.
+        :return:
+        """
+        self.building = True
+        try:
+            start_time = time.monotonic()
+            variant_entries = self.build_function()
+            dataset_index = DatasetIndex(variant_entries, self.version + 1, time.time())
+            # a single assignment, so lookups see either the old or the new dataset, never a mix
+            self.dataset_index = dataset_index
+            logger.info(
+                "Serving dataset version {version} with {size} entries, built in {seconds:.0f} seconds".format(
+                    version=dataset_index.version,
+                    size=dataset_index.size,
+                    seconds=time.monotonic() - start_time,
+                )
+            )
+        except Exception:
+            logger.exception(
+                "Rebuilding the dataset failed, still serving version {}".format(
+                    self.version
+                )
+            )
+        finally:
+            self.building = False
+
+    @property
+    def version(self):
+        """
+        Returns the version of the dataset being served, 0 before the first build.
+        :return:
+        """
+        dataset_index = self.dataset_index
+        return dataset_index.version if dataset_index is not None else 0
+
+    def start_rebuilds(self):
+        """
+        Builds the first dataset and then rebuilds it every rebuild_interval seconds, in a background thread.
+        :return:
+        """
+        self._stop_event.clear()
+        self._rebuild_thread = threading.Thread(
+            target=self._rebuild_on_schedule, name="DatasetRebuild", daemon=True
+        )
+        self._rebuild_thread.start()
+
+    def stop(self):
+        """
+        Stops scheduling rebuilds. A rebuild already running is left to finish.
+        :return:
+        """
+        self._stop_event.set()
+
+    def status(self):
+        """
+        Returns the version, build time and size of the dataset being served.
+        :return:
+        """
+        dataset_index = self.dataset_index
+        if dataset_index is None:
+            return {"version": 0, "built_at": None, "building": self.building, "entries": 0}
+        return {
+            "version": dataset_index.version,
+            "built_at": dataset_index.built_at,
+            "building": self.building,
+            "entries": dataset_index.size,
+        }
+
+    def create_server(self, host="127.0.0.1", port=8000):
+        """
+        Creates the HTTP server answering the lookups, see _DatasetRequestHandler for its routes.
+        :param host:
+        :param port: 0 to pick any free port
+        :return: ThreadingHTTPServer, to be run with serve_forever
+        """
+        server = ThreadingHTTPServer((host, port), _DatasetRequestHandler)
+        server.daemon_threads = True
+        server.dataset_service = self
+        return server
+
+    def _rebuild_on_schedule(self):
+        while True:
+            self.rebuild()
+            if self.rebuild_interval is None or self._stop_event.wait(
+                self.rebuild_interval
+            ):
+                return
+
+
+class _DatasetRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of a DatasetService:
+    - GET /status
+    - GET /cases/<case_id>
+    - GET /variants/<variant id>
+    - GET /rs_ids/<rs_id>
+    - GET /regions/<chromosome>:<start>-<end>
+    Lookups return the matching entries as objects of VARIANT_INFO_VALUES, and take an optional assembly query
+    parameter to only return the entries of one assembly.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    _ATTRIBUTE_ROUTES = {"cases": "case_id", "variants": "id", "rs_ids": "rs_id"}
+    _REGION_ROUTE = "regions"
+    _REGION_PATTERN = re.compile(r"^(?P<chromosome>[^:]+):(?P<start>\d+)-(?P<end>\d+)$")
+
+    def do_GET(self):
+        dataset_service = self.server.dataset_service
+        url = urlsplit(self.path)
+        route, _, value = url.path.strip("/").partition("/")
+        value = unquote(value)
+
+        if route == "status":
+            self._send_json(200, dataset_service.status())
+            return
+
+        if route not in self._ATTRIBUTE_ROUTES and route != self._REGION_ROUTE:
+            self._send_json(404, {"error": "Unknown route {}".format(url.path)})
+            return
+
+        dataset_index = dataset_service.dataset_index
+        if dataset_index is None:
+            self._send_json(503, {"error": "The first dataset is still being built"})
+            return
+
+        if route == self._REGION_ROUTE:
+            region = self._REGION_PATTERN.match(value)
+            if region is None:
+                self._send_json(
+                    400, {"error": "Regions are written as <chromosome>:<start>-<end>"}
+                )
+                return
+            variant_entries = dataset_index.get_region(
+                region.group("chromosome"),
+                int(region.group("start")),
+                int(region.group("end")),
+            )
+        else:
+            variant_entries = dataset_index.get(self._ATTRIBUTE_ROUTES[route], value)
+
+        assembly = parse_qs(url.query).get("assembly")
+        if assembly:
+            variant_entries = [
+                variant_entry
+                for variant_entry in variant_entries
+                if variant_entry.assembly == assembly[0]
+            ]
+
+        self._send_json(
+            200,
+            {
+                "version": dataset_index.version,
+                "entries": [
+                    dict(zip(VariantEntryInfo.VARIANT_INFO_VALUES, variant_entry))
+                    for variant_entry in variant_entries
+                ],
+            },
+        )
+
+    def _send_json(self, status, document):
+        body = json.dumps(document, default=self._to_json).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, message_format, *args):
+        logger.debug(message_format % args)
+
+    @staticmethod
+    def _to_json(value):
+        # interpretation messages are kept as utf-8 bytes
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "replace")
+        return str(value)
@@ -0,0 +1,64 @@
+"""
+Reads a dataset version store written by GlowingMemeDazzlingPower --version-store.
+
+usage: python scripts/dataset_versions.py STORE list
+       python scripts/dataset_versions.py STORE materialize VERSION output.csv
+       python scripts/dataset_versions.py STORE diff FROM_VERSION TO_VERSION output.csv
+"""
+import os
+import sys
+import csv
+import argparse
+
+# the scripts are run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from glowingmeme.build_data.version_store import DatasetVersionStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("store", help="Folder of the version store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="List the versions of the store.")
+
+    materialize_parser = subparsers.add_parser(
+        "materialize", help="Write a version as a full csv."
+    )
+    materialize_parser.add_argument("version", type=int)
+    materialize_parser.add_argument("output")
+
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="Write the rows added, removed and changed between two versions as a csv, with a change column first.",
+    )
+    diff_parser.add_argument("from_version", type=int)
+    diff_parser.add_argument("to_version", type=int)
+    diff_parser.add_argument("output")
+    args = parser.parse_args()
+
+    version_store = DatasetVersionStore(args.store)
+
+    if args.command == "list":
+        for version in version_store.versions:
+            print(
+                "{version:5} {type:8} {rows:10} rows {added:8} added {removed:8} removed {changed:8} changed".format(
+                    **version
+                )
+            )
+
+    elif args.command == "materialize":
+        version_store.export_csv(args.version, args.output)
+
+    elif args.command == "diff":
+        header = version_store.get_header(args.to_version)
+        with open(args.output, "w") as output_file:
+            output_csv = csv.writer(output_file, delimiter=",")
+            output_csv.writerow(["change"] + header)
+            for change, row in version_store.iter_changes(args.from_version, args.to_version):
+                output_csv.writerow([change] + row)
+
+
+if __name__ == "__main__":
+    main()
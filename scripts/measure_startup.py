@@ -0,0 +1,85 @@
+"""
+Measures the startup time and peak memory of GlowingMemeDazzlingPower for a quick command (--help by default),
+appends the measurement to a history file and compares it with the previous one, so that import time regressions
+are noticed.
+
+usage: python scripts/measure_startup.py [--runs 10] [--history startup_history.jsonl] [-- extra arguments]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+ENTRY_POINT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "GlowingMemeDazzlingPower",
+)
+
+
+def measure_run(command):
+    """
+    Runs the command once and returns its wall time in seconds and peak resident memory in MB.
+    :param command:
+    :return:
+    """
+    start_time = time.monotonic()
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    _, _, resource_usage = os.wait4(process.pid, 0)
+    wall_time = time.monotonic() - start_time
+
+    peak_memory = resource_usage.ru_maxrss / 1024
+    if sys.platform == "darwin":
+        peak_memory = peak_memory / 1024
+    return wall_time, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--history", default="startup_history.jsonl")
+    parser.add_argument("arguments", nargs="*", default=["--help"])
+    args = parser.parse_args()
+
+    command = [sys.executable, ENTRY_POINT] + args.arguments
+    measurements = [measure_run(command) for _ in range(args.runs)]
+    wall_times = sorted(wall_time for wall_time, _ in measurements)
+
+    result = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "arguments": args.arguments,
+        "runs": args.runs,
+        "median_seconds": wall_times[len(wall_times) // 2],
+        "min_seconds": wall_times[0],
+        "peak_memory_mb": max(peak_memory for _, peak_memory in measurements),
+    }
+
+    previous_result = None
+    if os.path.exists(args.history):
+        with open(args.history) as history_file:
+            for line in history_file:
+                if line.strip():
+                    previous_result = json.loads(line)
+
+    with open(args.history, "a") as history_file:
+        history_file.write(json.dumps(result) + "\n")
+
+    print(
+        "startup: {median_seconds:.3f}s median, {min_seconds:.3f}s min, {peak_memory_mb:.1f} MB peak".format(
+            **result
+        )
+    )
+    if previous_result:
+        print(
+            "previous: {median_seconds:.3f}s median, {min_seconds:.3f}s min, {peak_memory_mb:.1f} MB peak "
+            "({date})".format(**previous_result)
+        )
+
+
+if __name__ == "__main__":
+    main()
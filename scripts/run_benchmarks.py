@@ -0,0 +1,340 @@
+"""
+Microbenchmarks of the pure CPU paths of the dataset build, run on synthetic data so that no service is needed.
+Results are saved to a json file and compared with a baseline, failing when a benchmark got slower than the allowed
+tolerance, or when creating entries in bulk got slower than creating them one by one.
+
+usage: python scripts/run_benchmarks.py [--cases 200] [--variants-per-case 500] [--output benchmarks.json]
+                                        [--baseline baseline.json] [--tolerance 0.25]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from types import SimpleNamespace
+
+# the scripts are run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_data import SyntheticDataGenerator
+
+from glowingmeme.build_data.build_dataset import ReportedOutcomeEnum
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.build_data.build_dataset_cipapi import BuildDatasetCipapi
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+def _benchmark_get_variant_info(data):
+    for cva_case in data.cva_cases:
+        tiered_variants = cva_case["tieredVariants"]
+        for variant in cva_case["allVariants"]:
+            BuildDatasetCVA._get_variant_info(variant, tiered_variants)
+
+
+def _benchmark_subtract_lists(data):
+    for cva_case in data.cva_cases:
+        BuildDatasetCVA._subtract_lists(
+            cva_case["reportedVariants"], cva_case["allVariants"]
+        )
+
+
+def _benchmark_expand_case(data):
+    build_dataset_cva = BuildDatasetCVA()
+    variant_entries = []
+    for cva_case in data.cva_cases:
+        build_dataset_cva.expand_case(
+            cva_case, cva_case["identifier"], variant_entries, variant_entries
+        )
+
+
+def _benchmark_variant_entry_construction(data):
+    for variant_entry in data.variant_entries:
+        VariantEntryInfo(
+            **{
+                "id": variant_entry.id,
+                "assembly": variant_entry.assembly,
+                "case_id": variant_entry.case_id,
+                "age": variant_entry.age,
+                "sex": variant_entry.sex,
+                "tier": variant_entry.tier,
+                "program": variant_entry.program,
+                "reported_outcome": ReportedOutcomeEnum.NOT_REPORTED.value,
+            }
+        )
+
+
+def _benchmark_create_many(data):
+    for case_values, rows in data.entry_rows_by_case:
+        VariantEntryInfo.create_many(
+            ["id", "tier"],
+            rows,
+            reported_outcome=ReportedOutcomeEnum.NOT_REPORTED.value,
+            **case_values
+        )
+
+
+def _benchmark_variant_entry_iter(data):
+    for variant_entry in data.variant_entries:
+        list(variant_entry)
+
+
+def _benchmark_index_helper(data):
+    for dataset_key in ["id", "case_id", "rs_id"]:
+        data.build_dataset._set_dataset_index_helper_by_attribute(dataset_key)
+
+
+def _benchmark_create_fast_lookup_dict(data):
+    for interpreted_genome in data.interpreted_genomes:
+        data.build_dataset._create_fast_lookup_dict(interpreted_genome)
+
+
+def _benchmark_project_cipapi_case(data):
+    for cipapi_case in data.cipapi_cases:
+        BuildDatasetCipapi._CASE_PROJECTION.apply(cipapi_case)
+
+
+def _benchmark_save_data_to_csv(data):
+    data.build_dataset.save_data_to_csv(data.csv_file_name)
+
+
+# name -> (function, function returning the number of items it processes)
+BENCHMARKS = {
+    "get_variant_info": (
+        _benchmark_get_variant_info,
+        lambda data: sum(len(cva_case["allVariants"]) for cva_case in data.cva_cases),
+    ),
+    "subtract_lists": (
+        _benchmark_subtract_lists,
+        lambda data: len(data.cva_cases),
+    ),
+    "expand_case": (
+        _benchmark_expand_case,
+        lambda data: sum(len(cva_case["allVariants"]) for cva_case in data.cva_cases),
+    ),
+    "variant_entry_construction": (
+        _benchmark_variant_entry_construction,
+        lambda data: len(data.variant_entries),
+    ),
+    "create_many": (
+        _benchmark_create_many,
+        lambda data: len(data.variant_entries),
+    ),
+    "variant_entry_iter": (
+        _benchmark_variant_entry_iter,
+        lambda data: len(data.variant_entries),
+    ),
+    "set_dataset_index_helper_by_attribute": (
+        _benchmark_index_helper,
+        lambda data: 3 * len(data.variant_entries),
+    ),
+    "create_fast_lookup_dict": (
+        _benchmark_create_fast_lookup_dict,
+        lambda data: sum(
+            len(interpreted_genome["interpreted_genome_data"]["variants"])
+            for interpreted_genome in data.interpreted_genomes
+        ),
+    ),
+    "project_cipapi_case": (
+        _benchmark_project_cipapi_case,
+        lambda data: len(data.cipapi_cases),
+    ),
+    "save_data_to_csv": (
+        _benchmark_save_data_to_csv,
+        lambda data: len(data.variant_entries),
+    ),
+}
+
+# benchmarks of a bulk path, and of the path it replaces, which the bulk one must always be faster than
+BULK_BENCHMARKS = {"create_many": "variant_entry_construction"}
+
+
+def generate_benchmark_data(number_of_cases, variants_per_case, seed, csv_file_name):
+    """
+    Generates the synthetic data shared by all the benchmarks.
+    :param number_of_cases:
+    :param variants_per_case:
+    :param seed:
+    :param csv_file_name: file the csv export benchmark writes to
+    :return:
+    """
+    generator = SyntheticDataGenerator(seed)
+    cva_cases = list(generator.generate_cva_cases(number_of_cases, variants_per_case))
+    variant_entries = generator.generate_variant_entries(cva_cases)
+
+    interpreted_genomes = [
+        generator.generate_interpreted_genome(cva_case) for cva_case in cva_cases
+    ]
+    cipapi_cases = [generator.generate_cipapi_case(cva_case) for cva_case in cva_cases]
+
+    # the values of the entries of each case, as create_many takes them
+    entry_rows_by_case = {}
+    for variant_entry in variant_entries:
+        case_values, rows = entry_rows_by_case.setdefault(
+            variant_entry.case_id,
+            (
+                {
+                    "assembly": variant_entry.assembly,
+                    "case_id": variant_entry.case_id,
+                    "age": variant_entry.age,
+                    "sex": variant_entry.sex,
+                    "program": variant_entry.program,
+                },
+                [],
+            ),
+        )
+        rows.append((variant_entry.id, variant_entry.tier))
+
+    return SimpleNamespace(
+        cva_cases=cva_cases,
+        variant_entries=variant_entries,
+        entry_rows_by_case=list(entry_rows_by_case.values()),
+        interpreted_genomes=interpreted_genomes,
+        cipapi_cases=cipapi_cases,
+        build_dataset=BuildDatasetCipapi(variant_entries),
+        csv_file_name=csv_file_name,
+    )
+
+
+def run_benchmark(function, data, repeat):
+    """
+    Runs a benchmark several times and returns its best time, which is the least disturbed by the rest of the system.
+    :param function:
+    :param data:
+    :param repeat:
+    :return: seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(data)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compares the time per item of each benchmark with the baseline.
+    :param results:
+    :param baseline:
+    :param tolerance: fraction the time per item can grow by before it counts as a regression
+    :return: list of the names of the benchmarks that regressed
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            continue
+
+        change = result["ns_per_item"] / baseline_result["ns_per_item"] - 1
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(
+            "{name:40} {ns_per_item:12.1f} ns/item  baseline {baseline:12.1f} ns/item  {change:+7.1%}{flag}".format(
+                name=name,
+                ns_per_item=result["ns_per_item"],
+                baseline=baseline_result["ns_per_item"],
+                change=change,
+                flag="  REGRESSION" if regressed else "",
+            )
+        )
+    return regressions
+
+
+def check_bulk_benchmarks(results):
+    """
+    Compares the time per item of each bulk benchmark with the one of the path it replaces.
+    :param results:
+    :return: list of the names of the bulk benchmarks that are not faster
+    """
+    regressions = []
+    for bulk_name, replaced_name in BULK_BENCHMARKS.items():
+        bulk_result = results["benchmarks"].get(bulk_name)
+        replaced_result = results["benchmarks"].get(replaced_name)
+        if bulk_result is None or replaced_result is None:
+            continue
+
+        regressed = bulk_result["ns_per_item"] >= replaced_result["ns_per_item"]
+        if regressed:
+            regressions.append(bulk_name)
+        print(
+            "{name:40} {speedup:12.1f}x faster than {replaced_name}{flag}".format(
+                name=bulk_name,
+                speedup=replaced_result["ns_per_item"] / bulk_result["ns_per_item"],
+                replaced_name=replaced_name,
+                flag="  REGRESSION" if regressed else "",
+            )
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--variants-per-case", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run, all by default."
+    )
+    parser.add_argument("--output", default="benchmarks.json")
+    parser.add_argument("--baseline", help="Results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        data = generate_benchmark_data(
+            args.cases,
+            args.variants_per_case,
+            args.seed,
+            os.path.join(temporary_folder, "benchmark_dataset.csv"),
+        )
+
+        results = {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "cases": args.cases,
+            "variants_per_case": args.variants_per_case,
+            "seed": args.seed,
+            "entries": len(data.variant_entries),
+            "benchmarks": {},
+        }
+        for name in args.only or BENCHMARKS:
+            function, count_items = BENCHMARKS[name]
+            seconds = run_benchmark(function, data, args.repeat)
+            number_of_items = count_items(data)
+            results["benchmarks"][name] = {
+                "seconds": seconds,
+                "items": number_of_items,
+                "ns_per_item": seconds / max(number_of_items, 1) * 1e9,
+            }
+            print(
+                "{name:40} {seconds:10.4f} s  {ns_per_item:12.1f} ns/item".format(
+                    name=name, **results["benchmarks"][name]
+                )
+            )
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    regressions = check_bulk_benchmarks(results)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if (baseline["cases"], baseline["variants_per_case"]) != (
+            results["cases"],
+            results["variants_per_case"],
+        ):
+            print("WARNING: the baseline was run at a different scale, timings per item may not be comparable")
+
+        regressions += compare_with_baseline(results, baseline, args.tolerance)
+
+    if regressions:
+        print("Regressions: {}".format(", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Generates realistic synthetic CVA cases, CIPAPI interpreted genomes and Cellbase annotations, shaped like the raw
+json returned by the services, so that the dataset building code can be exercised and benchmarked without
+credentials or network access. Cases are generated lazily, so any scale can be streamed to a file.
+
+usage: python scripts/synthetic_data.py output.jsonl [--cases 1000] [--variants-per-case 500] [--seed 0]
+                                        [--cipapi-output cipapi.jsonl] [--cellbase-output cellbase.jsonl]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+
+# the scripts are run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+
+CHROMOSOMES = [str(chromosome) for chromosome in range(1, 23)] + ["X", "Y"]
+BASES = ["A", "C", "G", "T"]
+TIERS = ["TIER1", "TIER2", "TIER3", "TIER4", "TIER5", "NONE"]
+TIER_WEIGHTS = [1, 4, 30, 30, 30, 5]
+ACMG_CLASSIFICATIONS = [
+    "pathogenic_variant",
+    "likely_pathogenic_variant",
+    "variant_of_unknown_clinical_significance",
+    "likely_benign_variant",
+    "benign_variant",
+]
+CASE_STATUSES = ["ARCHIVED_POSITIVE", "ARCHIVED_NEGATIVE"]
+SEXES = ["MALE", "FEMALE", "UNKNOWN"]
+ZYGOSITIES = ["heterozygous", "alternate_homozygous", "reference_homozygous", "unk"]
+MODES_OF_INHERITANCE = [
+    "monoallelic",
+    "biallelic",
+    "xlinked_monoallelic",
+    "mitochondrial",
+    "unknown",
+]
+SEGREGATION_PATTERNS = ["UniparentalIsodisomy", "SimpleRecessive", "deNovo", None]
+PENETRANCES = ["complete", "incomplete", None]
+CONSEQUENCE_TYPES = [
+    "missense_variant",
+    "synonymous_variant",
+    "intron_variant",
+    "splice_region_variant",
+    "stop_gained",
+    "frameshift_variant",
+    "3_prime_UTR_variant",
+]
+BIOTYPES = ["protein_coding", "nonsense_mediated_decay", "lincRNA", "processed_transcript"]
+ETHNIC_ORIGINS = ["A", "B", "C", "D", "N", "Z"]
+
+
+class SyntheticDataGenerator:
+    """
+    Deterministic (for a given seed) generator of synthetic service payloads. Variants are drawn from a shared pool,
+    so that, as in the real data, the same variant appears in many cases.
+    """
+
+    def __init__(self, seed=0, variant_pool_size=200000, assembly="GRCh38"):
+        """
+        :param seed: seed of the random number generator
+        :param variant_pool_size: number of distinct variants the cases are drawn from
+        :param assembly:
+        """
+        self.random = random.Random(seed)
+        self.assembly = assembly
+        self.variant_pool = [
+            self._generate_variant(variant_number)
+            for variant_number in range(variant_pool_size)
+        ]
+        self.variants_by_id = {variant["id"]: variant for variant in self.variant_pool}
+
+    def _generate_variant(self, variant_number):
+        chromosome = self.random.choice(CHROMOSOMES)
+        position = self.random.randint(10000, 200000000)
+        reference, alternate = self.random.sample(BASES, 2)
+        return {
+            "id": "{assembly}:{chromosome}:{position}:{reference}:{alternate}".format(
+                assembly=self.assembly,
+                chromosome=chromosome,
+                position=position,
+                reference=reference,
+                alternate=alternate,
+            ),
+            "chromosome": chromosome,
+            "position": position,
+            "reference": reference,
+            "alternate": alternate,
+            # about a third of the variants have no rs_id, as in the real data
+            "rs_id": "rs{}".format(variant_number) if self.random.random() > 0.3 else None,
+        }
+
+    def generate_cva_cases(self, number_of_cases, variants_per_case):
+        """
+        Yields CVA case dictionaries, as returned by the CVA cases endpoint.
+        :param number_of_cases:
+        :param variants_per_case: average number of variants of a case, the actual number varies between cases
+        :return:
+        """
+        for case_number in range(number_of_cases):
+            number_of_variants = max(
+                1, int(self.random.expovariate(1 / variants_per_case))
+            )
+            variant_ids = [
+                variant["id"]
+                for variant in self.random.sample(
+                    self.variant_pool, min(number_of_variants, len(self.variant_pool))
+                )
+            ]
+
+            tiered_variants = {}
+            for variant_id in variant_ids:
+                tier = self.random.choices(TIERS, TIER_WEIGHTS)[0]
+                tiered_variants.setdefault(tier, []).append(variant_id)
+
+            reported_variants = self.random.sample(
+                variant_ids, min(len(variant_ids), self.random.randint(0, 5))
+            )
+            classified_variants = {}
+            for variant_id in reported_variants:
+                classified_variants.setdefault(
+                    self.random.choice(ACMG_CLASSIFICATIONS), []
+                ).append(variant_id)
+
+            case_status = self.random.choice(CASE_STATUSES)
+            yield {
+                "identifier": str(10000 + case_number),
+                "version": self.random.randint(1, 3),
+                "assembly": self.assembly,
+                "program": "rare_disease",
+                "caseStatus": case_status,
+                "probandSex": self.random.choice(SEXES),
+                "probandEstimatedAgeAtAnalysis": self.random.randint(0, 90),
+                "interpretation": "solved" if case_status == "ARCHIVED_POSITIVE" else None,
+                "reportedVariants": reported_variants,
+                "allVariants": variant_ids,
+                "tieredVariants": tiered_variants,
+                "classifiedVariants": classified_variants,
+            }
+
+    def generate_interpreted_genome(self, cva_case):
+        """
+        Returns the raw json of the Genomics England tiering interpreted genome of a CVA case, as returned in the
+        interpreted_genome list of a CIPAPI case.
+        :param cva_case:
+        :return:
+        """
+        participant_ids = [
+            "{identifier}-{member}".format(identifier=cva_case["identifier"], member=member)
+            for member in ["proband", "mother", "father"]
+        ]
+        variants = []
+        for variant_id in cva_case["allVariants"]:
+            variant = self.variants_by_id[variant_id]
+            variants.append(
+                {
+                    "variantCoordinates": {
+                        "chromosome": variant["chromosome"],
+                        "position": variant["position"],
+                        "reference": variant["reference"],
+                        "alternate": variant["alternate"],
+                        "assembly": self.assembly,
+                    },
+                    "variantCalls": [
+                        {
+                            "participantId": participant_id,
+                            "zygosity": self.random.choice(ZYGOSITIES),
+                        }
+                        for participant_id in participant_ids
+                    ],
+                    "reportEvents": [
+                        {
+                            "modeOfInheritance": self.random.choice(MODES_OF_INHERITANCE),
+                            "segregationPattern": self.random.choice(SEGREGATION_PATTERNS),
+                            "penetrance": self.random.choice(PENETRANCES),
+                        }
+                    ],
+                }
+            )
+
+        return {
+            "created_at": "2020-01-01T00:00:00",
+            "interpreted_genome_data": {
+                "interpretationService": "genomics_england_tiering",
+                "variants": variants,
+            },
+        }
+
+    def generate_cipapi_case(self, cva_case):
+        """
+        Returns the raw json of the CIPAPI case of a CVA case, with its pedigree, interpreted genomes and clinical
+        reports, and some of the fields BuildDatasetCipapi doesn't read, e.g. the other tiering services.
+        :param cva_case:
+        :return:
+        """
+        relations = {"proband": None, "mother": "Mother", "father": "Father"}
+        members = [
+            {
+                "participantId": "{identifier}-{member}".format(
+                    identifier=cva_case["identifier"], member=member
+                ),
+                "isProband": relation is None,
+                "additionalInformation": {"relation_to_proband": relation},
+                "ancestries": {
+                    "mothersEthnicOrigin": self.random.choice(ETHNIC_ORIGINS),
+                    "fathersEthnicOrigin": self.random.choice(ETHNIC_ORIGINS),
+                },
+                "disorderList": [{"diseaseGroup": "Neurology", "ageOfOnset": 3.0}],
+                "hpoTermList": [
+                    {"term": "HP:{:07d}".format(self.random.randint(1, 9999999))}
+                    for _ in range(20)
+                ],
+                "samples": [{"sampleId": "LP{}".format(self.random.randint(1, 10 ** 9))}],
+            }
+            for member, relation in relations.items()
+        ]
+
+        gel_interpreted_genome = self.generate_interpreted_genome(cva_case)
+        other_interpreted_genome = self.generate_interpreted_genome(cva_case)
+        other_interpreted_genome["interpreted_genome_data"]["interpretationService"] = "exomiser"
+
+        return {
+            "case_id": "{identifier}-{version}".format(**cva_case),
+            "sample_type": "raredisease",
+            "status": [{"status": "report_sent", "created_at": "2020-01-01T00:00:00"}],
+            "interpretation_request_data": {
+                "json_request": {
+                    "pedigree": {"members": members},
+                    "bams": [{"uriFile": "/genomes/" + "x" * 100} for _ in range(3)],
+                    "vcfs": [{"uriFile": "/genomes/" + "x" * 100} for _ in range(3)],
+                }
+            },
+            "interpreted_genome": [gel_interpreted_genome, other_interpreted_genome],
+            "clinical_report": [
+                {
+                    "created_at": "2020-02-01T00:00:00",
+                    "clinical_report_data": {"genomicInterpretation": "z" * 2000},
+                    "exit_questionnaire": {
+                        "exit_questionnaire_data": {
+                            "familyLevelQuestions": {
+                                "caseSolvedFamily": cva_case["interpretation"] or "no"
+                            },
+                            "variantGroupLevelQuestions": [
+                                {"phenotypesSolved": "yes", "actionability": "no"}
+                            ],
+                        }
+                    },
+                }
+            ],
+        }
+
+    def generate_cellbase_annotation(self, variant):
+        """
+        Returns the raw json of the Cellbase annotation of a variant of the pool.
+        :param variant:
+        :return:
+        """
+        return {
+            "id": variant["rs_id"],
+            "chromosome": variant["chromosome"],
+            "start": variant["position"],
+            "reference": variant["reference"],
+            "alternate": variant["alternate"],
+            "consequenceTypes": [
+                {
+                    "biotype": self.random.choice(BIOTYPES),
+                    "sequenceOntologyTerms": [
+                        {"name": self.random.choice(CONSEQUENCE_TYPES)}
+                    ],
+                }
+                for _ in range(self.random.randint(1, 4))
+            ],
+            "populationFrequencies": [
+                {
+                    "study": "GNOMAD_GENOMES",
+                    "population": population,
+                    "altAlleleFreq": self.random.random() / 10,
+                }
+                for population in ["ALL", "MALE", "FEMALE"]
+            ],
+            "conservation": [
+                {"source": source, "score": self.random.uniform(-5, 5)}
+                for source in ["gerp", "phastCons", "phylop"]
+            ],
+            "functionalScore": [
+                {"source": "cadd_scaled", "score": self.random.uniform(0, 40)}
+            ],
+        }
+
+    def generate_variant_entries(self, cva_cases):
+        """
+        Expands CVA cases into VariantEntryInfo objects, as BuildDatasetCVA does, and fills in the variant
+        information the CVA enrichment would add, so that the entries look like those of a finished build.
+        :param cva_cases:
+        :return: list of VariantEntryInfo
+        """
+        build_dataset_cva = BuildDatasetCVA()
+        variant_entries = []
+        for cva_case in cva_cases:
+            case_id = "{identifier}-{version}".format(**cva_case)
+            build_dataset_cva.expand_case(
+                cva_case, case_id, variant_entries, variant_entries
+            )
+
+        for variant_entry in variant_entries:
+            variant = self.variants_by_id[variant_entry.id]
+            variant_entry.update_object(
+                chromosome="chr" + variant["chromosome"],
+                start=variant["position"],
+                end=variant["position"] + 1,
+                ref=variant["reference"],
+                alt=variant["alternate"],
+                rs_id=variant["rs_id"],
+                consequence_type=self.random.choice(CONSEQUENCE_TYPES),
+                biotypes=self.random.choice(BIOTYPES),
+                population_frequency=self.random.random() / 10,
+                PhastCons=self.random.random(),
+                phylop=self.random.uniform(-5, 5),
+                mother_ethnic_origin=self.random.choice(ETHNIC_ORIGINS),
+                father_ethnic_origin=self.random.choice(ETHNIC_ORIGINS),
+            )
+        return variant_entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("output", help="jsonl file where the CVA cases are written to")
+    parser.add_argument("--cases", type=int, default=1000)
+    parser.add_argument("--variants-per-case", type=int, default=500)
+    parser.add_argument("--variant-pool-size", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--cipapi-output",
+        help="jsonl file where the CIPAPI cases, with their interpreted genomes, are written to. Defaults to the "
+        "output file name ending in _cipapi.jsonl",
+    )
+    parser.add_argument(
+        "--cellbase-output",
+        help="jsonl file where the Cellbase annotation of every variant of the cases is written to. Defaults to the "
+        "output file name ending in _cellbase.jsonl",
+    )
+    args = parser.parse_args()
+
+    output_root = os.path.splitext(args.output)[0]
+    cipapi_output = args.cipapi_output or output_root + "_cipapi.jsonl"
+    cellbase_output = args.cellbase_output or output_root + "_cellbase.jsonl"
+
+    generator = SyntheticDataGenerator(args.seed, args.variant_pool_size)
+    number_of_entries = 0
+    annotated_variant_ids = set()
+    with open(args.output, "w") as output_file, open(cipapi_output, "w") as cipapi_file, open(
+        cellbase_output, "w"
+    ) as cellbase_file:
+        for cva_case in generator.generate_cva_cases(args.cases, args.variants_per_case):
+            output_file.write(json.dumps(cva_case) + "\n")
+            cipapi_file.write(json.dumps(generator.generate_cipapi_case(cva_case)) + "\n")
+            number_of_entries += len(cva_case["allVariants"])
+
+            # variants are shared between cases, but Cellbase annotates each of them once
+            for variant_id in cva_case["allVariants"]:
+                if variant_id not in annotated_variant_ids:
+                    annotated_variant_ids.add(variant_id)
+                    variant = generator.variants_by_id[variant_id]
+                    cellbase_file.write(json.dumps(generator.generate_cellbase_annotation(variant)) + "\n")
+
+    print(
+        "{cases} cases with {entries} case-variant entries written to {output}, their CIPAPI cases to "
+        "{cipapi_output} and the annotations of their {variants} variants to {cellbase_output}".format(
+            cases=args.cases,
+            entries=number_of_entries,
+            output=args.output,
+            cipapi_output=cipapi_output,
+            variants=len(annotated_variant_ids),
+            cellbase_output=cellbase_output,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,12 @@
-from unittest import TestCase
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from glowingmeme.build_data.build_dataset import BuildDataset
+from glowingmeme.build_data.build_context import BuildContext
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.build_data.build_dataset_cipapi import BuildDatasetCipapi
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
 
 
 class TestBuildDataset(TestCase):
@@ -7,4 +15,96 @@ class TestBuildDataset(TestCase):
         This method initializes required objects for class
         :return:
         """
-        pass
+        self.case = {
+            "assembly": "GRCh38",
+            "probandSex": "FEMALE",
+            "program": "rare_disease",
+            "probandEstimatedAgeAtAnalysis": 7,
+            "interpretation": "solved",
+            "reportedVariants": ["v1"],
+            "allVariants": ["v1", "v2", "v3"],
+            "tieredVariants": {"TIER1": ["v1", "v2"], "TIER3": ["v2"]},
+            "classifiedVariants": {"pathogenic_variant": ["v1"]},
+        }
+
+    def test_invert_variant_info_matches_get_variant_info(self):
+        tier_by_variant = BuildDatasetCVA._invert_variant_info(
+            self.case["tieredVariants"]
+        )
+        for variant in self.case["allVariants"]:
+            self.assertEqual(
+                tier_by_variant.get(variant),
+                BuildDatasetCVA._get_variant_info(
+                    variant, self.case["tieredVariants"]
+                ),
+            )
+
+    def test_expand_case(self):
+        reported_variant_list, non_reported_variant_list = [], []
+        BuildDatasetCVA().expand_case(
+            self.case, "1-1", reported_variant_list, non_reported_variant_list
+        )
+
+        self.assertEqual(len(reported_variant_list), 1)
+        self.assertEqual(reported_variant_list[0].tier, "TIER1")
+        self.assertEqual(
+            reported_variant_list[0].gel_variant_acmg_classification,
+            "pathogenic_variant",
+        )
+        self.assertIsNone(reported_variant_list[0].interpretation_message)
+
+        tiers = {
+            variant_entry.id: variant_entry.tier
+            for variant_entry in non_reported_variant_list
+        }
+        self.assertEqual(tiers, {"v2": "TIER3", "v3": None})
+        self.assertEqual(non_reported_variant_list[0].case_id, "1-1")
+        self.assertEqual(non_reported_variant_list[0].interpretation_message, b"solved")
+
+    def test_create_many_matches_constructor(self):
+        variant_entry = VariantEntryInfo.create_many(
+            ["id", "tier"], [("v1", "TIER1")], case_id="1-1"
+        )[0]
+        self.assertEqual(
+            list(variant_entry),
+            list(VariantEntryInfo(id="v1", tier="TIER1", case_id="1-1")),
+        )
+
+    def test_clients_factory_is_created_once(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as credentials_file:
+            credentials_file.write("- name: cva_prod\n  username: user\n  password: password\n")
+        self.addCleanup(os.remove, credentials_file.name)
+        environment = mock.patch.dict(os.environ, GEL_CREDENTIALS=credentials_file.name)
+        environment.start()
+        self.addCleanup(environment.stop)
+
+        build_dataset = BuildDatasetCVA()
+        clients = build_dataset._get_client(BuildDataset._CLIENTS_FACTORY)
+        self.assertIs(build_dataset._get_client(BuildDataset._CLIENTS_FACTORY), clients)
+        self.assertEqual(clients._credentials["cva_prod"]["username"], "user")
+
+        # restarting the clients reads the credentials again, e.g. after they were rotated
+        build_dataset.start_clients()
+        self.assertIsNot(build_dataset._get_client(BuildDataset._CLIENTS_FACTORY), clients)
+
+    def test_request_caches_are_kept_across_builds(self):
+        fetched_keys = []
+
+        def fetch_missing(keys):
+            fetched_keys.append(keys)
+            return {key: key.upper() for key in keys}
+
+        # a single build has no request caches, since it never asks twice for the same record
+        builder = BuildDatasetCipapi([], build_context=BuildContext())
+        self.assertEqual(builder._get_many_or_fetch(BuildDataset.CIPAPI_SERVICE, ["a"], fetch_missing), {"a": "A"})
+        self.assertEqual(builder._get_many_or_fetch(BuildDataset.CIPAPI_SERVICE, ["a"], fetch_missing), {"a": "A"})
+        self.assertEqual(fetched_keys, [["a"], ["a"]])
+
+        # the caches given to the builds of a service only let the next build fetch what the previous ones didn't
+        request_caches = BuildDataset.create_request_caches(max_age=3600)
+        fetched_keys.clear()
+        for keys in [["a", "b"], ["a", "b", "c"]]:
+            builder = BuildDatasetCipapi([], build_context=BuildContext(request_caches=request_caches))
+            builder._get_many_or_fetch(BuildDataset.CIPAPI_SERVICE, keys, fetch_missing)
+        self.assertEqual(fetched_keys, [["a", "b"], ["c"]])
+        self.assertEqual(request_caches[BuildDataset.CIPAPI_SERVICE].stats()["hits"], 2)
@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from glowingmeme.build_data.build_context import BuildContext
+from glowingmeme.build_data.build_dataset_cellbase import BuildDatasetCellbase
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class _StubCellbaseVariantClient:
+    """
+    Cellbase variant client whose annotations come back in reverse order, without the variants it can't annotate,
+    as given by the CADD score of each coordinate id.
+    """
+
+    def __init__(self, cadd_scores):
+        self.cadd_scores = cadd_scores
+        self.queried_coordinate_ids = []
+
+    def get_annotation(self, coordinate_ids, method, assembly, include):
+        self.queried_coordinate_ids.extend(coordinate_ids)
+        annotations = []
+        for coordinate_id in reversed(coordinate_ids):
+            if coordinate_id not in self.cadd_scores:
+                continue
+            chromosome, start, reference, alternate = coordinate_id.split(":")
+            annotations.append(
+                {
+                    "result": [
+                        {
+                            "chromosome": chromosome.replace("chr", ""),
+                            "start": int(start),
+                            "reference": reference,
+                            "alternate": alternate,
+                            "conservation": [],
+                            "functionalScore": [
+                                {"source": "cadd_scaled", "score": self.cadd_scores[coordinate_id]}
+                            ],
+                        }
+                    ]
+                }
+            )
+        return annotations
+
+
+class TestBuildDatasetCellbase(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.variant_entries = [
+            VariantEntryInfo(
+                id="v1", case_id="1-1", assembly="GRCh38", chromosome="chr1", start=100, ref="A", alt="C"
+            ),
+            VariantEntryInfo(
+                id="v2", case_id="1-1", assembly="GRCh38", chromosome="chr1", start=200, ref="G", alt="T"
+            ),
+            VariantEntryInfo(
+                id="v3", case_id="1-1", assembly="GRCh38", chromosome="chr2", start=300, ref="T", alt="A"
+            ),
+            VariantEntryInfo(
+                id="v1", case_id="2-1", assembly="GRCh38", chromosome="chr1", start=100, ref="A", alt="C"
+            ),
+            # CVA left the alternate of this one out, so it can't be annotated by its coordinates
+            VariantEntryInfo(id="v4", case_id="2-1", assembly="GRCh38", chromosome="chr3", start=400, ref="C"),
+        ]
+        self.cellbase_variant_client = _StubCellbaseVariantClient(
+            {"chr1:100:A:C": 10.0, "chr2:300:T:A": 30.0}
+        )
+
+        self.build_dataset = BuildDatasetCellbase(self.variant_entries)
+        self.build_dataset.cellbase_variant_client = self.cellbase_variant_client
+
+    def test_annotations_are_matched_by_coordinates(self):
+        self.build_dataset.build_dataset()
+
+        self.assertEqual(
+            [(variant_entry.id, variant_entry.CADD_scaled_score) for variant_entry in self.variant_entries],
+            [("v1", 10.0), ("v2", None), ("v3", 30.0), ("v1", 10.0), ("v4", None)],
+        )
+        self.assertEqual(
+            sorted(self.cellbase_variant_client.queried_coordinate_ids),
+            ["chr1:100:A:C", "chr1:200:G:T", "chr2:300:T:A"],
+        )
+
+    def test_variants_left_out_have_no_annotation(self):
+        annotations = self.build_dataset._post_cellbase_annotation(
+            [("coordinates", "GRCh38:chr1:200:G:T"), ("coordinates", "GRCh38:chr2:300:T:A")]
+        )
+        self.assertEqual(list(annotations), [("coordinates", "GRCh38:chr2:300:T:A")])
+
+    def test_annotations_are_cached_across_builds(self):
+        request_caches = BuildDatasetCellbase.create_request_caches(max_age=3600)
+        for _ in range(2):
+            build_dataset = BuildDatasetCellbase(self.variant_entries, BuildContext(request_caches=request_caches))
+            build_dataset.cellbase_variant_client = self.cellbase_variant_client
+            build_dataset.build_dataset()
+
+        # the second build is annotated from the scores cached by the first one
+        self.assertEqual(len(self.cellbase_variant_client.queried_coordinate_ids), 3)
+        self.assertEqual(self.variant_entries[2].CADD_scaled_score, 30.0)
+        self.assertEqual(
+            request_caches[BuildDatasetCellbase.CELLBASE_SERVICE].get(("coordinates", "GRCh38:chr2:300:T:A")),
+            {"CADD_scaled_score": 30.0, "GERP": None, "phastCons": None, "phylop": None, "clinVar": None},
+        )
@@ -0,0 +1,92 @@
+import os
+import json
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from scipy import sparse
+
+from glowingmeme.build_data.build_dataset import ReportedOutcomeEnum
+from glowingmeme.build_data.build_features import BuildFeatures
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class TestBuildFeatures(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.variant_entries = [
+            VariantEntryInfo(
+                id="v1",
+                sex="FEMALE",
+                consequence_type="missense_variant,stop_gained,missense_variant",
+                tier="TIER1",
+                age=7,
+                reported_outcome=ReportedOutcomeEnum.REPORTED.value,
+            ),
+            VariantEntryInfo(
+                id="v2",
+                sex="MALE",
+                consequence_type="intron_variant",
+                tier="TIER3",
+                reported_outcome=ReportedOutcomeEnum.NOT_REPORTED.value,
+            ),
+            VariantEntryInfo(id="v3", sex="MALE"),
+        ]
+        self.output_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_folder.cleanup)
+
+    def _save_features(self, variant_entries, matrix_format):
+        build_features = BuildFeatures(variant_entries)
+        build_features.build_features()
+        file_names = [
+            os.path.join(self.output_folder.name, file_name)
+            for file_name in ["features.npz", "vocabulary.json", "labels.npy"]
+        ]
+        build_features.save_features(*file_names, matrix_format=matrix_format)
+
+        with open(file_names[1]) as vocabulary_file:
+            vocabulary = json.load(vocabulary_file)
+        return file_names[0], vocabulary, np.load(file_names[2])
+
+    def test_csr_features(self):
+        matrix_file_name, vocabulary, labels = self._save_features(
+            self.variant_entries, BuildFeatures.SPARSE
+        )
+        feature_matrix = sparse.load_npz(matrix_file_name)
+        features = vocabulary["features"]
+
+        self.assertEqual(feature_matrix.shape, (3, len(features)))
+        self.assertEqual(vocabulary["shape"], [3, len(features)])
+
+        # repeated consequence types are set once
+        self.assertEqual(feature_matrix[0, features.index("consequence_type=missense_variant")], 1)
+        self.assertEqual(feature_matrix[0, features.index("consequence_type=stop_gained")], 1)
+        self.assertEqual(feature_matrix[:, features.index("sex=MALE")].toarray().ravel().tolist(), [0, 1, 1])
+        self.assertEqual(feature_matrix[1, features.index("tier")], 3)
+        self.assertEqual(feature_matrix[2, features.index("tier_missing")], 1)
+        self.assertEqual(feature_matrix[0, features.index("age")], 7)
+
+        # entries without an outcome are not labelled as not reported
+        self.assertEqual(
+            labels.tolist(),
+            [BuildFeatures.REPORTED_LABEL, BuildFeatures.NOT_REPORTED_LABEL, BuildFeatures.UNKNOWN_LABEL],
+        )
+        self.assertEqual(vocabulary["labels"]["unknown"], BuildFeatures.UNKNOWN_LABEL)
+
+    def test_dense_features_match_csr(self):
+        csr_file_name, csr_vocabulary, _ = self._save_features(self.variant_entries, BuildFeatures.SPARSE)
+        csr_matrix = sparse.load_npz(csr_file_name).toarray()
+
+        dense_file_name, dense_vocabulary, _ = self._save_features(self.variant_entries, BuildFeatures.DENSE)
+        with np.load(dense_file_name) as dense_file:
+            np.testing.assert_array_equal(dense_file["features"], csr_matrix)
+        self.assertEqual(dense_vocabulary["features"], csr_vocabulary["features"])
+        self.assertEqual(dense_vocabulary["format"], BuildFeatures.DENSE)
+
+    def test_empty_dataset(self):
+        matrix_file_name, vocabulary, labels = self._save_features([], BuildFeatures.SPARSE)
+        self.assertEqual(sparse.load_npz(matrix_file_name).shape, (0, len(vocabulary["features"])))
+        self.assertEqual(len(labels), 0)
@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from glowingmeme.build_data.build_plan import BuildPlanner
+from glowingmeme.build_data.work_scheduler import WorkCostHistory
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class TestBuildPlanner(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.variant_entries = [
+            VariantEntryInfo(id="v1", case_id="1-1"),
+            VariantEntryInfo(id="v2", case_id="1-1"),
+            VariantEntryInfo(id="v3", case_id="2-1"),
+            VariantEntryInfo(id="v1", case_id="3-1"),
+        ]
+        # v1 and v2 were in the previous version, only v1 with an rs_id
+        self.previous_entries = [("1-1", "v1", "rs1"), ("1-1", "v2", ""), ("4-1", "v4", "rs4")]
+        self.cost_history = WorkCostHistory()
+
+    def test_plan_counts_calls(self):
+        build_plan = BuildPlanner(self.cost_history).plan(
+            self.variant_entries, self.previous_entries, 2.0, 3
+        )
+
+        variant_plan = build_plan[BuildPlanner.CVA_VARIANT_ENRICHMENT]
+        self.assertEqual(variant_plan["work_items"], 3)
+        self.assertEqual(variant_plan["new"], 1)
+        self.assertEqual(variant_plan["calls"], 3)
+
+        case_plan = build_plan[BuildPlanner.CIPAPI]
+        self.assertEqual(case_plan["work_items"], 3)
+        self.assertEqual(case_plan["new"], 2)
+        self.assertEqual(case_plan["calls"], 3)
+
+        # one rs_id search and one coordinate annotation
+        self.assertEqual(build_plan[BuildPlanner.CELLBASE]["calls"], 2)
+
+        self.assertEqual(build_plan["estimated_seconds"], 2.0)
+        self.assertEqual(
+            build_plan["stages_without_history"],
+            [
+                BuildPlanner.CVA_VARIANT_ENRICHMENT,
+                BuildPlanner.CIPAPI,
+                BuildPlanner.CELLBASE,
+                BuildPlanner.EXPORT,
+            ],
+        )
+
+    def test_plan_uses_recorded_stage_costs(self):
+        BuildPlanner.record_stage_costs(
+            self.cost_history,
+            {BuildPlanner.CVA_VARIANT_ENRICHMENT: 30.0, BuildPlanner.CIPAPI: 12.0},
+            {BuildPlanner.CVA_VARIANT_ENRICHMENT: 10, BuildPlanner.CIPAPI: 0},
+        )
+
+        build_plan = BuildPlanner(self.cost_history).plan(self.variant_entries)
+        self.assertEqual(
+            build_plan[BuildPlanner.CVA_VARIANT_ENRICHMENT]["estimated_seconds"], 9.0
+        )
+        self.assertIsNone(build_plan[BuildPlanner.CIPAPI]["estimated_seconds"])
+        self.assertEqual(build_plan["estimated_seconds"], 9.0)
+
+    def test_export_counts_rows_of_every_target(self):
+        BuildPlanner.record_stage_costs(
+            self.cost_history, {BuildPlanner.EXPORT: 10.0}, {BuildPlanner.EXPORT: 5}
+        )
+
+        # case 1-1 is saved by both targets
+        build_plan = BuildPlanner(self.cost_history).plan(
+            self.variant_entries,
+            target_case_ids={"a": {"1-1", "2-1"}, "b": {"1-1", "3-1"}},
+        )
+        self.assertEqual(build_plan[BuildPlanner.EXPORT]["work_items"], 6)
+        self.assertEqual(build_plan[BuildPlanner.EXPORT]["estimated_seconds"], 12.0)
@@ -0,0 +1,175 @@
+import os
+import csv
+import tempfile
+from unittest import TestCase
+
+from glowingmeme.build_data.build_context import BuildContext
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.build_data.build_spec import (
+    DatasetTarget,
+    TargetDataset,
+    get_fetch_plan,
+    load_build_spec,
+    normalize_assembly,
+)
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class _StubCvaCasesClient:
+    """
+    CVA cases client listing the given cases by (program, assembly, case status), and recording every listing.
+    """
+
+    def __init__(self, cases_by_listing):
+        self.cases_by_listing = cases_by_listing
+        self.listings = []
+
+    def cases(self):
+        return self
+
+    def get_cases(self, program, assembly, caseStatuses, include_all, include):
+        listing = (program, assembly, caseStatuses[0])
+        self.listings.append(listing)
+        return iter(self.cases_by_listing.get(listing, []))
+
+
+class TestBuildSpec(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.temporary_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_folder.cleanup)
+        self.build_spec_file_name = os.path.join(self.temporary_folder.name, "build_spec.yaml")
+
+        self.targets = [
+            DatasetTarget("archived", case_statuses=["ARCHIVED_POSITIVE", "ARCHIVED_NEGATIVE"]),
+            DatasetTarget("positive", assembly="grch38", case_statuses=["ARCHIVED_POSITIVE"]),
+            DatasetTarget("cancer", program="cancer", assembly="GRCh37"),
+        ]
+
+    def _write_build_spec(self, build_spec):
+        with open(self.build_spec_file_name, "w") as build_spec_file:
+            build_spec_file.write(build_spec)
+
+    def test_load_build_spec(self):
+        self._write_build_spec(
+            "targets:\n"
+            "  - name: rare_disease_archived\n"
+            "  - name: cancer_grch37\n"
+            "    program: cancer\n"
+            "    assembly: hg19\n"
+            "    case_statuses: [ARCHIVED_POSITIVE]\n"
+        )
+        targets = load_build_spec(self.build_spec_file_name)
+
+        self.assertEqual(
+            [vars(target) for target in targets],
+            [
+                {
+                    "name": "rare_disease_archived",
+                    "program": "rare_disease",
+                    "assembly": "GRCh38",
+                    "case_statuses": ["ARCHIVED_POSITIVE", "ARCHIVED_NEGATIVE"],
+                },
+                {
+                    "name": "cancer_grch37",
+                    "program": "cancer",
+                    "assembly": "GRCh37",
+                    "case_statuses": ["ARCHIVED_POSITIVE"],
+                },
+            ],
+        )
+
+    def test_load_build_spec_rejects_duplicated_names(self):
+        self._write_build_spec("targets:\n  - name: archived\n  - name: archived\n    program: cancer\n")
+        with self.assertRaises(ValueError):
+            load_build_spec(self.build_spec_file_name)
+
+    def test_normalize_assembly(self):
+        self.assertEqual(
+            [normalize_assembly(assembly) for assembly in ["GRCh38", "grch38", "hg38", "GRCh38.p13", "GRCh37", None]],
+            ["GRCh38", "GRCh38", "GRCh38", "GRCh38", "GRCh37", None],
+        )
+
+    def test_fetch_plan_lists_each_case_status_once(self):
+        self.assertEqual(
+            get_fetch_plan(self.targets),
+            {
+                ("rare_disease", "GRCh38", "ARCHIVED_POSITIVE"): ["archived", "positive"],
+                ("rare_disease", "GRCh38", "ARCHIVED_NEGATIVE"): ["archived"],
+                ("cancer", "GRCh37", "ARCHIVED_POSITIVE"): ["cancer"],
+                ("cancer", "GRCh37", "ARCHIVED_NEGATIVE"): ["cancer"],
+            },
+        )
+
+    def test_targets_are_exported_separately(self):
+        cases_client = _StubCvaCasesClient(
+            {
+                ("rare_disease", "GRCh38", "ARCHIVED_POSITIVE"): [
+                    {"identifier": "1", "version": 1, "assembly": "GRCh38", "allVariants": ["v1", "v2"]}
+                ],
+                ("rare_disease", "GRCh38", "ARCHIVED_NEGATIVE"): [
+                    {"identifier": "2", "version": 1, "assembly": "GRCh38", "allVariants": ["v1"]}
+                ],
+                ("cancer", "GRCh37", "ARCHIVED_NEGATIVE"): [
+                    {"identifier": "3", "version": 2, "assembly": "GRCh37", "allVariants": ["v3"]}
+                ],
+            }
+        )
+        build_dataset = BuildDatasetCVA(
+            targets=self.targets, build_context=BuildContext(shared_clients={"cva_client": cases_client})
+        )
+        reported_variant_list, non_reported_variant_list = build_dataset._query_cva_archived_cases()
+        build_dataset.main_dataset = reported_variant_list + non_reported_variant_list
+
+        # every listing is fetched once, and case 1 is only expanded once for both of its targets
+        self.assertEqual(len(cases_client.listings), 4)
+        self.assertEqual(len(build_dataset.main_dataset), 4)
+        self.assertEqual(
+            build_dataset.target_case_ids,
+            {"archived": {"1-1", "2-1"}, "positive": {"1-1"}, "cancer": {"3-2"}},
+        )
+
+        for target in self.targets:
+            target_dataset = TargetDataset(build_dataset.main_dataset, build_dataset.target_case_ids[target.name])
+            file_name = os.path.join(self.temporary_folder.name, target.name + ".csv")
+            self.assertEqual(build_dataset.save_data_to_csv(file_name, target_dataset), len(list(target_dataset)))
+
+            with open(file_name) as dataset_file:
+                self.assertEqual(
+                    sorted((row["case_id"], row["id"]) for row in csv.DictReader(dataset_file)),
+                    sorted(
+                        (variant_entry.case_id, variant_entry.id)
+                        for variant_entry in build_dataset.main_dataset
+                        if variant_entry.case_id in build_dataset.target_case_ids[target.name]
+                    ),
+                )
+
+        self.assertEqual(
+            sorted(variant_entry.id for variant_entry in TargetDataset(build_dataset.main_dataset, {"1-1"})),
+            ["v1", "v2"],
+        )
+
+    def test_variant_records_match_cases_of_the_same_assembly(self):
+        variant_records = BuildDatasetCVA._get_variant_records(
+            {
+                "variants": [
+                    {"assembly": "grch38", "annotation": {"chromosome": "1", "start": 100, "id": "rs38"}},
+                    {"assembly": "GRCh37", "annotation": {"chromosome": "1", "start": 90, "id": "rs37"}},
+                ]
+            },
+        )
+        build_dataset = BuildDatasetCVA()
+        build_dataset.main_dataset = [
+            VariantEntryInfo(id="v1", case_id="1-1", assembly="GRCh38"),
+            VariantEntryInfo(id="v1", case_id="3-2", assembly="hg19"),
+        ]
+        build_dataset._set_dataset_index_helper_by_attribute("id")
+        build_dataset._apply_variant_records([("v1", variant_records)])
+
+        self.assertEqual(
+            [(variant_entry.rs_id, variant_entry.start) for variant_entry in build_dataset.main_dataset],
+            [("rs38", 100), ("rs37", 90)],
+        )
@@ -0,0 +1,92 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from glowingmeme.build_data.dataset_store import SQLiteDatasetStore
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class TestSQLiteDatasetStore(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.temporary_folder = tempfile.TemporaryDirectory()
+        self.store = SQLiteDatasetStore(
+            os.path.join(self.temporary_folder.name, "store.sqlite"), hot_cache_size=1
+        )
+        self.store.extend(
+            [
+                VariantEntryInfo(id="v1", case_id="1-1"),
+                VariantEntryInfo(id="v2", case_id="1-1"),
+                VariantEntryInfo(id="v1", case_id="2-1"),
+            ]
+        )
+
+    def tearDown(self):
+        self.store.close()
+        self.temporary_folder.cleanup()
+
+    def test_index_by_attribute(self):
+        index = self.store.index_by("id")
+
+        self.assertEqual(sorted(index.keys()), ["v1", "v2"])
+        self.assertEqual([entry.case_id for entry in index["v1"]], ["1-1", "2-1"])
+        self.assertIn(None, self.store.index_by("rs_id"))
+
+    def test_updates_survive_hot_cache_eviction(self):
+        for variant_entry in self.store.index_by("id")["v1"]:
+            variant_entry.update_object(rs_id="rs1", age=30)
+
+        self.assertEqual(len(self.store.index_by("rs_id")["rs1"]), 2)
+        self.assertEqual(
+            [(entry.id, entry.age) for entry in self.store],
+            [("v1", 30), ("v2", None), ("v1", 30)],
+        )
+        self.assertEqual(len(list(list(self.store)[0])), len(VariantEntryInfo.VARIANT_INFO_VALUES))
+
+    def test_rows_have_one_object_while_in_use(self):
+        first_entry = self.store.index_by("id")["v1"][0]
+        # reading the other entries evicts the first one from the hot cache, but it's still in use here
+        list(self.store)
+        self.assertIs(self.store.index_by("id")["v1"][0], first_entry)
+
+        # so updates through any reference build on each other instead of overwriting each other
+        self.store.index_by("id")["v1"][0].update_object(age=30)
+        first_entry.update_object(rs_id="rs1")
+        self.assertEqual([(entry.age, entry.rs_id) for entry in self.store.index_by("case_id")["1-1"]][0], (30, "rs1"))
+
+    def test_count_and_stream_by_attribute(self):
+        index = self.store.index_by("case_id")
+        self.assertEqual(index.count("1-1"), 2)
+        self.assertEqual(index.count("3-1"), 0)
+        self.assertEqual([entry.id for entry in index.iter_entries("1-1")], ["v1", "v2"])
+
+    def test_distinct_values_are_streamed_a_page_at_a_time(self):
+        self.store.extend(VariantEntryInfo(id="v{}".format(number), case_id="3-1") for number in range(3, 8))
+        index = self.store.index_by("id")
+
+        with mock.patch.object(SQLiteDatasetStore, "_ITERATION_PAGE_SIZE", 2):
+            self.assertEqual(list(index.keys()), ["v1", "v2", "v3", "v4", "v5", "v6", "v7"])
+            self.assertEqual(list(self.store.index_by("rs_id")), [None])
+        self.assertEqual(len(index), 7)
+        self.assertEqual(len(self.store.index_by("rs_id")), 1)
+
+    def test_index_by_coordinates(self):
+        self.store.append(
+            VariantEntryInfo(id="v3", case_id="3-1", assembly="GRCh38", chromosome="chr1", start=100, ref="A", alt="C")
+        )
+        index = self.store.index_by("coordinates")
+
+        self.assertEqual(list(index.keys()), [None, "GRCh38:chr1:100:A:C"])
+        self.assertEqual([entry.id for entry in index.iter_entries("GRCh38:chr1:100:A:C")], ["v3"])
+
+    def test_updates_are_written_in_one_transaction(self):
+        for variant_entry in self.store.index_by("case_id")["1-1"]:
+            variant_entry.update_object(age=30)
+        self.assertEqual(len(self.store._update_buffer), 2)
+
+        # the buffered updates are written before the store is read again
+        self.assertEqual([entry.age for entry in self.store.index_by("case_id")["1-1"]], [30, 30])
+        self.assertEqual(self.store._update_buffer, {})
@@ -0,0 +1,145 @@
+import json
+from unittest import TestCase
+
+from glowingmeme.build_data.hybrid_executor import HybridExecutor
+from glowingmeme.clients.request_cache import RequestCache
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.build_data.build_dataset_cipapi import BuildDatasetCipapi
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class _StubVariantBodyClient:
+    """
+    Answers get_variant_body with the response body CVA sends, whose result is empty when it has no such variant.
+    """
+
+    def __init__(self, variants):
+        self.variants = variants
+        self.calls = []
+
+    def get_variant_body(self, identifier, include, retries=3):
+        self.calls.append((identifier, include, retries))
+        variant = self.variants.get(identifier)
+        return json.dumps(
+            {"response": [{"result": [variant] if variant is not None else []}]}
+        ).encode()
+
+
+class TestHybridExecutor(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.variant = {
+            "id": "v1",
+            "variants": [
+                {
+                    "assembly": "GRCh38",
+                    "smallVariantType": "SNV",
+                    "annotation": {
+                        "id": "rs1",
+                        "chromosome": "1",
+                        "start": 100,
+                        "reference": "A",
+                        "alternate": "T",
+                        "consequenceTypes": [
+                            {
+                                "biotype": "protein_coding",
+                                "sequenceOntologyTerms": [{"name": "missense_variant"}],
+                            }
+                        ],
+                        "conservation": [{"source": "phylop", "score": 0.5}],
+                        "populationFrequencies": [
+                            {"study": "GNOMAD_GENOMES", "population": "ALL", "altAlleleFreq": 0.1},
+                            {"study": "GNOMAD_GENOMES", "population": "FEMALE", "altAlleleFreq": 0.2},
+                            {"study": "EXAC", "population": "MALE", "altAlleleFreq": 0.3},
+                        ],
+                    },
+                },
+                {"assembly": "GRCh37", "annotation": None},
+            ],
+        }
+
+    def test_run_skips_missing_payloads(self):
+        payloads = {"1": 10, "2": None, "3": 30}
+        applied_records = []
+        hybrid_executor = HybridExecutor(io_workers=2, cpu_workers=2, batch_size=1)
+        self.addCleanup(hybrid_executor.close)
+        hybrid_executor.run(
+            ["1", "2", "3"],
+            payloads.get,
+            BuildDatasetCipapi._get_lookup_key,
+            applied_records.extend,
+        )
+        self.assertEqual(sorted(applied_records), [("1", "1_10"), ("3", "3_30")])
+
+    def test_cached_records_are_not_fetched(self):
+        record_cache = RequestCache()
+        record_cache.put("1", "1_cached")
+        fetched_items = []
+
+        def fetch(work_item):
+            fetched_items.append(work_item)
+            return int(work_item)
+
+        applied_records = []
+        hybrid_executor = HybridExecutor(io_workers=1, cpu_workers=1, batch_size=1)
+        self.addCleanup(hybrid_executor.close)
+        hybrid_executor.run(["1", "2"], fetch, BuildDatasetCipapi._get_lookup_key, applied_records.extend, record_cache)
+
+        self.assertEqual(fetched_items, ["2"])
+        self.assertEqual(sorted(applied_records), [("1", "1_cached"), ("2", "2_2")])
+        self.assertEqual(record_cache.get("2"), "2_2")
+
+    def test_worker_processes_are_reused_until_closed(self):
+        hybrid_executor = HybridExecutor(io_workers=1, cpu_workers=1)
+        self.addCleanup(hybrid_executor.close)
+        for _ in range(2):
+            applied_records = []
+            hybrid_executor.run(["1"], int, BuildDatasetCipapi._get_lookup_key, applied_records.extend)
+            self.assertEqual(applied_records, [("1", "1_1")])
+        cpu_executor = hybrid_executor._cpu_executor
+        self.assertIs(hybrid_executor._get_cpu_executor(), cpu_executor)
+
+        hybrid_executor.close()
+        self.assertIsNone(hybrid_executor._cpu_executor)
+
+    def test_variants_are_decoded_by_the_workers(self):
+        build_dataset_cva = BuildDatasetCVA()
+        build_dataset_cva.cva_variant_body_client = _StubVariantBodyClient({"v1": self.variant})
+
+        # the I/O threads only get the response body, which the worker processes decode
+        variant_body = build_dataset_cva._fetch_variant("v1")
+        self.assertIsInstance(variant_body, bytes)
+        self.assertEqual(list(BuildDatasetCVA._extract_variant_records("v1", variant_body)), ["GRCh38"])
+        self.assertEqual(BuildDatasetCVA._extract_variant_records("v2", build_dataset_cva._fetch_variant("v2")), {})
+
+        # only the included fields are requested
+        self.assertEqual(
+            build_dataset_cva.cva_variant_body_client.calls[0],
+            ("v1", BuildDatasetCVA._INCLUDE_LIST, BuildDatasetCVA._CVA_SERVER_ERROR_RETRIES),
+        )
+
+    def test_extract_and_apply_variant_records(self):
+        variant_records = BuildDatasetCVA._get_variant_records(self.variant)
+        self.assertEqual(list(variant_records), ["GRCh38"])
+
+        build_dataset_cva = BuildDatasetCVA()
+        female_entry = VariantEntryInfo(id="v1", assembly="GRCh38", sex="FEMALE")
+        male_entry = VariantEntryInfo(id="v1", assembly="GRCh38", sex="MALE")
+        grch37_entry = VariantEntryInfo(id="v1", assembly="GRCh37", sex="MALE")
+        build_dataset_cva.dataset_index_helper = {
+            "v1": [female_entry, male_entry, grch37_entry]
+        }
+        build_dataset_cva._apply_variant_records([("v1", variant_records)])
+
+        self.assertEqual(female_entry.population_frequency, 0.2)
+        self.assertEqual(male_entry.population_frequency, 0.1)
+        self.assertEqual(female_entry.chromosome, "chr1")
+        self.assertEqual(female_entry.end, 101)
+        self.assertEqual(female_entry.type, "SNV")
+        self.assertEqual(female_entry.consequence_type, "missense_variant")
+        self.assertEqual(female_entry.phylop, 0.5)
+        self.assertIsNone(female_entry.PhastCons)
+        self.assertIsNone(grch37_entry.chromosome)
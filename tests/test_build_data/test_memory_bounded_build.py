@@ -0,0 +1,277 @@
+import os
+import csv
+import json
+import random
+import tempfile
+from unittest import TestCase
+
+from glowingmeme.build_data.build_context import BuildContext
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.build_data.build_dataset_cipapi import BuildDatasetCipapi
+from glowingmeme.build_data.build_dataset_cellbase import BuildDatasetCellbase
+from glowingmeme.build_data.build_spec import TargetDataset
+from glowingmeme.build_data.dataset_store import SQLiteDatasetStore
+from glowingmeme.build_data.hybrid_executor import HybridExecutor
+
+
+class _StubCvaClient:
+    """
+    CVA client serving the cases of the test, and the response bodies of its variants.
+    """
+
+    def __init__(self, cases, variants):
+        self._cases = cases
+        self._variants = variants
+        self.fetched_variant_ids = []
+
+    def cases(self):
+        return self
+
+    def get_cases(self, program, assembly, caseStatuses, include_all, include):
+        return iter(self._cases if caseStatuses == ["ARCHIVED_POSITIVE"] else [])
+
+    def get_variant_body(self, variant_id, include, retries):
+        self.fetched_variant_ids.append(variant_id)
+        variant = self._variants[variant_id]
+        variant_json = {
+            "variants": [
+                {
+                    "assembly": "GRCh38",
+                    "variantType": "SNV",
+                    "annotation": {
+                        "id": variant["rs_id"],
+                        "chromosome": variant["chromosome"],
+                        "start": variant["start"],
+                        "reference": variant["reference"],
+                        "alternate": variant["alternate"],
+                    },
+                }
+            ]
+        }
+        return json.dumps({"response": [{"result": [variant_json]}]}).encode()
+
+
+class _StubCipapiClient:
+    def __init__(self, cases, variants):
+        self._variants_by_case = {
+            "{identifier}-{version}".format(**case): [variants[variant_id] for variant_id in case["allVariants"]]
+            for case in cases
+        }
+        self.fetched_case_ids = []
+
+    def get_case_body(self, case_id, case_version):
+        self.fetched_case_ids.append(case_id)
+        variants = self._variants_by_case["{}-{}".format(case_id, case_version)]
+        case_json = {
+            "interpretation_request_data": {
+                "json_request": {"pedigree": {"members": [{"isProband": True, "participantId": "proband"}]}}
+            },
+            "interpreted_genome": [
+                {
+                    "created_at": "2020-01-01T00:00:00",
+                    "interpreted_genome_data": {
+                        "interpretationService": "genomics_england_tiering",
+                        "variants": [
+                            {
+                                "variantCoordinates": {
+                                    "chromosome": variant["chromosome"],
+                                    "position": variant["start"],
+                                },
+                                "variantCalls": [{"participantId": "proband", "zygosity": "heterozygous"}],
+                                "reportEvents": [{"penetrance": "complete"}],
+                            }
+                            for variant in variants
+                        ],
+                    },
+                }
+            ],
+            "clinical_report": [{"created_at": "2020-01-01T00:00:00"}],
+        }
+        return json.dumps(case_json).encode()
+
+
+class _StubCellbaseClient:
+    """
+    Cellbase client annotating every variant with a CADD score equal to its position, for both the rs_id search and
+    the coordinates annotation calls.
+    """
+
+    def __init__(self, variants):
+        self._variants_by_rs_id = {variant["rs_id"]: variant for variant in variants.values()}
+
+    @staticmethod
+    def _annotate(variant):
+        return {
+            "chromosome": variant["chromosome"],
+            "start": variant["start"],
+            "reference": variant["reference"],
+            "alternate": variant["alternate"],
+            "conservation": [{"source": "gerp", "score": 1.0}],
+            "functionalScore": [{"source": "cadd_scaled", "score": float(variant["start"])}],
+        }
+
+    def search(self, id, include):
+        return [
+            {
+                "result": [
+                    {"id": rs_id, "annotation": self._annotate(self._variants_by_rs_id[rs_id])}
+                    for rs_id in id
+                    if rs_id in self._variants_by_rs_id
+                ]
+            }
+        ]
+
+    def get_annotation(self, coordinate_ids, method, assembly, include):
+        annotations = []
+        for coordinate_id in coordinate_ids:
+            chromosome, start, reference, alternate = coordinate_id.split(":")
+            annotations.append(
+                {
+                    "result": [
+                        self._annotate(
+                            {
+                                "chromosome": chromosome,
+                                "start": int(start),
+                                "reference": reference,
+                                "alternate": alternate,
+                            }
+                        )
+                    ]
+                }
+            )
+        return annotations
+
+
+class TestMemoryBoundedBuild(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.temporary_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_folder.cleanup)
+
+        test_random = random.Random(0)
+        self.variants = {}
+        for variant_number in range(50):
+            reference, alternate = test_random.sample("ACGT", 2)
+            variant_id = "GRCh38:1:{start}:{reference}:{alternate}".format(
+                start=1000 + variant_number, reference=reference, alternate=alternate
+            )
+            self.variants[variant_id] = {
+                "chromosome": "1",
+                "start": 1000 + variant_number,
+                "reference": reference,
+                "alternate": alternate,
+                # a third of the variants are annotated by their coordinates instead of their rs_id
+                "rs_id": "rs{}".format(variant_number) if variant_number % 3 else None,
+            }
+
+        self.cases = []
+        for case_number in range(40):
+            variant_ids = test_random.sample(sorted(self.variants), 5)
+            self.cases.append(
+                {
+                    "identifier": str(case_number),
+                    "version": 1,
+                    "assembly": "GRCh38",
+                    "program": "rare_disease",
+                    "reportedVariants": variant_ids[:1],
+                    "allVariants": variant_ids,
+                }
+            )
+
+        cva_client = _StubCvaClient(self.cases, self.variants)
+        self.shared_clients = {
+            "cva_client": cva_client,
+            "cva_variant_body_client": cva_client,
+            "cipapi_case_body_client": _StubCipapiClient(self.cases, self.variants),
+            "cellbase_client": _StubCellbaseClient(self.variants),
+            "cellbase_variant_client": _StubCellbaseClient(self.variants),
+        }
+
+    def _build(self, file_name, dataset_store=None, request_caches=None):
+        """
+        Runs every stage of a build and saves the dataset of a target made of half of the cases.
+        :param file_name:
+        :param dataset_store:
+        :param request_caches: request caches shared with other builds
+        :return: rows of the saved csv, sorted by case and variant
+        """
+        build_context = BuildContext(
+            hybrid_executor=HybridExecutor(io_workers=1, cpu_workers=1),
+            request_caches=request_caches,
+            shared_clients=self.shared_clients,
+        )
+        try:
+            bd_cva = BuildDatasetCVA(dataset_store=dataset_store, build_context=build_context)
+            bd_cva.build_dataset()
+            bd_cipapi = BuildDatasetCipapi(bd_cva.main_dataset, build_context=build_context)
+            bd_cipapi.build_dataset()
+            bd_cellbase = BuildDatasetCellbase(bd_cipapi.main_dataset, build_context=build_context)
+            bd_cellbase.build_dataset()
+
+            target_case_ids = {"{}-1".format(case_number) for case_number in range(0, 40, 2)}
+            bd_cellbase.save_data_to_csv(file_name, TargetDataset(bd_cellbase.main_dataset, target_case_ids))
+        finally:
+            build_context.close()
+
+        with open(file_name) as dataset_file:
+            return sorted(csv.DictReader(dataset_file), key=lambda row: (row["case_id"], row["id"]))
+
+    def test_build_stays_within_hot_cache(self):
+        dataset_store = SQLiteDatasetStore(os.path.join(self.temporary_folder.name, "store.sqlite"), hot_cache_size=20)
+        self.addCleanup(dataset_store.close)
+        stored_rows = self._build(os.path.join(self.temporary_folder.name, "stored.csv"), dataset_store)
+
+        # 200 entries went through every stage, but never more than the hot cache were in memory at once
+        self.assertEqual(len(dataset_store), 200)
+        self.assertLessEqual(dataset_store.peak_live_entries, 20)
+
+        # and the dataset is the one built in memory
+        in_memory_rows = self._build(os.path.join(self.temporary_folder.name, "in_memory.csv"))
+        self.assertEqual(len(stored_rows), 100)
+        self.assertEqual(stored_rows, in_memory_rows)
+
+        # variants with and without rs_id were all annotated by Cellbase, and filled in by CVA and CIPAPI before
+        for row in stored_rows:
+            self.assertEqual(row["CADD_scaled_score"], str(float(row["start"])))
+            self.assertEqual(row["zygosity_proband"], "heterozygous")
+
+    def test_rebuilds_only_fetch_what_earlier_builds_did_not(self):
+        request_caches = BuildDatasetCVA.create_request_caches(max_age=3600)
+        first_rows = self._build(os.path.join(self.temporary_folder.name, "first.csv"), request_caches=request_caches)
+        cva_client = self.shared_clients["cva_variant_body_client"]
+        cipapi_client = self.shared_clients["cipapi_case_body_client"]
+        self.assertEqual(len(cva_client.fetched_variant_ids), 50)
+        self.assertEqual(len(cipapi_client.fetched_case_ids), 40)
+
+        # a new case with a new variant is the only thing the next build fetches
+        new_variant_id = "GRCh38:2:5000:A:C"
+        self.variants[new_variant_id] = {
+            "chromosome": "2",
+            "start": 5000,
+            "reference": "A",
+            "alternate": "C",
+            "rs_id": "rs5000",
+        }
+        self.cases.append(
+            {
+                "identifier": "40",
+                "version": 1,
+                "assembly": "GRCh38",
+                "program": "rare_disease",
+                "reportedVariants": [new_variant_id],
+                "allVariants": [new_variant_id],
+            }
+        )
+        cva_client.fetched_variant_ids.clear()
+        # the cases of the CIPAPI and Cellbase stubs are set when they are created
+        self.shared_clients["cipapi_case_body_client"] = _StubCipapiClient(self.cases, self.variants)
+        self.shared_clients["cellbase_client"] = _StubCellbaseClient(self.variants)
+
+        second_rows = self._build(os.path.join(self.temporary_folder.name, "second.csv"), request_caches=request_caches)
+        self.assertEqual(cva_client.fetched_variant_ids, [new_variant_id])
+        self.assertEqual(self.shared_clients["cipapi_case_body_client"].fetched_case_ids, ["40"])
+        # case 40 isn't part of the saved target, whose rows are the same
+        self.assertEqual(second_rows, first_rows)
@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from glowingmeme.build_data.sampling import StratifiedCaseSampler
+
+
+class TestStratifiedCaseSampler(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.cases = [
+            (
+                "{}-1".format(case_number),
+                {
+                    "reportedVariants": ["v1"] if case_number % 4 == 0 else [],
+                    "allVariants": ["v{}".format(variant) for variant in range(case_number % 50)],
+                },
+            )
+            for case_number in range(2000)
+        ]
+
+    def _sample(self, cases, seed=0, fraction=0.1):
+        case_sampler = StratifiedCaseSampler(fraction, seed)
+        sampled_case_ids = {
+            case_id
+            for case_id, case in cases
+            if case_sampler.offer(case_id, case, "ARCHIVED_POSITIVE")
+        }
+        sampled_case_ids.update(
+            case_id for case_id, _ in case_sampler.pop_fallback_cases()
+        )
+        return sampled_case_ids, case_sampler.summary()
+
+    def test_sample_is_reproducible(self):
+        sampled_case_ids, summary = self._sample(self.cases)
+        self.assertEqual(sampled_case_ids, self._sample(self.cases[::-1])[0])
+        self.assertNotEqual(sampled_case_ids, self._sample(self.cases, seed=1)[0])
+        self.assertEqual(summary["sampled_cases"], len(sampled_case_ids))
+        self.assertEqual(summary["population_cases"], 2000)
+
+    def test_every_stratum_is_sampled(self):
+        _, summary = self._sample(self.cases, fraction=0.001)
+        for stratum in summary["strata"]:
+            self.assertGreaterEqual(stratum["sampled_cases"], 1)
+
+        # cases without variants fall in their own bucket
+        self.assertEqual(
+            StratifiedCaseSampler.get_stratum({}, "ARCHIVED_NEGATIVE"),
+            ("ARCHIVED_NEGATIVE", StratifiedCaseSampler.NEGATIVE, "0-0"),
+        )
+        self.assertEqual(
+            StratifiedCaseSampler.get_stratum(
+                {"reportedVariants": ["v1"], "allVariants": ["v1", "v2", "v3"]}, "ARCHIVED_POSITIVE"
+            ),
+            ("ARCHIVED_POSITIVE", StratifiedCaseSampler.POSITIVE, "2-3"),
+        )
@@ -0,0 +1,127 @@
+import random
+import tempfile
+from unittest import TestCase
+
+from glowingmeme.build_data.version_store import DatasetVersionStore
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class TestDatasetVersionStore(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.temporary_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_folder.cleanup)
+        self.version_store = DatasetVersionStore(self.temporary_folder.name, snapshot_interval=3)
+
+        # every version removes, changes and adds some entries of the previous one
+        randomizer = random.Random(0)
+        entries = {("case-{}".format(number % 7), "variant-{}".format(number)): "TIER3" for number in range(50)}
+        self.versions = []
+        for version_number in range(7):
+            for key in randomizer.sample(sorted(entries), 5):
+                del entries[key]
+            for key in randomizer.sample(sorted(entries), 5):
+                entries[key] = "TIER{}".format(version_number)
+            for number in range(5):
+                entries[("case-new", "variant-{}-{}".format(version_number, number))] = None
+            self.versions.append(dict(entries))
+            self.version_store.add_version(
+                [
+                    VariantEntryInfo(case_id=case_id, id=variant_id, tier=tier)
+                    for (case_id, variant_id), tier in entries.items()
+                ]
+            )
+
+    def _get_rows(self, entries):
+        return sorted(
+            ["" if value is None else value for value in VariantEntryInfo(case_id=case_id, id=variant_id, tier=tier)]
+            for (case_id, variant_id), tier in entries.items()
+        )
+
+    def test_materialize(self):
+        self.assertEqual(
+            [version["type"] for version in self.version_store.versions],
+            ["snapshot", "delta", "delta", "snapshot", "delta", "delta", "snapshot"],
+        )
+        reopened_version_store = DatasetVersionStore(self.version_store.folder)
+        for version_number, entries in enumerate(self.versions):
+            header, *rows = reopened_version_store.materialize(version_number)
+            self.assertEqual(header, VariantEntryInfo.VARIANT_INFO_VALUES)
+            self.assertEqual(sorted(rows), self._get_rows(entries))
+
+    def test_iter_changes(self):
+        for from_version, to_version in [(0, 1), (1, 2), (4, 5), (3, 5), (1, 5), (2, 6)]:
+            from_entries = self.versions[from_version]
+            to_entries = self.versions[to_version]
+            changes = list(self.version_store.iter_changes(from_version, to_version))
+
+            self.assertEqual(
+                sorted(row for change, row in changes if change == DatasetVersionStore.ADDED),
+                self._get_rows({key: tier for key, tier in to_entries.items() if key not in from_entries}),
+            )
+            self.assertEqual(
+                sorted(row[7] + row[0] for change, row in changes if change == DatasetVersionStore.REMOVED),
+                sorted(
+                    case_id + variant_id
+                    for case_id, variant_id in from_entries
+                    if (case_id, variant_id) not in to_entries
+                ),
+            )
+            self.assertEqual(
+                sorted(row for change, row in changes if change == DatasetVersionStore.CHANGED),
+                self._get_rows(
+                    {
+                        key: tier
+                        for key, tier in to_entries.items()
+                        if key in from_entries and from_entries[key] != tier
+                    }
+                ),
+            )
+
+    def test_entries_sharing_their_key_are_kept(self):
+        version_store = DatasetVersionStore(self.temporary_folder.name + "/duplicates", snapshot_interval=3)
+        versions = [
+            [
+                VariantEntryInfo(case_id="1-1", id="v1", reported_outcome="reported", tier="TIER1"),
+                VariantEntryInfo(case_id="1-1", id="v1", reported_outcome="not_reported", tier="TIER1"),
+                VariantEntryInfo(case_id="1-1", id="v1", reported_outcome="not_reported", tier="TIER3"),
+                VariantEntryInfo(case_id="1-1", id="v2", reported_outcome="not_reported"),
+            ],
+            # the next version drops one of the not reported duplicates and changes the other one
+            [
+                VariantEntryInfo(case_id="1-1", id="v1", reported_outcome="reported", tier="TIER1"),
+                VariantEntryInfo(case_id="1-1", id="v1", reported_outcome="not_reported", tier="TIER2"),
+                VariantEntryInfo(case_id="1-1", id="v2", reported_outcome="not_reported"),
+            ],
+        ]
+        self.assertEqual(version_store.add_version(versions[0])["rows"], 4)
+        version = version_store.add_version(versions[1])
+        self.assertEqual(
+            [version[field] for field in ["type", "rows", "added", "removed", "changed"]], ["delta", 3, 0, 1, 1]
+        )
+
+        for version_number, variant_entries in enumerate(versions):
+            header, *rows = version_store.materialize(version_number)
+            self.assertEqual(
+                sorted(rows),
+                sorted(
+                    ["" if value is None else value for value in variant_entry]
+                    for variant_entry in variant_entries
+                ),
+            )
+
+    def test_ordinals_do_not_depend_on_the_order_of_the_entries(self):
+        version_store = DatasetVersionStore(self.temporary_folder.name + "/ordinals", snapshot_interval=3)
+        variant_entries = [
+            VariantEntryInfo(case_id="1-1", id="v1", reported_outcome="not_reported", tier=tier)
+            for tier in ["TIER1", "TIER2", "TIER3"]
+        ]
+        version_store.add_version(variant_entries)
+
+        # the same entries built in another order make a version without changes
+        version = version_store.add_version(variant_entries[::-1])
+        self.assertEqual([version[field] for field in ["added", "removed", "changed"]], [0, 0, 0])
+        self.assertEqual(list(version_store.iter_changes(0, 1)), [])
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from unittest import TestCase
+from multiprocessing.pool import ThreadPool
+
+from glowingmeme.build_data.work_scheduler import WorkCostHistory, LongestFirstScheduler
+
+
+class TestWorkScheduler(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.history_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.history_folder.cleanup)
+        self.history_file_name = os.path.join(self.history_folder.name, "costs.json")
+        self.sizes = {"small": 1, "medium": 5, "big": 10}
+
+    def test_order_uses_size_without_history(self):
+        scheduler = LongestFirstScheduler()
+        self.assertEqual(
+            scheduler.order(self.sizes, self.sizes.get), ["big", "medium", "small"]
+        )
+
+    def test_order_prefers_recorded_costs(self):
+        cost_history = WorkCostHistory()
+        # small and big took 6 seconds for 11 units of size, so medium is estimated to take about 2.7 seconds
+        cost_history.record("small", 5.0)
+        cost_history.record("big", 1.0)
+
+        scheduler = LongestFirstScheduler(cost_history)
+        self.assertEqual(
+            scheduler.order(self.sizes, self.sizes.get), ["small", "medium", "big"]
+        )
+
+    def test_map_records_every_item(self):
+        scheduler = LongestFirstScheduler()
+        done = []
+        with ThreadPool(2) as pool:
+            scheduler.map(pool, done.append, self.sizes, self.sizes.get)
+
+        self.assertEqual(sorted(done), sorted(self.sizes))
+        for work_item in self.sizes:
+            self.assertIn(work_item, scheduler.cost_history)
+
+    def test_history_is_saved_and_reloaded(self):
+        cost_history = WorkCostHistory(self.history_file_name)
+        cost_history.record("1-1", 2.0)
+        cost_history.save()
+
+        reloaded_history = WorkCostHistory(self.history_file_name)
+        self.assertEqual(reloaded_history.get("1-1"), 2.0)
+        self.assertIsNone(reloaded_history.get("2-1"))
+
+        # without a file nothing is written
+        WorkCostHistory().save()
+        self.assertEqual(os.listdir(self.history_folder.name), ["costs.json"])
+
+    def test_record_keeps_a_moving_average(self):
+        cost_history = WorkCostHistory(smoothing=0.25)
+        cost_history.record("1-1", 10.0)
+        cost_history.record("1-1", 50.0)
+        self.assertEqual(cost_history.get("1-1"), 20.0)
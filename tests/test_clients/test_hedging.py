@@ -0,0 +1,142 @@
+import time
+import threading
+from unittest import TestCase
+
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.clients.hedging import (
+    LatencyTracker,
+    HedgedRequests,
+    RequestTimeoutError,
+    skip_on_request_timeout,
+)
+
+
+class _FakeUpstream:
+    """
+    Upstream call whose requests take the given number of seconds, in order, and then return immediately.
+    """
+
+    def __init__(self, *latencies):
+        self._latencies = list(latencies)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def get(self, item):
+        with self._lock:
+            self.requests += 1
+            request = self.requests
+            latency = self._latencies.pop(0) if self._latencies else 0
+        time.sleep(latency)
+        return item, request
+
+
+class _FakeBuilder:
+    def __init__(self, hedged_requests, upstream):
+        self.hedged_requests = hedged_requests
+        self.upstream = upstream
+        self.timed_out_items = []
+
+    @skip_on_request_timeout
+    def fetch(self, item):
+        return self.hedged_requests.call("upstream.get", self.upstream.get, item)
+
+
+class TestHedging(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.hedged_requests = HedgedRequests(timeout=0.2, hedge_percentile=50)
+        self.addCleanup(self.hedged_requests.close)
+
+    def _warm_up(self, latency):
+        # hedging only starts once enough latencies were measured
+        for _ in range(HedgedRequests._MIN_SAMPLES):
+            self.hedged_requests._get_latency_tracker("upstream.get").record(latency)
+
+    def test_latency_percentile(self):
+        latency_tracker = LatencyTracker(window_size=10)
+        self.assertIsNone(latency_tracker.percentile(50))
+        for latency in range(20):
+            latency_tracker.record(latency)
+
+        # only the last 10 latencies are kept
+        self.assertEqual(len(latency_tracker), 10)
+        self.assertEqual(latency_tracker.percentile(0), 10)
+        self.assertEqual(latency_tracker.percentile(50), 15)
+        self.assertEqual(latency_tracker.percentile(100), 19)
+
+    def test_call_returns_result(self):
+        upstream = _FakeUpstream()
+        self.assertEqual(self.hedged_requests.call("upstream.get", upstream.get, "v1"), ("v1", 1))
+        self.assertEqual(self.hedged_requests.stats()["calls"], 1)
+        self.assertEqual(len(self.hedged_requests._get_latency_tracker("upstream.get")), 1)
+
+    def test_errors_are_raised(self):
+        def fail():
+            raise ValueError("upstream error")
+
+        with self.assertRaises(ValueError):
+            self.hedged_requests.call("upstream.fail", fail)
+
+    def test_slow_call_is_hedged(self):
+        self._warm_up(0.01)
+        upstream = _FakeUpstream(10)
+
+        start_time = time.monotonic()
+        self.assertEqual(self.hedged_requests.call("upstream.get", upstream.get, "v1"), ("v1", 2))
+        self.assertLess(time.monotonic() - start_time, 1)
+        self.assertEqual(
+            self.hedged_requests.stats(), {"calls": 1, "hedged": 1, "hedge_wins": 1, "timeouts": 0}
+        )
+
+    def test_call_times_out(self):
+        upstream = _FakeUpstream(10, 10)
+
+        start_time = time.monotonic()
+        with self.assertRaises(RequestTimeoutError):
+            HedgedRequests(timeout=0.1).call("upstream.get", upstream.get, "v1")
+        self.assertLess(time.monotonic() - start_time, 1)
+
+    def test_timed_out_items_are_skipped_and_kept(self):
+        fake_builder = _FakeBuilder(HedgedRequests(timeout=0.1), _FakeUpstream(10, 0))
+        self.assertIsNone(fake_builder.fetch("v1"))
+        self.assertEqual(fake_builder.fetch("v2"), ("v2", 2))
+        self.assertEqual(fake_builder.timed_out_items, ["v1"])
+        self.assertEqual(fake_builder.hedged_requests.stats()["timeouts"], 1)
+
+        build_dataset = BuildDatasetCVA()
+        build_dataset.timed_out_items = ["v1"]
+        with self.assertLogs("GlowingMeme", level="WARNING") as logs:
+            build_dataset._log_timed_out_items("CVA variants")
+        self.assertIn("1 CVA variants were left without enrichment after timing out: v1", logs.output[0])
+
+    def test_hung_requests_hold_their_slots(self):
+        hedged_requests = HedgedRequests(timeout=0.1, max_workers=1)
+        upstream = _FakeUpstream(10, 0)
+        with self.assertRaises(RequestTimeoutError):
+            hedged_requests.call("upstream.get", upstream.get, "v1")
+
+        # the hung request still holds the only slot, so the next call can't start within its deadline
+        with self.assertRaises(RequestTimeoutError):
+            hedged_requests.call("upstream.get", upstream.get, "v2")
+        self.assertEqual(upstream.requests, 1)
+        self.assertEqual(hedged_requests.stats()["timeouts"], 2)
+
+    def test_close(self):
+        upstream = _FakeUpstream(10)
+        with self.assertRaises(RequestTimeoutError):
+            self.hedged_requests.call("upstream.get", upstream.get, "v1")
+
+        # hung requests run in daemon threads, so they don't keep the process from exiting
+        self.assertTrue(
+            all(
+                thread.daemon
+                for thread in threading.enumerate()
+                if thread.name == "HedgedRequest"
+            )
+        )
+        self.hedged_requests.close()
+        with self.assertRaises(RuntimeError):
+            self.hedged_requests.call("upstream.get", upstream.get, "v2")
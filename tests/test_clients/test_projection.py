@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from glowingmeme.clients.projection import FieldProjection
+
+
+class TestFieldProjection(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.document = {
+            "case_id": "1-1",
+            "files": [{"uri": "/genomes/1.bam"}],
+            "interpreted_genome": [
+                {
+                    "created_at": "2020",
+                    "status": "sent",
+                    "interpreted_genome_data": {
+                        "variants": [{"variantCalls": [{"zygosity": "het"}], "score": 1}]
+                    },
+                },
+                {"created_at": "2021"},
+            ],
+        }
+
+    def test_apply(self):
+        projection = FieldProjection(
+            [
+                "case_id",
+                "interpreted_genome.created_at",
+                "interpreted_genome.interpreted_genome_data.variants.variantCalls",
+                "missing.field",
+            ]
+        )
+        self.assertEqual(
+            projection.apply(self.document),
+            {
+                "case_id": "1-1",
+                "interpreted_genome": [
+                    {
+                        "created_at": "2020",
+                        "interpreted_genome_data": {
+                            "variants": [{"variantCalls": [{"zygosity": "het"}]}]
+                        },
+                    },
+                    {"created_at": "2021"},
+                ],
+            },
+        )
+
+    def test_parent_field_keeps_whole_subtree(self):
+        for fields in [["files", "files.uri"], ["files.uri", "files"]]:
+            self.assertEqual(
+                FieldProjection(fields).apply(self.document),
+                {"files": self.document["files"]},
+            )
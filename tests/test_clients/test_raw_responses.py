@@ -0,0 +1,118 @@
+from unittest import TestCase, mock
+
+from requests import RequestException
+
+from glowingmeme.clients.raw_responses import CvaVariantBodyClient, CipapiCaseBodyClient
+
+
+class _StubResponse:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+
+
+class _StubSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, params, dict(headers)))
+        return self.responses.pop(0)
+
+
+class _StubPyarkVariantsClient:
+    """
+    Lays out its request machinery as pyark's RestClient does, renewing its token and raising a RequestException for
+    the first unauthorised response, and raising for any server error.
+    """
+
+    _BASE_ENDPOINT = "variants"
+
+    def __init__(self, responses):
+        self._session = _StubSession(responses)
+        self._headers = {"Authorization": "Bearer old"}
+
+    def _build_url(self, endpoint):
+        return "https://cva/cva/api/0/" + "/".join(endpoint)
+
+    def _verify_response(self, response, request):
+        if response.status_code in (401, 403):
+            self._headers["Authorization"] = "Bearer new"
+            raise RequestException(response=response)
+        if response.status_code >= 500:
+            raise ValueError("{}: server error".format(request))
+
+
+class _StubPycipapiClient:
+    """
+    Lays out its request machinery as pycipapi's RestClient does.
+    """
+
+    url_base = "https://cipapi"
+    IR_ENDPOINT = "api/2/interpretation-request"
+
+    def __init__(self, content):
+        self.content = content
+        self.calls = []
+
+    @staticmethod
+    def build_url(baseurl, path, *args):
+        return "/".join([baseurl, path] + list(map(str, args)))
+
+    def _request_call(self, method, url, params):
+        self.calls.append((method, url))
+        return _StubResponse(200, self.content)
+
+    def _verify_response(self, response, method=None, **kwargs):
+        return response
+
+
+@mock.patch.object(CvaVariantBodyClient, "_RETRY_WAIT", 0)
+class TestRawResponses(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.variant_body = b'{"response": [{"result": [{"id": "v1"}]}]}'
+
+    def test_variant_body_is_returned_undecoded(self):
+        variants_client = _StubPyarkVariantsClient([_StubResponse(200, self.variant_body)])
+        variant_body = CvaVariantBodyClient(variants_client).get_variant_body(
+            "v1", include=["assembly", "annotation.id"]
+        )
+
+        self.assertEqual(variant_body, self.variant_body)
+        self.assertEqual(
+            variants_client._session.requests,
+            [
+                (
+                    "https://cva/cva/api/0/variants/v1",
+                    {"include": ["assembly", "annotation.id"]},
+                    {"Authorization": "Bearer old"},
+                )
+            ],
+        )
+
+    def test_server_errors_and_token_renewals_are_retried(self):
+        variants_client = _StubPyarkVariantsClient(
+            [_StubResponse(503), _StubResponse(403), _StubResponse(200, self.variant_body)]
+        )
+        self.assertEqual(
+            CvaVariantBodyClient(variants_client).get_variant_body("v1", include=[], retries=2), self.variant_body
+        )
+        # the last request is sent with the renewed token
+        self.assertEqual(variants_client._session.requests[-1][2], {"Authorization": "Bearer new"})
+
+        # once the retries are spent, the server error is raised as pyark raises it
+        variants_client = _StubPyarkVariantsClient([_StubResponse(500), _StubResponse(500)])
+        with self.assertRaises(ValueError):
+            CvaVariantBodyClient(variants_client).get_variant_body("v1", include=[], retries=1)
+
+    def test_case_body_is_returned_undecoded(self):
+        cipapi_client = _StubPycipapiClient(b'{"interpreted_genome": []}')
+        self.assertEqual(CipapiCaseBodyClient(cipapi_client).get_case_body("1", "2"), b'{"interpreted_genome": []}')
+        self.assertEqual(cipapi_client.calls, [("get", "https://cipapi/api/2/interpretation-request/1/2/")])
+
+        self.assertIsNone(CipapiCaseBodyClient(_StubPycipapiClient(b"")).get_case_body("1", "2"))
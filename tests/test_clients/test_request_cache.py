@@ -0,0 +1,83 @@
+import threading
+from unittest import TestCase
+
+from glowingmeme.clients.request_cache import RequestCache
+
+
+class TestRequestCache(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.request_cache = RequestCache(max_size=2)
+
+    def test_lru_bound(self):
+        for key in ["a", "b", "a", "c"]:
+            self.request_cache.get_or_fetch(key, lambda: key.upper())
+
+        self.assertIn("a", self.request_cache)
+        self.assertNotIn("b", self.request_cache)
+        self.assertEqual(self.request_cache.stats()["hits"], 1)
+        self.assertEqual(self.request_cache.stats()["evictions"], 1)
+
+    def test_concurrent_callers_share_one_request(self):
+        calls = []
+        release = threading.Event()
+
+        def slow_fetch():
+            calls.append(1)
+            release.wait()
+            return "value"
+
+        results = []
+        # every caller is started before the fetch is released
+        started = threading.Barrier(5)
+
+        def get():
+            started.wait()
+            results.append(self.request_cache.get_or_fetch("key", slow_fetch))
+
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # callers arriving while the fetch is in flight wait for it, later ones find the cached value
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 4)
+        stats = self.request_cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["coalesced"] + stats["hits"], 3)
+
+    def test_get_many_only_fetches_missing_keys(self):
+        self.request_cache.get_or_fetch("a", lambda: 1)
+        fetched_keys = []
+
+        def fetch_missing(keys):
+            fetched_keys.extend(keys)
+            return {"b": 2}
+
+        results = self.request_cache.get_many_or_fetch(["a", "b", "c"], fetch_missing)
+
+        self.assertEqual(fetched_keys, ["b", "c"])
+        self.assertEqual(results, {"a": 1, "b": 2, "c": None})
+
+    def test_values_older_than_max_age_are_fetched_again(self):
+        now = [0]
+        request_cache = RequestCache(max_age=60, clock=lambda: now[0])
+        request_cache.put("a", 1)
+
+        now[0] = 60
+        self.assertEqual(request_cache.get("a"), 1)
+        self.assertEqual(request_cache.get_or_fetch("a", lambda: 2), 1)
+
+        now[0] = 61
+        self.assertIsNone(request_cache.get("a"))
+        self.assertEqual(request_cache.get_or_fetch("a", lambda: 2), 2)
+        stats = request_cache.stats()
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
@@ -0,0 +1,94 @@
+import threading
+from unittest import TestCase
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from glowingmeme.build_data.build_context import BuildContext
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.clients.transport import HttpTransport
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = str(self.headers.get("Authorization")).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubCvaClient:
+    """
+    Lays out its session as pyark does: one session for the class, used by the main client and by sub clients that
+    are created on demand.
+    """
+
+    _session = requests.Session()
+
+    def __init__(self, url_base):
+        self._url_base = url_base
+        self._session.headers["Authorization"] = "Bearer token"
+
+    def variants(self):
+        return _StubCvaClient(self._url_base)
+
+    def get(self):
+        return self._session.get(self._url_base)
+
+
+class TestHttpTransport(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.http_transport = HttpTransport(pool_size=2)
+
+    def tearDown(self):
+        self.http_transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_pools_are_shared_and_connections_reused(self):
+        sessions = [requests.Session(), requests.Session()]
+        for session in sessions:
+            self.http_transport.mount(session, self.host)
+        self.assertIs(sessions[0].get_adapter(self.host), sessions[1].get_adapter(self.host))
+
+        for _ in range(5):
+            for session in sessions:
+                session.get(self.host).raise_for_status()
+
+        transport_stats = self.http_transport.stats()[self.host]
+        self.assertEqual(transport_stats["requests"], 10)
+        self.assertEqual(transport_stats["connections"], 1)
+        self.assertAlmostEqual(transport_stats["reuse"], 0.9)
+
+    def test_pool_is_only_mounted_for_its_host(self):
+        session = requests.Session()
+        library_adapter = session.get_adapter("https://other.host")
+        self.http_transport.mount(session, self.host)
+
+        self.assertIsNot(session.get_adapter(self.host), library_adapter)
+        self.assertIs(session.get_adapter("https://other.host"), library_adapter)
+
+    def test_builders_send_requests_through_the_pool(self):
+        cva_client = _StubCvaClient(self.host)
+        self.http_transport.mount(cva_client._session, self.host)
+        # the variants client is created by the builder, after the pool was mounted, and keeps the library's login
+        build_dataset = BuildDatasetCVA(
+            build_context=BuildContext(http_transport=self.http_transport, shared_clients={"cva_client": cva_client})
+        )
+        response = build_dataset.cva_variants_client.get()
+        self.assertEqual(response.text, "Bearer token")
+        self.assertEqual(self.http_transport.stats()[self.host]["requests"], 1)
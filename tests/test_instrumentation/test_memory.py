@@ -0,0 +1,60 @@
+import tracemalloc
+from unittest import TestCase
+
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+from glowingmeme.instrumentation.memory import MemoryProfiler
+
+
+class TestMemoryProfiler(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.memory_profiler = MemoryProfiler(max_sampled_entries=100)
+        # the same program string in every entry, but a copy of it in each
+        self.variant_entries = [
+            VariantEntryInfo(
+                id="v{}".format(number),
+                program="".join(["rare ", "disease"]),
+                case_id="1-1",
+            )
+            for number in range(1000)
+        ]
+
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_stage_records_allocations(self):
+        with self.memory_profiler.stage("allocate"):
+            allocated = [bytearray(1024) for _ in range(1000)]
+
+        stage_report = self.memory_profiler.stage_reports["allocate"]
+        self.assertGreater(stage_report["traced_growth_mb"], 0.9)
+        self.assertGreater(stage_report["traced_peak_mb"], 0.9)
+        self.assertGreater(stage_report["peak_rss_mb"], 0)
+        self.assertIn(__file__, stage_report["top_allocations"][0]["location"])
+        self.assertEqual(len(allocated), 1000)
+
+    def test_dataset_fields_are_estimated(self):
+        report = self.memory_profiler.get_report(
+            self.variant_entries, {"cva": {"v1": self.variant_entries[:1]}, "cellbase": None}
+        )
+
+        dataset_report = report["dataset"]
+        self.assertEqual(dataset_report["entries"], 1000)
+        self.assertEqual(dataset_report["sampled_entries"], 100)
+        self.assertEqual(dataset_report["fields"]["rs_id"]["values"], 0)
+
+        program_report = dataset_report["fields"]["program"]
+        self.assertEqual(program_report["values"], 1000)
+        self.assertEqual(program_report["distinct_values"], 1)
+        self.assertGreater(program_report["duplicated_mb"], 0)
+        self.assertEqual(program_report["top_values"][0]["value"], "'rare disease'")
+        self.assertEqual(program_report["top_values"][0]["entries"], 1000)
+
+        # the interned case id literal is a single object, so it has nothing to share
+        self.assertEqual(dataset_report["fields"]["case_id"]["duplicated_mb"], 0)
+        self.assertEqual(dataset_report["fields"]["id"]["top_values"], [])
+        self.assertGreater(report["indexes"]["cva"], 0)
+        self.assertEqual(report["indexes"]["cellbase"], 0)
@@ -0,0 +1,102 @@
+import os
+import time
+import tempfile
+from unittest import TestCase
+
+from glowingmeme.build_data.build_context import BuildContext
+from glowingmeme.build_data.build_dataset_cva import BuildDatasetCVA
+from glowingmeme.build_data.hybrid_executor import HybridExecutor
+from glowingmeme.clients.hedging import HedgedRequests
+from glowingmeme.instrumentation.profiling import StageProfiler, StageTimer, SlowCallLogger
+
+
+def _busy_loop(seconds):
+    end_time = time.monotonic() + seconds
+    while time.monotonic() < end_time:
+        pass
+
+
+def _busy_extract(work_item, payload):
+    _busy_loop(payload)
+    return work_item
+
+
+class _SlowVariantBodyClient:
+    def get_variant_body(self, identifier, include, retries=3):
+        _busy_loop(0.06)
+        return b"{}"
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        profile_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_folder.cleanup)
+        self.profile_folder = profile_folder.name
+        self.stage_profiler = StageProfiler(self.profile_folder, interval=0.001)
+
+    def test_stage_writes_folded_stacks(self):
+        with self.stage_profiler.stage("busy"):
+            _busy_loop(0.1)
+
+        with open(os.path.join(self.profile_folder, "busy.folded")) as folded_file:
+            lines = folded_file.read().splitlines()
+
+        self.assertTrue(lines)
+        self.assertTrue(any("_busy_loop" in line for line in lines))
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+
+    def test_slow_calls_are_counted(self):
+        slow_call_logger = SlowCallLogger(threshold=0.05)
+        with self.assertLogs("GlowingMeme", level="WARNING") as logs:
+            self.assertEqual(slow_call_logger.call("slow", _busy_loop, 0.06), None)
+        slow_call_logger.call("fast", _busy_loop, 0)
+
+        self.assertEqual(slow_call_logger.slow_calls, 1)
+        self.assertIn("slow", logs.output[0])
+
+    def test_stage_hooks_belong_to_one_build(self):
+        stage_timer = StageTimer()
+        build_context = BuildContext([stage_timer])
+        build_dataset = BuildDatasetCVA(build_context=build_context)
+        with build_dataset.build_context.stage("busy"):
+            _busy_loop(0.01)
+        self.assertIn("busy", stage_timer.stage_seconds)
+
+        # builders of another build don't see the hooks, and adding hooks to a build leaves the given list untouched
+        with BuildDatasetCVA().build_context.stage("other"):
+            pass
+        self.assertNotIn("other", stage_timer.stage_seconds)
+        hooks = [stage_timer]
+        BuildContext(hooks).stage_hooks.append(StageTimer())
+        self.assertEqual(hooks, [stage_timer])
+
+    def test_worker_processes_are_sampled(self):
+        hybrid_executor = HybridExecutor(io_workers=1, cpu_workers=1, stage_profiler=self.stage_profiler)
+        self.addCleanup(hybrid_executor.close)
+        with self.stage_profiler.stage("workers"):
+            hybrid_executor.run(["1"], lambda work_item: 0.1, _busy_extract, list)
+
+        with open(os.path.join(self.profile_folder, "workers.folded")) as folded_file:
+            worker_stacks = [line for line in folded_file.read().splitlines() if line.startswith("WorkerProcess;")]
+        self.assertTrue(any("_busy_extract" in line for line in worker_stacks))
+
+    def test_slow_calls_are_logged_with_the_stack_of_the_builder(self):
+        build_dataset = BuildDatasetCVA(
+            build_context=BuildContext(
+                slow_call_logger=SlowCallLogger(threshold=0.05),
+                request_hedger=HedgedRequests(timeout=5),
+                shared_clients={"cva_variant_body_client": _SlowVariantBodyClient()},
+            )
+        )
+        self.addCleanup(build_dataset.build_context.close)
+
+        # the call is sent by a hedging thread, but logged with the stack of the thread waiting for it
+        with self.assertLogs("GlowingMeme", level="WARNING") as logs:
+            build_dataset._fetch_variant("v1")
+        self.assertIn("_fetch_variant", logs.output[0])
@@ -0,0 +1,99 @@
+import json
+import threading
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from glowingmeme.service.dataset_service import DatasetIndex, DatasetService
+from glowingmeme.build_data.variant_entry_info import VariantEntryInfo
+
+
+class TestDatasetService(TestCase):
+    def setUp(self):
+        """
+        This method initializes required objects for class
+        :return:
+        """
+        self.variant_entries = [
+            VariantEntryInfo(
+                id="v1", case_id="1-1", rs_id="rs1", assembly="GRCh38", chromosome="chr1",
+                start=100, end=101, interpretation_message=b"solved",
+            ),
+            VariantEntryInfo(
+                id="v2", case_id="1-1", assembly="GRCh38", chromosome="chr1", start=150, end=400,
+            ),
+            VariantEntryInfo(
+                id="v1", case_id="2-1", rs_id="rs1", assembly="GRCh37", chromosome="chr1",
+                start=90, end=91,
+            ),
+            VariantEntryInfo(id="v3", case_id="2-1", assembly="GRCh38"),
+        ]
+
+    def test_index_lookups(self):
+        dataset_index = DatasetIndex(self.variant_entries)
+        self.assertEqual(dataset_index.size, 4)
+        self.assertEqual(len(dataset_index.get("case_id", "1-1")), 2)
+        self.assertEqual(len(dataset_index.get("rs_id", "rs1")), 2)
+        self.assertEqual(dataset_index.get("id", "unknown"), [])
+
+        # v2 starts before the region but overlaps it
+        self.assertEqual(
+            [variant_entry.id for variant_entry in dataset_index.get_region("1", 200, 300)],
+            ["v2"],
+        )
+        self.assertEqual(
+            [variant_entry.id for variant_entry in dataset_index.get_region("chr1", 91, 150)],
+            ["v1", "v1", "v2"],
+        )
+        self.assertEqual(dataset_index.get_region("chr2", 0, 1000), [])
+
+    def test_api(self):
+        dataset_service = DatasetService(lambda: self.variant_entries)
+        server = dataset_service.create_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}".format(server.server_port)
+
+        try:
+            with self.assertRaises(HTTPError) as error:
+                urlopen(url + "/cases/1-1")
+            self.assertEqual(error.exception.code, 503)
+
+            dataset_service.rebuild()
+            with urlopen(url + "/status") as response:
+                self.assertEqual(json.load(response)["entries"], 4)
+
+            with urlopen(url + "/variants/v1?assembly=GRCh38") as response:
+                lookup = json.load(response)
+            self.assertEqual(lookup["version"], 1)
+            self.assertEqual(len(lookup["entries"]), 1)
+            self.assertEqual(lookup["entries"][0]["case_id"], "1-1")
+            self.assertEqual(lookup["entries"][0]["interpretation_message"], "solved")
+
+            with urlopen(url + "/regions/chr1:0-120") as response:
+                self.assertEqual(len(json.load(response)["entries"]), 2)
+
+            with self.assertRaises(HTTPError) as error:
+                urlopen(url + "/regions/chr1")
+            self.assertEqual(error.exception.code, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_version_is_swapped_with_its_index(self):
+        builds = iter([self.variant_entries, self.variant_entries[:1]])
+        dataset_service = DatasetService(lambda: next(builds))
+        self.assertEqual(dataset_service.status()["version"], 0)
+
+        dataset_service.rebuild()
+        first_index = dataset_service.dataset_index
+        dataset_service.rebuild()
+
+        # a lookup still holding the previous index reports the version of its entries
+        self.assertEqual((first_index.version, first_index.size), (1, 4))
+        self.assertEqual(dataset_service.version, 2)
+        self.assertEqual(dataset_service.status()["entries"], 1)
+
+        # a failed rebuild keeps serving the last version
+        with self.assertLogs("GlowingMeme", level="ERROR"):
+            dataset_service.rebuild()
+        self.assertEqual(dataset_service.version, 2)